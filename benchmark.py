@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import argparse
+import gc
+import ipaddress
+import json
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Collection, Iterable, NamedTuple, Optional, Any
+import ipset
+import ipset_intervals
+import ipset_lookup
+
+
+# IPv4 ranges, roughly: a small country, a mid-size one, CN scale and US scale
+DATASET_SIZES = {
+    "small": 100,
+    "medium": 5_000,
+    "large": 20_000,
+    "xlarge": 80_000,
+}
+
+
+class Dataset(NamedTuple):
+    name: str
+    ipdeny_v4: bytes
+    ipdeny_v6: bytes
+    ripestat: bytes
+    ipdeny_networks: list[ipset.Network]
+    ripestat_networks: list[ipset.Network]
+
+
+class StageResult(NamedTuple):
+    dataset: str
+    stage: str
+    seconds: float
+    peak_bytes: int
+    items: int
+
+
+def generate_ranges(
+        generator: random.Random,
+        count: int,
+        address_bits: int,
+        unit_bits: int,
+) -> list[tuple[int, int]]:
+    # disjoint, non-adjacent ranges made of whole units (e.g. /24 for IPv4)
+    unit_count = 1 << (address_bits - unit_bits)
+    starts = sorted(generator.sample(range(unit_count), count))
+    ranges = []
+    for start, next_start in zip(starts, starts[1:] + [unit_count]):
+        length = min(next_start - start - 1, max(1, int(generator.expovariate(1 / 16))))
+        if length > 0:
+            ranges.append((start << unit_bits, ((start + length) << unit_bits) - 1))
+    return ranges
+
+
+def generate_dataset(name: str, size: int, seed: int = 0) -> Dataset:
+    generator = random.Random(seed)
+    v4_ranges = generate_ranges(generator, size, 32, 8)
+    v6_ranges = generate_ranges(generator, max(1, size // 4), 64, 32)
+    v4_set = ipset.IntervalSet.from_sorted_ranges(4, v4_ranges)
+    v6_set = ipset.IntervalSet.from_sorted_ranges(
+        6, ((first << 64, (last << 64) | (2 ** 64 - 1)) for first, last in v6_ranges)
+    )
+
+    ipdeny_v4 = [str(network) for network in v4_set.networks()]
+    ipdeny_v6 = [str(network) for network in v6_set.networks()]
+
+    # RIPEstat lists the same space unaggregated, as a mix of ranges, networks
+    # and single addresses, with a few entries missing
+    ripestat_v4: list[str] = []
+    for first, last in v4_set:
+        if generator.random() < 0.01:
+            continue
+        if generator.random() < 0.5:
+            ripestat_v4.append(f"{ipaddress.IPv4Address(first)}-{ipaddress.IPv4Address(last)}")
+        else:
+            ripestat_v4.extend(
+                str(network) for network in ipset_intervals.range_networks(4, first, last)
+            )
+    ripestat_v4.extend(
+        str(ipaddress.IPv4Address(first + 1))
+        for first, _ in generator.sample(list(v4_set), len(v4_set) // 100)
+    )
+    generator.shuffle(ripestat_v4)
+    ripestat = {
+        "status": "ok",
+        "status_code": 200,
+        "data_call_status": "supported",
+        "data": {"resources": {"ipv4": ripestat_v4, "ipv6": ipdeny_v6}},
+    }
+
+    dataset = Dataset(
+        name=name,
+        ipdeny_v4="\n".join(ipdeny_v4).encode("ascii"),
+        ipdeny_v6="\n".join(ipdeny_v6).encode("ascii"),
+        ripestat=json.dumps(ripestat).encode("ascii"),
+        ipdeny_networks=[],
+        ripestat_networks=[],
+    )
+    dataset.ipdeny_networks.extend(ipset.parse_ipdeny_v4(dataset.ipdeny_v4))
+    dataset.ipdeny_networks.extend(ipset.parse_ipdeny_v6(dataset.ipdeny_v6))
+    v4_set, v6_set = ipset.parse_ripestat_interval_sets(dataset.ripestat)
+    dataset.ripestat_networks.extend(v4_set.networks())
+    dataset.ripestat_networks.extend(v6_set.networks())
+    return dataset
+
+
+def stages(dataset: Dataset) -> Iterable[tuple[str, Callable[[], Any]]]:
+    ripestat_v4 = json.loads(dataset.ripestat)["data"]["resources"]["ipv4"]
+    common_networks = ipset.compare_networks(
+        dataset.ipdeny_networks, dataset.ripestat_networks
+    ).common_networks
+    country_index = ipset_lookup.CountryIndex.from_networks({"zz": common_networks})
+    generator = random.Random(0)
+    addresses = [
+        str(ipaddress.IPv4Address(generator.getrandbits(32))) for _ in range(len(common_networks))
+    ]
+    yield "parse_ipdeny_v4", lambda: list(ipset.parse_ipdeny_v4(dataset.ipdeny_v4))
+    yield "parse_ipdeny_v6", lambda: list(ipset.parse_ipdeny_v6(dataset.ipdeny_v6))
+    yield "parse_ripestat_v4", lambda: list(ipset.parse_ripestat_v4(dataset.ripestat))
+    yield "parse_ripestat_v6", lambda: list(ipset.parse_ripestat_v6(dataset.ripestat))
+    yield "ripestat_resource_to_networks", lambda: [
+        ipset.ripestat_resource_to_networks(resource) for resource in ripestat_v4
+    ]
+    yield "parse_ripestat_interval_sets", lambda: ipset.parse_ripestat_interval_sets(
+        dataset.ripestat
+    )
+    yield "compare_networks", lambda: ipset.compare_networks(
+        dataset.ipdeny_networks, dataset.ripestat_networks
+    )
+    yield "compare_address_space", lambda: ipset.compare_address_space(
+        dataset.ipdeny_networks, dataset.ripestat_networks
+    )
+    yield "compare_sources", lambda: ipset.compare_sources(
+        [dataset.ipdeny_networks, dataset.ripestat_networks, dataset.ipdeny_networks],
+        ["ipdeny", "ripestat", "ipdeny copy"],
+        2,
+    )
+    yield "ipset_commands", lambda: list(ipset.ipset_commands("zz", common_networks))
+    yield "nft_commands", lambda: list(ipset.nft_commands(
+        (f"country-zz-v{version}", interval_set)
+        for version, interval_set in ipset.network_interval_sets(common_networks).items()
+    ))
+    yield "lookup_addresses", lambda: list(ipset_lookup.lookup_addresses(country_index, addresses))
+
+
+def measure(dataset: Dataset, stage: str, function: Callable[[], Any], repeat: int) -> StageResult:
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    # memory is measured separately, tracing slows down the code considerably
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return StageResult(dataset.name, stage, min(seconds), peak_bytes, count_items(result))
+
+
+def count_items(result: Any) -> int:
+    if hasattr(result, "common_networks"):
+        return len(result.common_networks)
+    if isinstance(result, tuple):
+        return sum(map(len, result))
+    return len(result)
+
+
+def run(
+        dataset_names: Iterable[str],
+        repeat: int = 3,
+        stage_names: Optional[Collection[str]] = None,
+        seed: int = 0,
+) -> Iterable[StageResult]:
+    for dataset_name in dataset_names:
+        dataset = generate_dataset(dataset_name, DATASET_SIZES[dataset_name], seed)
+        for stage, function in stages(dataset):
+            if stage_names is None or stage in stage_names:
+                yield measure(dataset, stage, function, repeat)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, check=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(
+        baseline: Iterable[dict[str, Any]],
+        results: Iterable[StageResult],
+) -> Iterable[str]:
+    baseline_index = {(result["dataset"], result["stage"]): result for result in baseline}
+    for result in results:
+        previous = baseline_index.get((result.dataset, result.stage))
+        if previous is None or not previous["seconds"]:
+            continue
+        yield (
+            f"{result.dataset:8} {result.stage:32} "
+            f"time x{result.seconds / previous['seconds']:.2f} "
+            f"memory x{result.peak_bytes / max(previous['peak_bytes'], 1):.2f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ipset.py pipeline stages on synthetic data."
+    )
+    parser.add_argument(
+        "-d", dest="datasets", action="append", choices=list(DATASET_SIZES), metavar="DATASET",
+        help=f"run only DATASET: {', '.join(DATASET_SIZES)} (can be repeated)"
+    )
+    parser.add_argument(
+        "-s", dest="stages", action="append", metavar="STAGE",
+        help="run only STAGE (can be repeated)"
+    )
+    parser.add_argument(
+        "-r", dest="repeat", type=int, default=3, metavar="N",
+        help="best of N timing runs (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="random seed for the synthetic data (default: %(default)s)"
+    )
+    parser.add_argument(
+        "-c", dest="baseline", type=argparse.FileType("r"), metavar="FILE",
+        help="compare against results previously saved to FILE"
+    )
+    args = parser.parse_args()
+    results = list(run(args.datasets or list(DATASET_SIZES), args.repeat, args.stages, args.seed))
+    if args.baseline:
+        baseline = json.load(args.baseline)["results"]
+        for line in compare_results(baseline, results):
+            print(line, file=sys.stderr)
+    json.dump(
+        {
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "seed": args.seed,
+            "results": [result._asdict() for result in results],
+        },
+        sys.stdout,
+        indent=1,
+    )
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
 
+# pylint: disable=too-many-lines; the data sources, comparisons, set formats and
+# outputs look each other up in this module's namespace (where tests patch them)
+# and are kept together with the command line program; self-contained
+# subsystems are in the ipset_* modules imported below, which have to be
+# installed next to this file
+
 import ipaddress
 import string
 import itertools
@@ -8,13 +14,78 @@ import urllib.parse
 import urllib.request
 import urllib.error
 import time
-import http.client
+import sys
+import os.path
+import concurrent.futures
+import hashlib
+import bisect
+import heapq
+import math
+import re
+import contextlib
+import copy
+import subprocess
 from http import HTTPStatus
-from typing import Iterable, Mapping, Collection, NamedTuple, Union, Optional, Any
+from typing import (
+    Iterable, Iterator, Mapping, Collection, Sequence, NamedTuple,
+    Optional, Any, Callable, ContextManager, TextIO, IO, cast,
+)
 import argparse
+from ipset_intervals import (
+    Network, NETWORK_CLASSES, ADDRESS_CLASSES, ADDRESS_LENGTHS, IntervalSet,
+    network_to_range, network_interval_sets, group_networks_by_version,
+)
+from ipset_metrics import Metrics, measure_stage, count_metric
+from ipset_history import HistoryStore, parse_history_time
+from ipset_http import (
+    UrlCache, HttpClient, write_file_atomically, read_url, install_url_cache, installed_url_cache,
+    install_http_client, installed_http_client,
+)
+from ipset_delegated import (
+    DelegatedStats, load_delegated_stats, install_delegated_stats, installed_delegated_stats,
+    get_delegated_stats,
+)
+from ipset_snapshot import (
+    SNAPSHOT_MAGIC, Snapshot, snapshot_bytes, pack_addresses, unpack_addresses,
+)
+from ipset_lookup import CountryIndex, lookup_addresses
+from ipset_daemon import RefreshDaemon, RefreshOptions, RefreshResult
+
+
+IPSET_FAMILIES = {
+    4: "inet",
+    6: "inet6",
+}
+
+SOURCE_NAMES = {
+    "ipdeny": "IPdeny",
+    "ripestat": "RIPEstat",
+    "delegated": "RIR statistics",
+}
 
+NFT_TYPES = {
+    4: "ipv4_addr",
+    6: "ipv6_addr",
+}
+NFT_DEFAULT_TABLE = "country"
+# elements per `add element` command, keeps lines of large sets short
+NFT_ELEMENTS_PER_COMMAND = 1024
 
-Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+IPSET_DEFAULT_HASHSIZE = 1024
+IPSET_DEFAULT_MAXELEM = 65536
+IPSET_DEFAULT_HEADROOM = 25
+DELTA_STATE_ERROR = (
+    "a delta session lists only changes and can't be used as the previous state, "
+    "use the output of `ipset save` or keep the previous full session"
+)
+
+
+class SizingOptions(NamedTuple):
+    # percent of entries added to the size of the hash
+    headroom: float = IPSET_DEFAULT_HEADROOM
+    # only a limit, `create -exist` fails if an existing set has a different
+    # one, so it stays the same between runs instead of following the entries
+    maxelem: int = IPSET_DEFAULT_MAXELEM
 
 
 class ComparisionResult(NamedTuple):
@@ -22,14 +93,17 @@ class ComparisionResult(NamedTuple):
     ipdeny_missing: Collection[Network]
     ripestat_missing: Collection[Network]
     differences_count: int
+    # display names of the compared sources, the first one takes the IPdeny role
+    source_names: tuple[str, str] = ("IPdeny", "RIPEstat")
 
     def describe(self) -> Iterable[str]:
+        first, second = self.source_names
         if self.ripestat_missing:
-            yield "networks present in IPdeny but not in RIPEstat: " + ", ".join(
+            yield f"networks present in {first} but not in {second}: " + ", ".join(
                 map(str, self.ripestat_missing)
             )
         if self.ipdeny_missing:
-            yield "networks present in RIPEstat but not in IPdeny: " + ", ".join(
+            yield f"networks present in {second} but not in {first}: " + ", ".join(
                 map(str, self.ipdeny_missing)
             )
         yield f"total number of differences: {self.differences_count}"
@@ -71,35 +145,58 @@ def parse_ipdeny_v6(text_input: bytes) -> Iterable[ipaddress.IPv6Network]:
 
 def list_ripestat(country_code: str) -> Iterable[Network]:
     response = read_url(get_ripestat_url(country_code))
-    v4_networks = parse_ripestat_v4(response)
-    v6_networks = parse_ripestat_v6(response)
-
     # RIPEstat data is not aggregated, needs collapsing
-    v4_networks = ipaddress.collapse_addresses(v4_networks)
-    v6_networks = ipaddress.collapse_addresses(v6_networks)
-
-    yield from v4_networks
-    yield from v6_networks
+    v4_set, v6_set = parse_ripestat_interval_sets(response)
+    yield from v4_set.networks()
+    yield from v6_set.networks()
 
 
 def get_ripestat_url(country_code: str) -> str:
     return f"https://stat.ripe.net/data/country-resource-list/data.json?resource={country_code}"
 
 
-def parse_ripestat_v4(json_input: bytes) -> Iterable[ipaddress.IPv4Network]:
-    response = json.loads(json_input)
-    check_ripestat_response(response)
-    return itertools.chain.from_iterable(
+def parse_ripestat(
+        json_input: bytes,
+) -> tuple[Iterable[ipaddress.IPv4Network], Iterable[ipaddress.IPv6Network]]:
+    v4_resources, v6_resources = parse_ripestat_resources(json_input)
+    v4_networks = itertools.chain.from_iterable(
         ripestat_resource_to_networks(input_network)
-        for input_network in response["data"]["resources"]["ipv4"]
+        for input_network in v4_resources
+    )
+    v6_networks = (
+        ipaddress.IPv6Network(input_network)
+        for input_network in v6_resources
     )
+    return v4_networks, v6_networks
 
 
-def parse_ripestat_v6(json_input: bytes) -> Iterable[ipaddress.IPv6Network]:
+def parse_ripestat_interval_sets(json_input: bytes) -> tuple["IntervalSet", "IntervalSet"]:
+    # converts all resources to integer ranges in one pass, without creating
+    # intermediate network objects, and collapses them
+    v4_resources, v6_resources = parse_ripestat_resources(json_input)
+    v4_set = IntervalSet.from_ranges(4, map(ripestat_resource_to_range, v4_resources))
+    v6_set = IntervalSet.from_ranges(
+        6,
+        (network_to_range(ipaddress.IPv6Network(input_network)) for input_network in v6_resources),
+    )
+    return v4_set, v6_set
+
+
+def parse_ripestat_resources(json_input: bytes) -> tuple[Collection[str], Collection[str]]:
+    # decodes and validates the response once for both IP versions
     response = json.loads(json_input)
     check_ripestat_response(response)
-    for input_network in response["data"]["resources"]["ipv6"]:
-        yield ipaddress.IPv6Network(input_network)
+    resources = response["data"]["resources"]
+    count_metric("entries", len(resources["ipv4"]) + len(resources["ipv6"]))
+    return resources["ipv4"], resources["ipv6"]
+
+
+def parse_ripestat_v4(json_input: bytes) -> Iterable[ipaddress.IPv4Network]:
+    return parse_ripestat(json_input)[0]
+
+
+def parse_ripestat_v6(json_input: bytes) -> Iterable[ipaddress.IPv6Network]:
+    return parse_ripestat(json_input)[1]
 
 
 def check_ripestat_response(response: Any) -> None:
@@ -123,96 +220,1390 @@ def check_ripestat_response(response: Any) -> None:
 
 
 def ripestat_resource_to_networks(network_spec: str) -> Iterable[ipaddress.IPv4Network]:
+    first, last = ripestat_resource_to_range(network_spec)
+    return list(ipaddress.summarize_address_range(
+        ipaddress.IPv4Address(first), ipaddress.IPv4Address(last)
+    ))
 
-    def range_to_networks(network_range: str) -> Iterable[ipaddress.IPv4Network]:
-        parts = network_range.split("-")
-        if len(parts) != 2:
-            raise ValueError
-        first = ipaddress.IPv4Address(parts[0])
-        last = ipaddress.IPv4Address(parts[1])
-        return ipaddress.summarize_address_range(first, last)
 
-    try:
-        return [ipaddress.IPv4Network(network_spec)]
-    except ipaddress.AddressValueError:
-        try:
-            return range_to_networks(network_spec)
-        except ValueError:
-            pass
-        raise
+def ripestat_resource_to_range(network_spec: str) -> tuple[int, int]:
+    # resources are either networks (CIDR or single addresses) or address
+    # ranges (first-last)
+    first_spec, separator, last_spec = network_spec.partition("-")
+    if not separator:
+        return network_to_range(ipaddress.IPv4Network(network_spec))
+    first = int(ipaddress.IPv4Address(first_spec))
+    last = int(ipaddress.IPv4Address(last_spec))
+    if first > last:
+        raise ipaddress.AddressValueError(f"invalid address range: {network_spec}")
+    return first, last
+
+
+def list_delegated(country_code: str) -> Iterable[Network]:
+    return get_delegated_stats().networks(country_code)
+
+
+def get_source(source_name: str) -> Callable[[str], Iterable[Network]]:
+    sources = {
+        "ipdeny": list_ipdeny,
+        "ripestat": list_ripestat,
+        "delegated": list_delegated,
+    }
+    return sources[source_name]
 
 
-def read_url(url: str) -> bytes:
-    response : http.client.HTTPResponse
-    with urllib.request.urlopen(url) as response:
-        if response.getcode() != HTTPStatus.OK:
-            raise ValueError(f"unexpected HTTP code: {response.getcode()}")
-        return response.read()
+def parse_sources(text_input: str) -> tuple[str, ...]:
+    source_names = tuple(source.strip().lower() for source in text_input.split(","))
+    for source_name in source_names:
+        if source_name not in SOURCE_NAMES:
+            raise ValueError(
+                f"invalid source '{source_name}', use one of: {', '.join(SOURCE_NAMES)}"
+            )
+    if len(source_names) < 2 or len(set(source_names)) != len(source_names):
+        raise ValueError("at least two different sources are required")
+    return source_names
 
 
-def list_networks(country_code: str, max_diff: int = 0) -> Iterable[Network]:
+def list_networks(
+        country_code: str,
+        max_diff: int = 0,
+        space_limit: Optional["AddressSpaceLimit"] = None,
+) -> Iterable[Network]:
     ipdeny_networks = list_ipdeny(country_code)
     ripestat_networks = list_ripestat(country_code)
-    comparision = compare_networks(ipdeny_networks, ripestat_networks)
+    return select_networks(ipdeny_networks, ripestat_networks, max_diff, space_limit)
+
+
+def select_networks(
+        ipdeny_networks: Iterable[Network],
+        ripestat_networks: Iterable[Network],
+        max_diff: int = 0,
+        space_limit: Optional["AddressSpaceLimit"] = None,
+        source_names: tuple[str, str] = ("ipdeny", "ripestat"),
+) -> Collection[Network]:
+    display_names = (SOURCE_NAMES[source_names[0]], SOURCE_NAMES[source_names[1]])
+    if space_limit is not None:
+        space_comparision = compare_address_space(
+            ipdeny_networks, ripestat_networks
+        )._replace(source_names=display_names)
+        count_metric("common", len(space_comparision.common_networks))
+        count_metric("ipdeny_missing", len(space_comparision.ipdeny_missing))
+        count_metric("ripestat_missing", len(space_comparision.ripestat_missing))
+        if space_comparision.exceeds(space_limit):
+            raise ValueError("\n".join(space_comparision.describe()))
+        return space_comparision.common_networks
+    comparision = compare_networks(
+        ipdeny_networks, ripestat_networks
+    )._replace(source_names=display_names)
+    count_metric("common", len(comparision.common_networks))
+    count_metric("ipdeny_missing", len(comparision.ipdeny_missing))
+    count_metric("ripestat_missing", len(comparision.ripestat_missing))
     if comparision.differences_count > max_diff:
         raise ValueError("\n".join(comparision.describe()))
     return comparision.common_networks
 
 
+class BatchResult(NamedTuple):
+    country_code: str
+    networks: Collection[Network]
+    error: Optional[Exception]
+    # commands of a full session, if already rendered by a worker process
+    session: Optional[str] = None
+
+
+class GenerationOptions(NamedTuple):
+    max_diff: int = 0
+    space_limit: Optional["AddressSpaceLimit"] = None
+    max_overshoot: Optional[float] = None
+    sources: tuple[str, ...] = ("ipdeny", "ripestat")
+    # number of sources that have to contain an address, all if not set
+    quorum: Optional[int] = None
+    # address space removed from all sets, see parse_allow_list()
+    allowed_sets: Optional[Mapping[int, "IntervalSet"]] = None
+    # percent of entries that may be added to reduce distinct prefix lengths
+    shaping_budget: Optional[float] = None
+    # records source and generated networks of each refresh
+    history: Optional["HistoryStore"] = None
+
+
+def list_networks_batch(
+        country_codes: Iterable[str],
+        options: GenerationOptions = GenerationOptions(),
+        max_workers: int = 8,
+        metrics: Optional["Metrics"] = None,
+) -> Iterable[BatchResult]:
+
+    def download(
+            source: Callable[[str], Iterable[Network]],
+            source_name: str,
+            country_code: str,
+    ) -> list[Network]:
+        with measure_stage(metrics, country_code, "download", source_name):
+            networks = list(source(country_code))
+            count_metric("networks", len(networks))
+        return networks
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        downloads = [
+            (
+                country_code,
+                [
+                    executor.submit(download, get_source(source_name), source_name, country_code)
+                    for source_name in options.sources
+                ],
+            )
+            for country_code in country_codes
+        ]
+        for country_code, futures in downloads:
+            try:
+                networks = process_networks(
+                    country_code,
+                    [future.result() for future in futures],
+                    options,
+                    metrics,
+                )
+            except Exception as error: # pylint: disable=broad-except; reported per country
+                yield BatchResult(country_code, [], error)
+            else:
+                yield BatchResult(country_code, networks, None)
+
+
+def process_networks(
+        country_code: str,
+        source_networks: Sequence[Iterable[Network]],
+        options: GenerationOptions,
+        metrics: Optional["Metrics"] = None,
+) -> Collection[Network]:
+    if options.history is not None:
+        source_networks = [list(networks) for networks in source_networks]
+        for source_name, networks in zip(options.sources, source_networks):
+            with measure_stage(metrics, country_code, "history", source_name):
+                options.history.record(country_code, networks, source_name)
+    with measure_stage(metrics, country_code, "compare"):
+        if len(options.sources) == 2 and options.quorum in (None, 2):
+            networks = select_networks(
+                source_networks[0],
+                source_networks[1],
+                options.max_diff,
+                options.space_limit,
+                (options.sources[0], options.sources[1]),
+            )
+        else:
+            networks = select_networks_quorum(source_networks, options)
+    if options.max_overshoot is not None:
+        with measure_stage(metrics, country_code, "minimize"):
+            networks = minimize_networks(networks, options.max_overshoot).networks
+    if options.allowed_sets is not None:
+        with measure_stage(metrics, country_code, "allow"):
+            networks = subtract_networks(networks, options.allowed_sets).networks
+    if options.shaping_budget is not None:
+        with measure_stage(metrics, country_code, "shape"):
+            networks = shape_prefix_lengths(networks, options.shaping_budget).networks
+    if options.history is not None:
+        with measure_stage(metrics, country_code, "history"):
+            options.history.record(country_code, networks)
+    return networks
+
+
+def list_networks_parallel(
+        country_codes: Iterable[str],
+        options: GenerationOptions = GenerationOptions(),
+        processes: Optional[int] = None,
+        sizing: Optional[SizingOptions] = None,
+        metrics: Optional["Metrics"] = None,
+) -> Iterable[BatchResult]:
+    # Same as list_networks_batch(), but each country is downloaded, compared
+    # and, if `sizing` is given, rendered to a full session in a pool of
+    # worker processes (one per CPU by default), so that CPU bound work isn't
+    # serialized by the GIL. Workers send back networks in packed form.
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=initialize_worker,
+            initargs=(installed_http_client(), installed_url_cache(), installed_delegated_stats()),
+    ) as executor:
+        collect_metrics = metrics is not None
+        futures = [
+            (
+                country_code,
+                executor.submit(build_country, country_code, options, sizing, collect_metrics),
+            )
+            for country_code in country_codes
+        ]
+        for country_code, future in futures:
+            try:
+                result, metric_records = future.result()
+            except Exception as error: # pylint: disable=broad-except; e.g. a killed worker
+                yield BatchResult(country_code, [], error)
+                continue
+            if metrics is not None:
+                with metrics.lock:
+                    metrics.records.extend(metric_records)
+            yield result
+
+
+def initialize_worker(
+        http_client: HttpClient,
+        url_cache: Optional[UrlCache],
+        delegated_stats: Optional[DelegatedStats],
+) -> None:
+    # the arguments are not pickled when worker processes are forked, copies
+    # make sure that connections and locks of the parent are not shared
+    install_http_client(copy.copy(http_client))
+    install_url_cache(copy.copy(url_cache))
+    install_delegated_stats(delegated_stats)
+
+
+def build_country(
+        country_code: str,
+        options: GenerationOptions,
+        sizing: Optional[SizingOptions],
+        collect_metrics: bool,
+) -> tuple[BatchResult, list[dict[str, Any]]]:
+    metrics = Metrics() if collect_metrics else None
+    result = next(iter(list_networks_batch([country_code], options, len(options.sources), metrics)))
+    if result.error is not None:
+        # not every exception can be pickled, only the message is needed
+        return BatchResult(country_code, [], Exception(str(result.error))), []
+    session = None
+    if sizing is not None:
+        with measure_stage(metrics, country_code, "render"):
+            commands = list(ipset_commands(country_code, result.networks, sizing))
+            count_metric("commands", len(commands))
+            session = "".join(command + "\n" for command in commands)
+    return (
+        BatchResult(country_code, PackedNetworks(result.networks), None, session),
+        metrics.records if metrics is not None else [],
+    )
+
+
+class PackedNetworks:
+    # Networks of a country as packed addresses (the same format as in
+    # snapshots) and prefix lengths per IP version, to be cheaply passed
+    # between processes. The networks are unpacked on iteration.
+
+    def __init__(self, networks: Iterable[Network]) -> None:
+        self.packed = {
+            version: (
+                pack_addresses(version, (int(network.network_address) for network in networks)),
+                bytes(network.prefixlen for network in networks),
+            )
+            for version, networks in group_networks_by_version(networks).items()
+        }
+
+    def __len__(self) -> int:
+        return sum(len(prefixlens) for _, prefixlens in self.packed.values())
+
+    def __iter__(self) -> Iterator[Network]:
+        for version, (addresses, prefixlens) in self.packed.items():
+            yield from map(
+                NETWORK_CLASSES[version],
+                zip(unpack_addresses(version, memoryview(addresses)), prefixlens),
+            )
+
+    def __contains__(self, network: object) -> bool:
+        return any(network == other for other in self)
+
+
 def compare_networks(
         ipdeny_networks: Iterable[Network],
         ripestat_networks: Iterable[Network],
 ) -> ComparisionResult:
-    ipdeny_networks = frozenset(ipdeny_networks)
-    ripestat_networks = frozenset(ripestat_networks)
+    # networks are compared by identity (same address and prefix length), on
+    # integer keys instead of hashed ipaddress objects
+    ipdeny_index = index_networks(ipdeny_networks)
+    ripestat_index = index_networks(ripestat_networks)
+    common_networks: list[Network] = []
+    ipdeny_missing: list[Network] = []
+    ripestat_missing: list[Network] = []
+    for version in (4, 6):
+        ipdeny_keys = ipdeny_index[version].keys()
+        ripestat_keys = ripestat_index[version].keys()
+        common_networks.extend(
+            ipdeny_index[version][key] for key in sorted(ipdeny_keys & ripestat_keys)
+        )
+        ipdeny_missing.extend(
+            ripestat_index[version][key] for key in sorted(ripestat_keys - ipdeny_keys)
+        )
+        ripestat_missing.extend(
+            ipdeny_index[version][key] for key in sorted(ipdeny_keys - ripestat_keys)
+        )
     return ComparisionResult(
-        common_networks=ipdeny_networks & ripestat_networks,
-        ipdeny_missing=ripestat_networks - ipdeny_networks,
-        ripestat_missing=ipdeny_networks - ripestat_networks,
-        differences_count=len(ipdeny_networks ^ ripestat_networks),
+        common_networks=common_networks,
+        ipdeny_missing=ipdeny_missing,
+        ripestat_missing=ripestat_missing,
+        differences_count=len(ipdeny_missing) + len(ripestat_missing),
     )
 
 
-def ipset_commands(country_code: str, networks: Iterable[Network]) -> Iterable[str]:
-    version_family_map = {
-        4: "inet",
-        6: "inet6",
-    }
-    networks_grouped_by_version: dict[int, list[Network]] = {
-        4: [],
-        6: [],
+class AddressSpaceLimit(NamedTuple):
+    value: float
+    relative: bool
+
+    def exceeded(self, differences_size: int, total_size: int) -> bool:
+        if self.relative:
+            return differences_size > self.value / 100 * total_size
+        return differences_size > self.value
+
+
+def parse_address_space_limit(limit: str) -> AddressSpaceLimit:
+    relative = limit.endswith("%")
+    try:
+        value = float(limit[:-1] if relative else limit)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise ValueError(
+            f"invalid address space limit '{limit}', "
+            "use a number of addresses or a percentage, e.g. 256 or 0.5%"
+        )
+    return AddressSpaceLimit(value, relative)
+
+
+class AddressSpaceComparisionResult(NamedTuple):
+    common_networks: Collection[Network]
+    ipdeny_missing: Collection[Network]
+    ripestat_missing: Collection[Network]
+    differences_sizes: Mapping[int, int]
+    total_sizes: Mapping[int, int]
+    source_names: tuple[str, str] = ("IPdeny", "RIPEstat")
+
+    def exceeds(self, limit: AddressSpaceLimit) -> bool:
+        # address counts of different IP versions are not comparable, so the
+        # limit applies to each version separately
+        return any(
+            limit.exceeded(self.differences_sizes[version], self.total_sizes[version])
+            for version in self.differences_sizes
+        )
+
+    def describe(self) -> Iterable[str]:
+        first, second = self.source_names
+        if self.ripestat_missing:
+            yield f"address space present in {first} but not in {second}: " + ", ".join(
+                map(str, self.ripestat_missing)
+            )
+        if self.ipdeny_missing:
+            yield f"address space present in {second} but not in {first}: " + ", ".join(
+                map(str, self.ipdeny_missing)
+            )
+        for version, differences_size in self.differences_sizes.items():
+            total_size = self.total_sizes[version]
+            percentage = differences_size / total_size * 100 if total_size else 0
+            yield (
+                f"IPv{version} differences: {differences_size} addresses "
+                f"({percentage:.2f}% of {total_size})"
+            )
+
+
+def compare_address_space(
+        ipdeny_networks: Iterable[Network],
+        ripestat_networks: Iterable[Network],
+) -> AddressSpaceComparisionResult:
+    # compares covered address ranges, so that differently aggregated networks
+    # (e.g. a /23 vs. two /24) are not counted as differences
+    ipdeny_sets = network_interval_sets(ipdeny_networks)
+    ripestat_sets = network_interval_sets(ripestat_networks)
+    common_networks: list[Network] = []
+    ipdeny_missing: list[Network] = []
+    ripestat_missing: list[Network] = []
+    differences_sizes = {}
+    total_sizes = {}
+    for version in (4, 6):
+        ipdeny_set = ipdeny_sets[version]
+        ripestat_set = ripestat_sets[version]
+        ipdeny_missing_set = ripestat_set - ipdeny_set
+        ripestat_missing_set = ipdeny_set - ripestat_set
+        common_networks.extend((ipdeny_set & ripestat_set).networks())
+        ipdeny_missing.extend(ipdeny_missing_set.networks())
+        ripestat_missing.extend(ripestat_missing_set.networks())
+        differences_sizes[version] = (
+            ipdeny_missing_set.address_count() + ripestat_missing_set.address_count()
+        )
+        total_sizes[version] = (ipdeny_set | ripestat_set).address_count()
+    return AddressSpaceComparisionResult(
+        common_networks=common_networks,
+        ipdeny_missing=ipdeny_missing,
+        ripestat_missing=ripestat_missing,
+        differences_sizes=differences_sizes,
+        total_sizes=total_sizes,
+    )
+
+
+class QuorumComparisionResult(NamedTuple):
+    common_networks: Collection[Network]
+    source_names: Sequence[str]
+    quorum: int
+    # per source and IP version: address space present in the source but not
+    # accepted, and accepted but not present in the source
+    extra_sets: Sequence[Mapping[int, "IntervalSet"]]
+    missing_sets: Sequence[Mapping[int, "IntervalSet"]]
+    total_sizes: Mapping[int, int]
+
+    def differences_sizes(self, index: int) -> dict[int, int]:
+        return {
+            version: extra_set.address_count()
+            + self.missing_sets[index][version].address_count()
+            for version, extra_set in self.extra_sets[index].items()
+        }
+
+    def differences_count(self, index: int) -> int:
+        return sum(
+            len(list(interval_set.networks()))
+            for interval_sets in (self.extra_sets[index], self.missing_sets[index])
+            for interval_set in interval_sets.values()
+        )
+
+    def agrees(
+            self,
+            index: int,
+            max_diff: int = 0,
+            space_limit: Optional[AddressSpaceLimit] = None,
+    ) -> bool:
+        if space_limit is None:
+            return self.differences_count(index) <= max_diff
+        return not any(
+            space_limit.exceeded(differences_size, self.total_sizes[version])
+            for version, differences_size in self.differences_sizes(index).items()
+        )
+
+    def describe(self) -> Iterable[str]:
+        yield f"addresses present in at least {self.quorum} of {len(self.source_names)} sources"
+        for index, source_name in enumerate(self.source_names):
+            for version, differences_size in self.differences_sizes(index).items():
+                if not differences_size:
+                    continue
+                extra_set = self.extra_sets[index][version]
+                missing_set = self.missing_sets[index][version]
+                yield (
+                    f"{source_name} IPv{version}: {extra_set.address_count()} addresses "
+                    f"not accepted ({', '.join(map(str, extra_set.networks())) or '-'}), "
+                    f"{missing_set.address_count()} accepted addresses missing "
+                    f"({', '.join(map(str, missing_set.networks())) or '-'})"
+                )
+
+
+def compare_sources(
+        source_networks: Sequence[Iterable[Network]],
+        source_names: Sequence[str],
+        quorum: int,
+) -> QuorumComparisionResult:
+    if not 1 <= quorum <= len(source_networks):
+        raise ValueError(f"invalid quorum {quorum} for {len(source_networks)} sources")
+    source_sets = [network_interval_sets(networks) for networks in source_networks]
+    common_networks: list[Network] = []
+    extra_sets: list[dict[int, IntervalSet]] = [{} for _ in source_sets]
+    missing_sets: list[dict[int, IntervalSet]] = [{} for _ in source_sets]
+    total_sizes = {}
+    for version in (4, 6):
+        accepted_set, version_extra_sets, version_missing_sets = quorum_interval_sets(
+            [interval_sets[version] for interval_sets in source_sets], quorum
+        )
+        common_networks.extend(accepted_set.networks())
+        for index, (extra_set, missing_set) in enumerate(
+                zip(version_extra_sets, version_missing_sets)
+        ):
+            extra_sets[index][version] = extra_set
+            missing_sets[index][version] = missing_set
+        total_sizes[version] = IntervalSet.from_ranges(
+            version, heapq.merge(*(interval_sets[version] for interval_sets in source_sets))
+        ).address_count()
+    return QuorumComparisionResult(
+        common_networks=common_networks,
+        source_names=source_names,
+        quorum=quorum,
+        extra_sets=extra_sets,
+        missing_sets=missing_sets,
+        total_sizes=total_sizes,
+    )
+
+
+def quorum_interval_sets(
+        source_sets: Sequence["IntervalSet"],
+        quorum: int,
+) -> tuple["IntervalSet", list["IntervalSet"], list["IntervalSet"]]:
+    # A single sweep over the merged range boundaries of all sources, which
+    # are already sorted, instead of pairwise set operations. Between two
+    # boundaries the set of sources containing the addresses is constant.
+    accepted_ranges = []
+    extra_ranges: list[list[tuple[int, int]]] = [[] for _ in source_sets]
+    missing_ranges: list[list[tuple[int, int]]] = [[] for _ in source_sets]
+    active = [False] * len(source_sets)
+    active_count = 0
+    start = 0
+    for position, events in itertools.groupby(
+            range_boundaries(source_sets), key=lambda boundary: boundary[0]
+    ):
+        if active_count >= quorum:
+            accepted_ranges.append((start, position - 1))
+            for index, source_active in enumerate(active):
+                if not source_active:
+                    missing_ranges[index].append((start, position - 1))
+        elif active_count:
+            for index, source_active in enumerate(active):
+                if source_active:
+                    extra_ranges[index].append((start, position - 1))
+        for _, index, starts in events:
+            active[index] = starts
+            active_count += 1 if starts else -1
+        start = position
+    version = source_sets[0].version
+    return (
+        IntervalSet.from_sorted_ranges(version, accepted_ranges),
+        [IntervalSet.from_sorted_ranges(version, ranges) for ranges in extra_ranges],
+        [IntervalSet.from_sorted_ranges(version, ranges) for ranges in missing_ranges],
+    )
+
+
+def range_boundaries(source_sets: Sequence["IntervalSet"]) -> Iterator[tuple[int, int, bool]]:
+    # (address, source index, range starts) of all sources, in address order
+
+    def boundaries(index: int, source_set: IntervalSet) -> Iterator[tuple[int, int, bool]]:
+        for first, last in source_set:
+            yield first, index, True
+            yield last + 1, index, False
+
+    return heapq.merge(*itertools.starmap(boundaries, enumerate(source_sets)))
+
+
+def select_networks_quorum(
+        source_networks: Sequence[Iterable[Network]],
+        options: GenerationOptions,
+) -> Collection[Network]:
+    # fails unless at least quorum sources agree with the accepted networks
+    # within the -i / -a limit, so that a few broken sources can't shrink them
+    quorum = len(source_networks) if options.quorum is None else options.quorum
+    comparision = compare_sources(
+        source_networks, [SOURCE_NAMES[name] for name in options.sources], quorum
+    )
+    count_metric("common", len(comparision.common_networks))
+    agreeing = 0
+    for index, source_name in enumerate(options.sources):
+        count_metric(f"{source_name}_differences", comparision.differences_count(index))
+        agreeing += comparision.agrees(index, options.max_diff, options.space_limit)
+    if agreeing < quorum:
+        raise ValueError("\n".join((
+            *comparision.describe(),
+            f"sources within the difference limit: {agreeing}, required: {quorum}",
+        )))
+    return comparision.common_networks
+
+
+def index_networks(networks: Iterable[Network]) -> dict[int, dict[int, Network]]:
+    # a key packs the first address and the prefix length of a network into a
+    # single integer, sorting keys sorts networks the same way as ipaddress does
+    index: dict[int, dict[int, Network]] = {
+        4: {},
+        6: {},
     }
     for network in networks:
-        networks_grouped_by_version[network.version].append(network)
-    for version, version_networks in networks_grouped_by_version.items():
-        family = version_family_map[version]
+        index[network.version][int(network.network_address) << 8 | network.prefixlen] = network
+    return index
+
+
+class MinimizationResult(NamedTuple):
+    networks: Collection[Network]
+    saved_entries: int
+    added_sizes: Mapping[int, int]
+
+
+def minimize_networks(networks: Iterable[Network], max_overshoot: float = 0) -> MinimizationResult:
+    # Collapses networks to their minimal CIDR cover. With a non-zero
+    # max_overshoot, networks are also merged into a covering prefix if
+    # addresses outside of the set make up at most max_overshoot percent of it.
+    networks = list(networks)
+    minimized_networks: list[Network] = []
+    added_sizes = {}
+    for version, interval_set in network_interval_sets(networks).items():
+        version_networks = list(interval_set.networks())
+        if max_overshoot > 0:
+            version_networks = list(merge_networks(version, version_networks, max_overshoot / 100))
+        added_sizes[version] = (
+            IntervalSet.from_networks(version, version_networks).address_count()
+            - interval_set.address_count()
+        )
+        minimized_networks.extend(version_networks)
+    saved_entries = len(networks) - len(minimized_networks)
+    count_metric("saved_entries", saved_entries)
+    for version, added_size in added_sizes.items():
+        count_metric(f"added_addresses_v{version}", added_size)
+    return MinimizationResult(minimized_networks, saved_entries, added_sizes)
+
+
+class SubtractionResult(NamedTuple):
+    networks: Collection[Network]
+    removed_sizes: Mapping[int, int]
+
+
+def subtract_networks(
+        networks: Iterable[Network],
+        allowed_sets: Mapping[int, "IntervalSet"],
+) -> SubtractionResult:
+    # Removes allowed address space, splitting only the overlapping networks
+    # into the minimal CIDR cover of what remains of them, so that the others
+    # (e.g. merged by minimize_networks) are kept as they are.
+    remaining_networks: list[Network] = []
+    removed_sizes = {}
+    for version, version_networks in group_networks_by_version(networks).items():
+        allowed_set = allowed_sets.get(version, IntervalSet(version))
+        version_remaining_networks: list[Network] = []
+        overlapping_ranges = []
+        for network in version_networks:
+            network_range = network_to_range(network)
+            if allowed_set.overlaps(*network_range):
+                overlapping_ranges.append(network_range)
+            else:
+                version_remaining_networks.append(network)
+        overlapping_set = IntervalSet.from_ranges(version, overlapping_ranges)
+        remaining_set = overlapping_set - allowed_set
+        removed_sizes[version] = overlapping_set.address_count() - remaining_set.address_count()
+        version_remaining_networks.extend(remaining_set.networks())
+        remaining_networks.extend(sorted(version_remaining_networks))
+    for version, removed_size in removed_sizes.items():
+        count_metric(f"allowed_addresses_v{version}", removed_size)
+    return SubtractionResult(remaining_networks, removed_sizes)
+
+
+class ShapingResult(NamedTuple):
+    networks: Collection[Network]
+    # distinct prefix lengths per IP version, i.e. hash:net probes per lookup
+    probes_before: Mapping[int, int]
+    probes_after: Mapping[int, int]
+    added_entries: int
+
+
+def shape_prefix_lengths(networks: Iterable[Network], budget: float = 0) -> ShapingResult:
+    # A hash:net lookup probes the hash once for each distinct prefix length in
+    # the set. Splitting networks into longer prefixes that are in the set
+    # anyway reduces the number of lengths without changing the address space,
+    # at the cost of up to budget percent more entries per set.
+    shaped_networks: list[Network] = []
+    probes_before = {}
+    probes_after = {}
+    added_entries = 0
+    for version, version_networks in group_networks_by_version(networks).items():
+        histogram: dict[int, int] = {}
+        for network in version_networks:
+            histogram[network.prefixlen] = histogram.get(network.prefixlen, 0) + 1
+        target_lengths = choose_prefix_lengths(
+            histogram, math.floor(len(version_networks) * budget / 100)
+        )
+        for network in version_networks:
+            target_length = target_lengths[network.prefixlen]
+            if target_length == network.prefixlen:
+                shaped_networks.append(network)
+            else:
+                shaped_networks.extend(network.subnets(new_prefix=target_length))
+        probes_before[version] = len(histogram)
+        probes_after[version] = len(set(target_lengths.values()))
+        added_entries += sum(
+            count * ((1 << (target_lengths[length] - length)) - 1)
+            for length, count in histogram.items()
+        )
+    for version, probes in probes_before.items():
+        count_metric(f"probes_before_v{version}", probes)
+        count_metric(f"probes_after_v{version}", probes_after[version])
+    count_metric("shaped_entries", added_entries)
+    return ShapingResult(shaped_networks, probes_before, probes_after, added_entries)
+
+
+def choose_prefix_lengths(histogram: Mapping[int, int], max_added: int) -> dict[int, int]:
+    # Maps each prefix length to the one its networks are split into, using as
+    # few distinct lengths as possible (then as few entries as possible) with
+    # at most max_added more entries. Networks of a length are split into the
+    # next longer chosen length, the longest length is always chosen.
+    # best[j][k]: (added entries, previous chosen index) with k lengths chosen
+    # up to lengths[j], which is chosen
+    lengths = sorted(histogram)
+    best: list[dict[int, tuple[int, int]]] = []
+    for j, length in enumerate(lengths):
+        best_j: dict[int, tuple[int, int]] = {}
+        for i in range(j - 1, -2, -1):
+            added = sum(
+                histogram[lengths[t]] * ((1 << (length - lengths[t])) - 1)
+                for t in range(i + 1, j)
+            )
+            if added > max_added:
+                # splitting even more lengths only costs more
+                break
+            for k, (previous_added, _) in (best[i] if i >= 0 else {0: (0, -1)}).items():
+                if previous_added + added <= max_added \
+                        and previous_added + added < best_j.get(k + 1, (max_added + 1, -1))[0]:
+                    best_j[k + 1] = (previous_added + added, i)
+        best.append(best_j)
+    target_lengths = {}
+    if lengths:
+        j, k = len(lengths) - 1, min(best[-1])
+        while j >= 0:
+            previous_j = best[j][k][1]
+            for t in range(previous_j + 1, j + 1):
+                target_lengths[lengths[t]] = lengths[j]
+            j, k = previous_j, k - 1
+    return target_lengths
+
+
+def parse_allow_list(text_input: str) -> list[Network]:
+    # one network or address per line, comments start with #
+    networks = []
+    for line_number, line in enumerate(text_input.splitlines(), 1):
+        network_spec = line.split("#", 1)[0].strip()
+        if not network_spec:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(network_spec))
+        except ValueError as value_error:
+            raise ValueError(f"allow list line {line_number}: {value_error}") from value_error
+    return networks
+
+
+def merge_networks(
+        version: int,
+        networks: Sequence[Network],
+        max_foreign_ratio: float,
+) -> Iterable[Network]:
+    # Top-down over the (compressed) prefix tree of sorted, disjoint networks:
+    # the smallest prefix covering a run of networks replaces the run if its
+    # share of addresses not covered by the run is small enough, otherwise the
+    # run is split in two halves of that prefix.
+    network_class = NETWORK_CLASSES[version]
+    max_prefixlen = ADDRESS_LENGTHS[version]
+    firsts = [int(network.network_address) for network in networks]
+    lasts = [first | int(network.hostmask) for first, network in zip(firsts, networks)]
+    covered_sizes = list(itertools.accumulate(
+        (last - first + 1 for first, last in zip(firsts, lasts)), initial=0
+    ))
+
+    def merge(start: int, stop: int) -> Iterable[Network]:
+        if stop - start == 1:
+            yield networks[start]
+            return
+        host_bits = (firsts[start] ^ lasts[stop - 1]).bit_length()
+        prefix_first = firsts[start] >> host_bits << host_bits
+        foreign_size = (1 << host_bits) - (covered_sizes[stop] - covered_sizes[start])
+        if foreign_size <= max_foreign_ratio * (1 << host_bits):
+            yield network_class((prefix_first, max_prefixlen - host_bits))
+            return
+        middle = bisect.bisect_left(firsts, prefix_first + (1 << (host_bits - 1)), start, stop)
+        yield from merge(start, middle)
+        yield from merge(middle, stop)
+
+    if networks:
+        yield from merge(0, len(networks))
+
+
+def ipset_commands(
+        country_code: str,
+        networks: Iterable[Network],
+        sizing: SizingOptions = SizingOptions(),
+        previous_state: Optional["IpsetState"] = None,
+) -> Iterable[str]:
+    for version, version_networks in group_networks_by_version(networks).items():
         set_name = create_target_set_name(country_code, version)
-        tmp_set_name = create_temporary_set_name(country_code, version)
-        header = (
-            f"create -exist {set_name} hash:net family {family}",
-            f"create {tmp_set_name} hash:net family {family}",
+        existing_options = previous_state.options.get(set_name) if previous_state else None
+        yield from ipset_swap_commands(
+            set_name, version, version_networks, sizing, existing_options
+        )
+
+
+def ipset_swap_commands(
+        set_name: str,
+        version: int,
+        networks: Collection[Network],
+        sizing: SizingOptions = SizingOptions(),
+        existing_options: Optional[Mapping[str, int]] = None,
+) -> Iterable[str]:
+    check_set_size(set_name, len(networks), sizing.maxelem)
+    family = IPSET_FAMILIES[version]
+    sorted_networks = sorted(networks)
+    # The temporary set is named after its entries, so that the session is
+    # reproducible. A set left over by an interrupted restore of the same
+    # entries has the same options and is reused after flushing it.
+    tmp_set_name = temporary_set_name(set_name, networks_digest(sorted_networks))
+    options = ipset_create_options(len(networks), sizing)
+    header = (
+        f"create -exist {set_name} hash:net family {family}"
+        + format_ipset_options(target_create_options(options, existing_options)),
+        f"create -exist {tmp_set_name} hash:net family {family}" + format_ipset_options(options),
+        f"flush {tmp_set_name}",
+    )
+    footer = (
+        f"swap {set_name} {tmp_set_name}",
+        f"destroy {tmp_set_name}",
+    )
+    commands = (
+        f"add {tmp_set_name} {network}"
+        for network in sorted_networks
+    )
+    yield from itertools.chain(header, commands, footer)
+
+
+def check_set_sizes(sets: Mapping[str, Collection[Network]], maxelem: int) -> None:
+    for set_name, networks in sets.items():
+        check_set_size(set_name, len(networks), maxelem)
+
+
+def check_set_size(set_name: str, entry_count: int, maxelem: int) -> None:
+    # otherwise `ipset restore` fails at the first entry over the limit
+    if entry_count > maxelem:
+        raise ValueError(
+            f"set {set_name} has {entry_count} entries, more than maxelem {maxelem} "
+            "(see --maxelem)"
+        )
+
+
+def ipset_group_commands(
+        group_name: str,
+        networks: Iterable[Network],
+        sizing: SizingOptions = SizingOptions(),
+        list_set: bool = False,
+        previous_state: Optional["IpsetState"] = None,
+) -> Iterable[str]:
+    # a single set per IP version for networks of many countries, unioned and
+    # collapsed, so that one rule can match all of them
+    for version, interval_set in network_interval_sets(networks).items():
+        set_name = create_group_set_name(group_name, version)
+        existing_options = previous_state.options.get(set_name) if previous_state else None
+        yield from ipset_swap_commands(
+            set_name, version, list(interval_set.networks()), sizing, existing_options
         )
-        footer = (
-            f"swap {set_name} {tmp_set_name}",
-            f"destroy {tmp_set_name}",
+    if list_set:
+        list_set_name = create_group_set_name(group_name)
+        yield f"create -exist {list_set_name} list:set"
+        for version in IPSET_FAMILIES:
+            yield f"add -exist {list_set_name} {create_group_set_name(group_name, version)}"
+
+
+def ipset_create_options(
+        entry_count: int,
+        sizing: SizingOptions = SizingOptions(),
+) -> dict[str, int]:
+    # Sizes the hash for the expected number of entries, so that it doesn't
+    # have to be resized while restoring and its buckets stay short. Powers of
+    # two keep the values stable between runs. Kernel defaults are omitted.
+    capacity = next_power_of_two(math.ceil(entry_count * (1 + sizing.headroom / 100)))
+    options = {}
+    if capacity > IPSET_DEFAULT_HASHSIZE:
+        options["hashsize"] = capacity
+    if sizing.maxelem != IPSET_DEFAULT_MAXELEM:
+        options["maxelem"] = sizing.maxelem
+    return options
+
+
+def target_create_options(
+        options: Mapping[str, int],
+        existing_options: Optional[Mapping[str, int]],
+) -> dict[str, int]:
+    # `create -exist` fails if the existing set has a different maxelem
+    # (hashsize is not compared, it changes when a set is resized), so the
+    # target set is declared with the maxelem it already has. The swap then
+    # replaces it with the newly sized temporary set.
+    if existing_options is None:
+        maxelem = options.get("maxelem", IPSET_DEFAULT_MAXELEM)
+    else:
+        maxelem = existing_options.get("maxelem", IPSET_DEFAULT_MAXELEM)
+    return {} if maxelem == IPSET_DEFAULT_MAXELEM else {"maxelem": maxelem}
+
+
+def format_ipset_options(options: Mapping[str, int]) -> str:
+    return "".join(f" {name} {value}" for name, value in options.items())
+
+
+def next_power_of_two(number: int) -> int:
+    return 1 << max(number - 1, 0).bit_length()
+
+
+def ipset_delta_commands(
+        country_code: str,
+        networks: Iterable[Network],
+        previous_state: "IpsetState",
+        max_change_ratio: float = 0.5,
+        sizing: SizingOptions = SizingOptions(),
+) -> Iterable[str]:
+    for version, version_networks in group_networks_by_version(networks).items():
+        set_name = create_target_set_name(country_code, version)
+        existing_options = previous_state.options.get(set_name)
+        if set_name not in previous_state.entries:
+            yield from ipset_swap_commands(
+                set_name, version, version_networks, sizing, existing_options
+            )
+            continue
+        current = frozenset(version_networks)
+        previous = frozenset(previous_state.entries[set_name])
+        removed = sorted(previous - current)
+        added = sorted(current - previous)
+        # sets of a state without options were created as configured
+        maxelem = (existing_options or {}).get("maxelem", sizing.maxelem)
+        if len(removed) + len(added) > max_change_ratio * max(len(current), 1) \
+                or len(current) > maxelem:
+            # a full rebuild is cheaper than a long list of changes, and it
+            # replaces a set created with a smaller maxelem than configured
+            yield from ipset_swap_commands(
+                set_name, version, version_networks, sizing, existing_options
+            )
+            continue
+        yield (
+            f"create -exist {set_name} hash:net family {IPSET_FAMILIES[version]}"
+            + format_ipset_options(target_create_options(
+                ipset_create_options(len(current), sizing), existing_options
+            ))
         )
-        commands = (
-            f"add {tmp_set_name} {network}"
-            for network in sorted(version_networks)
+        yield from (f"del -exist {set_name} {network}" for network in removed)
+        yield from (f"add -exist {set_name} {network}" for network in added)
+
+
+def nft_commands(
+        sets: Iterable[tuple[str, "IntervalSet"]],
+        table: str = NFT_DEFAULT_TABLE,
+) -> Iterable[str]:
+    # An `nft -f` script, which is applied as one atomic transaction. Each set
+    # is (re)declared, flushed and filled with its ranges, which are sorted,
+    # disjoint and not adjacent, so there is nothing for auto-merge to merge.
+    # Sets are rendered one by one, as they are consumed.
+    yield f"add table inet {table}"
+    for set_name, interval_set in sets:
+        yield (
+            f"add set inet {table} {set_name} "
+            f"{{ type {NFT_TYPES[interval_set.version]}; flags interval; auto-merge; }}"
         )
-        yield from itertools.chain(header, commands, footer)
+        yield f"flush set inet {table} {set_name}"
+        elements = (nft_element(interval_set.version, first, last) for first, last in interval_set)
+        while chunk := list(itertools.islice(elements, NFT_ELEMENTS_PER_COMMAND)):
+            yield f"add element inet {table} {set_name} {{ {', '.join(chunk)} }}"
+
+
+def nft_element(version: int, first: int, last: int) -> str:
+    address_class = ADDRESS_CLASSES[version]
+    size = last - first + 1
+    if size == 1:
+        return str(address_class(first))
+    if size & (size - 1) == 0 and first % size == 0:
+        return f"{address_class(first)}/{ADDRESS_LENGTHS[version] - size.bit_length() + 1}"
+    return f"{address_class(first)}-{address_class(last)}"
+
+
+class IpsetState(NamedTuple):
+    entries: Mapping[str, Collection[Network]]
+    options: Mapping[str, Mapping[str, int]]
+
+
+def parse_ipset_state(text_input: str) -> IpsetState:
+    # Accepts both full generated sessions and `ipset save` dumps. Swaps and
+    # destroys are replayed, so that the entries of a generated temporary set
+    # end up in its target set. Temporary sets that are still there, e.g. left
+    # over by a failed restore in an `ipset save` dump, are not live and are
+    # skipped.
+    entries: dict[str, set[Network]] = {}
+    options: dict[str, dict[str, int]] = {}
+    # e.g. list:set groups, their members are set names
+    other_sets = set()
+    # target sets declared by a generated session, which must be swapped
+    declared_sets = set()
+    for line in text_input.splitlines():
+        parts = line.split()
+        if not parts or parts[0] not in ("create", "add", "del", "swap", "destroy"):
+            continue
+        arguments = [part for part in parts[1:] if not part.startswith("-")]
+        if not arguments:
+            raise ValueError(f"invalid ipset command: {line}")
+        set_name = arguments[0]
+        if parts[0] == "create" and arguments[1:2] != ["hash:net"]:
+            other_sets.add(set_name)
+        if set_name in other_sets:
+            continue
+        # a delta session lists only the changes of the live sets
+        if parts[0] == "del" or (parts[0] == "add" and "-exist" in parts):
+            raise ValueError(DELTA_STATE_ERROR)
+        if parts[0] == "create":
+            entries.setdefault(set_name, set())
+            options[set_name] = {
+                name: int(value)
+                for name, value in zip(arguments, arguments[1:])
+                if name in ("hashsize", "maxelem")
+            }
+            if "-exist" in parts and not is_temporary_set_name(set_name):
+                declared_sets.add(set_name)
+        else:
+            replay_ipset_command(parts[0], arguments, line, entries, options)
+            if parts[0] == "swap":
+                declared_sets.discard(set_name)
+    if declared_sets:
+        raise ValueError(DELTA_STATE_ERROR)
+    return IpsetState(
+        {name: networks for name, networks in entries.items() if not is_temporary_set_name(name)},
+        {name: values for name, values in options.items() if not is_temporary_set_name(name)},
+    )
+
+
+def replay_ipset_command(
+        command: str,
+        arguments: Sequence[str],
+        line: str,
+        entries: dict[str, set[Network]],
+        options: dict[str, dict[str, int]],
+) -> None:
+    if len(arguments) < 2 and command in ("add", "swap"):
+        raise ValueError(f"invalid ipset command: {line}")
+    set_name = created_set(entries, arguments[0], line)
+    if command == "add":
+        entries[set_name].add(ipaddress.ip_network(arguments[1]))
+    elif command == "swap":
+        other_name = created_set(entries, arguments[1], line)
+        entries[set_name], entries[other_name] = entries[other_name], entries[set_name]
+        options[set_name], options[other_name] = options[other_name], options[set_name]
+    else:
+        del entries[set_name]
+        del options[set_name]
+
+
+def created_set(entries: Mapping[str, Collection[Network]], set_name: str, line: str) -> str:
+    if set_name not in entries:
+        raise ValueError(f"set {set_name} is not created: {line}")
+    return set_name
+
+
+def is_temporary_set_name(set_name: str) -> bool:
+    return ".tmp-" in set_name
+
+
+def parse_ipset_entries(text_input: str) -> Mapping[str, Collection[Network]]:
+    return parse_ipset_state(text_input).entries
 
 
 def create_target_set_name(country_code: str, version: int) -> str:
     return f"country-{country_code}-v{version}"
 
 
-def create_temporary_set_name(country_code: str, version: int) -> str:
-    return f"country-{country_code}-v{version}.tmp-{time.strftime('%y%m%d%H%M%S', time.gmtime())}"
+def create_temporary_set_name(
+        country_code: str,
+        version: int,
+        networks: Iterable[Network] = (),
+) -> str:
+    return temporary_set_name(
+        create_target_set_name(country_code, version), networks_digest(networks)
+    )
+
+
+def temporary_set_name(set_name: str, digest: str) -> str:
+    return f"{set_name}.tmp-{digest[:12]}"
+
+
+def networks_digest(networks: Iterable[Network]) -> str:
+    # of the entries of a single set, regardless of their order and of how
+    # `ipset save` writes single addresses
+    digest = hashlib.sha256()
+    for network in sorted(networks):
+        digest.update(f"{network}\n".encode("ascii"))
+    return digest.hexdigest()
+
+
+def create_group_set_name(group_name: str, version: Optional[int] = None) -> str:
+    if version is None:
+        return f"group-{group_name}"
+    return f"group-{group_name}-v{version}"
+
+
+def normalize_group_name(group_name: str) -> str:
+    # set names are limited to 31 characters, including the temporary suffix
+    if re.fullmatch("[a-z0-9]{1,5}", group_name.lower()):
+        return group_name.lower()
+    raise ValueError(
+        f"invalid group name '{group_name}', use 1 to 5 letters or digits"
+    )
+
+
+def write_snapshot(filename: str, results: Iterable["BatchResult"], sources: Sequence[str]) -> None:
+    country_networks = {
+        result.country_code: result.networks for result in results if result.error is None
+    }
+    write_file_atomically(filename, snapshot_bytes(country_networks, {"sources": list(sources)}))
+
+
+def snapshot_ipset_state(snapshot: Snapshot) -> "IpsetState":
+    # set sizes are not known, as if the sets were created with defaults
+    entries = {}
+    for country_code in snapshot.country_codes():
+        for version, interval_set in snapshot.interval_sets(country_code).items():
+            entries[create_target_set_name(country_code, version)] = list(
+                interval_set.networks()
+            )
+    return IpsetState(entries, {})
+
+
+def read_previous_state(filename: str, allow_snapshot: bool = False) -> "IpsetState":
+    if filename == "-":
+        content = sys.stdin.buffer.read()
+    else:
+        with open(filename, "rb") as previous_file:
+            content = previous_file.read()
+    if content.startswith(SNAPSHOT_MAGIC):
+        # merged address ranges, not the entries loaded in the sets (e.g. after
+        # prefix shaping), so deltas against them would delete the wrong entries
+        if not allow_snapshot:
+            raise ValueError(
+                "a snapshot can only be used with -d for --lookup, "
+                "use the output of `ipset save` or a previous full session"
+            )
+        return snapshot_ipset_state(Snapshot(content))
+    return parse_ipset_state(content.decode("ascii"))
+
+
+def history_results(
+        history: HistoryStore,
+        country_codes: Iterable[str],
+        timestamp: float,
+) -> Iterable["BatchResult"]:
+    for country_code in country_codes:
+        try:
+            state = history.state(country_code, timestamp)
+        except ValueError as error:
+            yield BatchResult(country_code, [], error)
+            continue
+        networks = [
+            network for interval_set in state.values() for network in interval_set.networks()
+        ]
+        yield BatchResult(country_code, networks, None)
+
+
+def session_sets(country_code: str, networks: Iterable[Network]) -> dict[str, list[Network]]:
+    return {
+        create_target_set_name(country_code, version): version_networks
+        for version, version_networks in group_networks_by_version(networks).items()
+    }
+
+
+def group_session_sets(group_name: str, networks: Iterable[Network]) -> dict[str, list[Network]]:
+    return {
+        create_group_set_name(group_name, version): list(interval_set.networks())
+        for version, interval_set in network_interval_sets(networks).items()
+    }
+
+
+def manifest_entry(sets: Mapping[str, Iterable[Network]]) -> dict[str, Any]:
+    set_digests = {set_name: networks_digest(networks) for set_name, networks in sets.items()}
+    return {
+        "sha256": hashlib.sha256(
+            json.dumps(set_digests, sort_keys=True).encode("ascii")
+        ).hexdigest(),
+        "sets": set_digests,
+    }
+
+
+def manifest_bytes(results: Iterable["BatchResult"], group_name: Optional[str] = None) -> bytes:
+    # Content hashes of the sets of each generated session, keyed by the
+    # session name (country code or group set name). Sessions that failed are
+    # left out. There is no timestamp, so that unchanged data gives an
+    # identical manifest.
+    results = list(results)
+    sessions = {}
+    if group_name is not None:
+        if all(result.error is None for result in results):
+            sessions[create_group_set_name(group_name)] = manifest_entry(group_session_sets(
+                group_name,
+                itertools.chain.from_iterable(result.networks for result in results),
+            ))
+    else:
+        for result in results:
+            if result.error is None:
+                sessions[result.country_code] = manifest_entry(
+                    session_sets(result.country_code, result.networks)
+                )
+    return (json.dumps({"sessions": sessions}, sort_keys=True, indent=1) + "\n").encode("ascii")
+
+
+def parse_manifest(text_input: str) -> Mapping[str, Mapping[str, str]]:
+    try:
+        sessions = json.loads(text_input)["sessions"]
+        return {name: dict(entry["sets"]) for name, entry in sessions.items()}
+    except (ValueError, TypeError, KeyError, AttributeError) as error:
+        raise ValueError(f"invalid manifest: {error!r}") from error
+
+
+def stale_sessions(
+        manifest_sets: Mapping[str, Mapping[str, str]],
+        state: "IpsetState",
+) -> Iterable[str]:
+    # sessions whose sets are missing from the state or have other entries
+    for name, set_digests in manifest_sets.items():
+        if any(
+                set_name not in state.entries or networks_digest(state.entries[set_name]) != digest
+                for set_name, digest in set_digests.items()
+        ):
+            yield name
+
+
+def ipset_restore(commands: Iterable[str], ipset_binary: str = "ipset") -> None:
+    # Commands are streamed to the process as they are rendered, the session
+    # is never held in memory. Restore stops at the first failed command.
+    with subprocess.Popen(
+            [ipset_binary, "restore"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+    ) as process:
+        stdin = cast(IO[str], process.stdin)
+        try:
+            for command in commands:
+                stdin.write(command + "\n")
+                count_metric("commands", 1)
+        except BrokenPipeError:
+            # restore exited early, the reason is in stderr
+            pass
+        except BaseException:
+            process.kill()
+            raise
+        _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise ValueError(
+            f"ipset restore failed: {stderr.strip() or f'exit status {process.returncode}'}"
+        )
+
+
+def run_ipset(arguments: Sequence[str], ipset_binary: str = "ipset") -> str:
+    completed = subprocess.run(
+        [ipset_binary, *arguments], capture_output=True, text=True, check=False
+    )
+    if completed.returncode != 0:
+        raise ValueError(f"ipset {' '.join(arguments)} failed: {completed.stderr.strip()}")
+    return completed.stdout
+
+
+def remove_temporary_sets(set_names: Iterable[str], ipset_binary: str = "ipset") -> list[str]:
+    # left over by failed or interrupted restores
+    prefixes = tuple(f"{set_name}.tmp-" for set_name in set_names)
+    leftover_sets = [
+        set_name
+        for set_name in run_ipset(["list", "-n"], ipset_binary).split()
+        if set_name.startswith(prefixes)
+    ]
+    for set_name in leftover_sets:
+        run_ipset(["destroy", set_name], ipset_binary)
+        count_metric("leftover_sets", 1)
+    return leftover_sets
+
+
+class SetVerification(NamedTuple):
+    set_name: str
+    # intended, but not loaded
+    missing: "IntervalSet"
+    # loaded, but not intended
+    unexpected: "IntervalSet"
+
+    def describe(self) -> Iterable[str]:
+        for description, interval_set in (
+                ("missing from", self.missing),
+                ("unexpected in", self.unexpected),
+        ):
+            if interval_set:
+                networks = list(itertools.islice(interval_set.networks(), 11))
+                yield (
+                    f"{interval_set.address_count()} addresses {description} "
+                    f"the loaded set {self.set_name}: "
+                    + ", ".join(map(str, networks[:10]))
+                    + (", ..." if len(networks) > 10 else "")
+                )
+
+
+def verify_sets(
+        sets: Mapping[str, Iterable[Network]],
+        ipset_binary: str = "ipset",
+) -> Iterable[SetVerification]:
+    # loaded sets are compared by address space, the same space loaded as
+    # other networks is fine
+    loaded_set_names = set(run_ipset(["list", "-n"], ipset_binary).split())
+    for set_name, networks in sets.items():
+        version = set_name_version(set_name)
+        loaded_networks: Collection[Network] = ()
+        if set_name in loaded_set_names:
+            loaded_networks = parse_ipset_state(
+                run_ipset(["save", set_name], ipset_binary)
+            ).entries.get(set_name, ())
+        intended = IntervalSet.from_networks(version, networks)
+        loaded = IntervalSet.from_networks(version, loaded_networks)
+        verification = SetVerification(set_name, intended - loaded, loaded - intended)
+        count_metric("missing_addresses", verification.missing.address_count())
+        count_metric("unexpected_addresses", verification.unexpected.address_count())
+        yield verification
+
+
+def set_name_version(set_name: str) -> int:
+    for version in ADDRESS_LENGTHS:
+        if set_name.endswith(f"-v{version}"):
+            return version
+    raise ValueError(f"no IP version in set name '{set_name}'")
+
 
+class DaemonOptions(NamedTuple):
+    output_directory: str
+    generation: GenerationOptions = GenerationOptions()
+    sizing: SizingOptions = SizingOptions()
+    delegated_files: Sequence[str] = ()
 
-def ipset(country_code: str, max_diff: int = 0) -> Iterable[str]:
-    return ipset_commands(country_code, list_networks(country_code, max_diff))
+
+class SetRefreshDaemon(RefreshDaemon):
+    # Refreshes countries with list_networks_batch() and publishes them as
+    # full sessions, ipset-$COUNTRYCODE.txt in the output directory.
+
+    def __init__(
+            self,
+            country_codes: Iterable[str],
+            daemon_options: DaemonOptions,
+            refresh_options: RefreshOptions = RefreshOptions(),
+            status_file: Optional[str] = None,
+    ) -> None:
+        self.daemon_options = daemon_options
+        self.delegated_stats_loaded: Optional[float] = None
+        super().__init__(country_codes, refresh_options, status_file)
+
+    def refresh(self, country_codes: Sequence[str], metrics: Metrics) -> Iterable[RefreshResult]:
+        if "delegated" in self.daemon_options.generation.sources:
+            self.refresh_delegated_stats()
+        for result in list_networks_batch(
+                country_codes,
+                self.daemon_options.generation,
+                self.refresh_options.max_workers,
+                metrics,
+        ):
+            yield RefreshResult(result.country_code, result.networks, result.error)
+
+    def refresh_delegated_stats(self) -> None:
+        loaded = self.delegated_stats_loaded
+        if loaded is not None and time.monotonic() - loaded < self.refresh_options.interval:
+            return
+        try:
+            install_delegated_stats(load_delegated_stats(self.daemon_options.delegated_files))
+        except (OSError, ValueError) as error:
+            # the previous index, if any, is kept
+            print(f"delegated statistics: {error}", file=sys.stderr)
+            return
+        self.delegated_stats_loaded = time.monotonic()
+
+    def publish(self, country_code: str, networks: Collection[Network]) -> None:
+        commands = ipset_commands(country_code, networks, self.daemon_options.sizing)
+        write_file_atomically(
+            output_filename(self.daemon_options.output_directory, country_code),
+            "".join(line + "\n" for line in commands).encode("ascii"),
+        )
+
+    def read_published(self, country_code: str) -> Optional[Collection[Network]]:
+        try:
+            with open(
+                    output_filename(self.daemon_options.output_directory, country_code),
+                    encoding="ascii",
+            ) as published_file:
+                state = parse_ipset_state(published_file.read())
+        except (OSError, ValueError):
+            return None
+        return list(itertools.chain.from_iterable(
+            state.entries.get(create_target_set_name(country_code, version), ())
+            for version in IPSET_FAMILIES
+        ))
+
+
+def ipset(
+        country_code: str,
+        max_diff: int = 0,
+        space_limit: Optional[AddressSpaceLimit] = None,
+) -> Iterable[str]:
+    return ipset_commands(country_code, list_networks(country_code, max_diff, space_limit))
 
 
 def normalize_country_code(country_code: str) -> str:
@@ -225,7 +1616,23 @@ def normalize_country_code(country_code: str) -> str:
     )
 
 
-def main() -> None:
+def parse_country_codes(text_input: str) -> list[str]:
+    # accepts plain lists (one or more codes per line) as well as simple YAML
+    # lists, like the one in ansible/vars.yaml
+    country_codes = []
+    for line in text_input.splitlines():
+        for token in line.split("#", 1)[0].split():
+            if token == "-" or token.endswith(":"):
+                continue
+            country_codes.append(normalize_country_code(token.lstrip("-")))
+    return country_codes
+
+
+def output_filename(output_directory: str, country_code: str) -> str:
+    return os.path.join(output_directory, f"ipset-{country_code}.txt")
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
 
     def country_code_argument(country_code: str) -> str:
         try:
@@ -233,20 +1640,722 @@ def main() -> None:
         except ValueError as value_error:
             raise argparse.ArgumentTypeError(value_error)
 
+    def group_name_argument(group_name: str) -> str:
+        try:
+            return normalize_group_name(group_name)
+        except ValueError as value_error:
+            raise argparse.ArgumentTypeError(value_error)
+
+    def sources_argument(sources: str) -> tuple[str, ...]:
+        try:
+            return parse_sources(sources)
+        except ValueError as value_error:
+            raise argparse.ArgumentTypeError(value_error)
+
+    def address_space_limit_argument(limit: str) -> AddressSpaceLimit:
+        try:
+            return parse_address_space_limit(limit)
+        except ValueError as value_error:
+            raise argparse.ArgumentTypeError(value_error)
+
     parser = argparse.ArgumentParser(
         description="Generate a country based IP set for packet filtering in the Linux kernel."
     )
     parser.add_argument(
-        "country_code", type=country_code_argument,
+        "country_codes", type=country_code_argument, nargs="*", metavar="country_code",
         help="two letter ISO-3166 country code"
     )
     parser.add_argument(
         "-i", dest="max_diff", type=int, metavar="N", default=0,
         help="ignore up to N networks of difference between data sources"
     )
+    parser.add_argument(
+        "-a", dest="space_limit", type=address_space_limit_argument, metavar="LIMIT",
+        help="compare covered address space instead of networks and ignore up to LIMIT "
+        "of difference per IP version, as a number of addresses or a percentage (e.g. 0.5%%)"
+    )
+    parser.add_argument(
+        "--sources", type=sources_argument, metavar="SOURCE,SOURCE[,...]",
+        default=("ipdeny", "ripestat"),
+        help=f"compare these data sources: {', '.join(SOURCE_NAMES)} "
+        "(default: ipdeny,ripestat)"
+    )
+    parser.add_argument(
+        "--quorum", type=int, metavar="K",
+        help="accept addresses present in at least K of the sources, and require K sources "
+        "to be within the -i / -a limit of the result (default: all sources)"
+    )
+    parser.add_argument(
+        "--delegated-file", dest="delegated_files", action="append", metavar="FILE",
+        help="read RIR delegated-extended statistics from FILE instead of downloading them "
+        "for the delegated source (can be repeated)"
+    )
+    parser.add_argument(
+        "-f", dest="country_file", type=argparse.FileType("r"), metavar="FILE",
+        help="read country codes from FILE (plain list or YAML list, e.g. ansible/vars.yaml)"
+    )
+    parser.add_argument(
+        "-j", dest="max_workers", type=int, metavar="N", default=8,
+        help="download up to N documents concurrently (default: %(default)s)"
+    )
+    parser.add_argument(
+        "-p", dest="processes", type=int, metavar="N",
+        help="process countries in N worker processes, 0 for one per CPU, "
+        "to build sets for many countries faster"
+    )
+    parser.add_argument(
+        "-o", dest="output_directory", metavar="DIR",
+        help="write one ipset-CC.txt file per country into DIR instead of printing"
+    )
+    parser.add_argument(
+        "--cache-dir", metavar="DIR",
+        help="cache downloaded documents in DIR and revalidate them on later runs"
+    )
+    parser.add_argument(
+        "--cache-ttl", type=float, metavar="SECONDS", default=0,
+        help="use cached documents without revalidation for up to SECONDS (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--cache-max-size", type=int, metavar="BYTES",
+        help="evict least recently used documents once the cache exceeds BYTES"
+    )
+    parser.add_argument(
+        "--connect-timeout", type=float, metavar="SECONDS", default=HttpClient().connect_timeout,
+        help="give up connecting to a data source after SECONDS (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--timeout", dest="read_timeout", type=float, metavar="SECONDS",
+        default=HttpClient().read_timeout,
+        help="give up waiting for data from a data source after SECONDS (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--retries", type=int, metavar="N", default=HttpClient().retries,
+        help="retry a failed download up to N times, with exponential backoff "
+        "(default: %(default)s)"
+    )
+    parser.add_argument(
+        "--offline", action="store_true",
+        help="use only cached documents, don't connect to data sources (requires --cache-dir)"
+    )
+    parser.add_argument(
+        "-d", dest="previous_file", metavar="FILE",
+        help="generate add/del commands against the state in FILE "
+        "(a previously generated full session, `ipset save` output or a snapshot)"
+    )
+    parser.add_argument(
+        "--delta-threshold", type=float, metavar="RATIO", default=0.5,
+        help="rebuild a set when changes exceed RATIO of its size (default: %(default)s)"
+    )
+    parser.add_argument(
+        "-g", dest="group_name", type=group_name_argument, metavar="NAME",
+        help="generate a single set per IP version named group-NAME-v4/6 with "
+        "the networks of all countries"
+    )
+    parser.add_argument(
+        "--list-set", action="store_true",
+        help="with -g, also generate a list:set named group-NAME wrapping both sets"
+    )
+    parser.add_argument(
+        "--allow", dest="allow_files", type=argparse.FileType("r"), action="append",
+        metavar="FILE",
+        help="remove the networks or addresses listed in FILE (one per line) from all sets "
+        "(can be repeated)"
+    )
+    parser.add_argument(
+        "--shape-prefixes", dest="shaping_budget", type=float, metavar="PERCENT",
+        help="split networks into longer prefixes already in the set, adding up to PERCENT "
+        "entries, to reduce distinct prefix lengths and thus hash:net probes per packet"
+    )
+    parser.add_argument(
+        "--max-overshoot", type=float, metavar="PERCENT", default=0,
+        help="merge networks into a covering prefix if at most PERCENT of its addresses "
+        "are not in the set (default: %(default)s, only lossless merging)"
+    )
+    parser.add_argument(
+        "--lookup", dest="lookup_file", type=argparse.FileType("r"), metavar="FILE",
+        help="instead of generating sets, print the countries of each address in FILE "
+        "(`-` for stdin), using the sets from -d if given"
+    )
+    parser.add_argument(
+        "--snapshot", dest="snapshot_file", metavar="FILE",
+        help="also save the generated networks of all countries to FILE in a compact "
+        "binary format, usable with -d"
+    )
+    parser.add_argument(
+        "--manifest", dest="manifest_file", metavar="FILE",
+        help="also write content hashes of the sets of each generated session to FILE"
+    )
+    parser.add_argument(
+        "--check-manifest", dest="check_manifest_file", type=argparse.FileType("r"),
+        metavar="FILE",
+        help="instead of generating sets, print the names of the sessions in the manifest "
+        "FILE whose sets differ from the state in -d, e.g. `ipset save` output of a host"
+    )
+    add_sizing_arguments(parser)
+    add_output_arguments(parser)
+    add_history_arguments(parser)
+    add_daemon_arguments(parser)
+    parser.add_argument(
+        "--metrics", dest="metrics_file", metavar="FILE",
+        help="write per-stage timings and counters to FILE (`-` for stderr)"
+    )
+    parser.add_argument(
+        "--metrics-format", choices=("json", "textfile"), default="json",
+        help="JSON lines or Prometheus text format for the node exporter textfile "
+        "collector (default: %(default)s)"
+    )
+    return parser
+
+
+def add_sizing_arguments(parser: argparse.ArgumentParser) -> None:
+
+    def maxelem_argument(maxelem: str) -> int:
+        if not maxelem.isdigit() or int(maxelem) < 1:
+            raise argparse.ArgumentTypeError(f"invalid number of entries: {maxelem}")
+        return int(maxelem)
+
+    parser.add_argument(
+        "--headroom", type=float, metavar="PERCENT", default=IPSET_DEFAULT_HEADROOM,
+        help="size sets for PERCENT more entries than generated (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--maxelem", type=maxelem_argument, metavar="N", default=IPSET_DEFAULT_MAXELEM,
+        help="maximum number of entries of each set, keep it the same between runs "
+        "(default: %(default)s)"
+    )
+
+
+def add_output_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--format", choices=("ipset", "nft"), default="ipset",
+        help="generate `ipset restore` sessions, or a single `nft -f` script with interval "
+        "sets for all countries, written to TABLE.nft with -o (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--nft-table", metavar="TABLE", default=NFT_DEFAULT_TABLE,
+        help="with --format nft, the inet family table of the sets (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--apply", action="store_true",
+        help="instead of writing sessions, load them with `ipset restore`, remove leftover "
+        "temporary sets and verify the loaded sets"
+    )
+    parser.add_argument(
+        "--ipset", dest="ipset_binary", metavar="PATH", default="ipset",
+        help="with --apply, the ipset program to run (default: %(default)s)"
+    )
+
+
+def add_history_arguments(parser: argparse.ArgumentParser) -> None:
+
+    def time_argument(text_input: str) -> float:
+        try:
+            return parse_history_time(text_input)
+        except ValueError as value_error:
+            raise argparse.ArgumentTypeError(value_error)
+
+    parser.add_argument(
+        "--history", dest="history_directory", metavar="DIR",
+        help="record the generated networks of each country, and the networks of each data "
+        "source, in DIR"
+    )
+    parser.add_argument(
+        "--at", dest="history_time", type=time_argument, metavar="TIME",
+        help="instead of downloading, generate sets from the networks recorded in --history "
+        "as of TIME (ISO 8601, UTC unless a time zone is given, or `now`)"
+    )
+    parser.add_argument(
+        "--changes", dest="changes_period", type=time_argument, nargs=2,
+        metavar=("SINCE", "UNTIL"),
+        help="instead of generating sets, print the networks added (+) to and removed (-) "
+        "from each country recorded in --history between SINCE and UNTIL"
+    )
+    parser.add_argument(
+        "--churn", dest="churn_period", type=time_argument, nargs=2,
+        metavar=("SINCE", "UNTIL"),
+        help="instead of generating sets, print how often the networks of each country and "
+        "data source recorded in --history changed between SINCE and UNTIL, as JSON lines"
+    )
+
+
+def add_daemon_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="keep running and refresh the ipset-CC.txt files in the -o directory "
+        "when the networks of a country change"
+    )
+    parser.add_argument(
+        "--interval", type=float, metavar="SECONDS", default=RefreshOptions().interval,
+        help="with --daemon, refresh each country every SECONDS (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--jitter", type=float, metavar="FRACTION", default=RefreshOptions().jitter,
+        help="with --daemon, randomly change refresh delays by up to FRACTION "
+        "(default: %(default)s)"
+    )
+    parser.add_argument(
+        "--retry-interval", type=float, metavar="SECONDS",
+        default=RefreshOptions().retry_interval,
+        help="with --daemon, retry a failed country after SECONDS, doubled after each "
+        "consecutive failure up to --interval (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--status", dest="status_file", metavar="FILE",
+        help="with --daemon, write the refresh status of all countries to FILE as JSON "
+        "after each refresh"
+    )
+
+
+def read_allow_lists(allow_files: Iterable[TextIO]) -> Optional[dict[int, IntervalSet]]:
+    allowed_networks = [
+        network for allow_file in allow_files for network in parse_allow_list(allow_file.read())
+    ]
+    if not allowed_networks:
+        return None
+    return network_interval_sets(allowed_networks)
+
+
+def read_country_codes(args: argparse.Namespace, required: bool = True) -> list[str]:
+    country_codes = list(args.country_codes)
+    if args.country_file:
+        country_codes.extend(parse_country_codes(args.country_file.read()))
+    if required and not country_codes:
+        raise ValueError("at least one country code is required")
+    return list(dict.fromkeys(country_codes))
+
+
+def write_sessions(
+        results: Iterable[BatchResult],
+        args: argparse.Namespace,
+        previous_state: Optional[IpsetState],
+        metrics: Optional[Metrics] = None,
+) -> bool:
+    success = True
+    for result in results:
+        if result.error is not None:
+            print(f"{result.country_code}: {result.error}", file=sys.stderr)
+            success = False
+            continue
+        try:
+            check_set_sizes(session_sets(result.country_code, result.networks), args.maxelem)
+        except ValueError as error:
+            print(f"{result.country_code}: {error}", file=sys.stderr)
+            success = False
+            continue
+        # lazily rendered
+        commands = session_commands(result, args, previous_state)
+        if args.apply:
+            with measure_stage(metrics, result.country_code, "apply"):
+                sets = session_sets(result.country_code, result.networks)
+                if not apply_session(result.country_code, commands, sets, args.ipset_binary):
+                    success = False
+        elif result.session is not None:
+            write_commands(commands, args.output_directory, result.country_code)
+        else:
+            with measure_stage(metrics, result.country_code, "render"):
+                write_commands(commands, args.output_directory, result.country_code)
+    return success
+
+
+def session_commands(
+        result: BatchResult,
+        args: argparse.Namespace,
+        previous_state: Optional[IpsetState],
+) -> Iterable[str]:
+    if result.session is not None:
+        return result.session.splitlines()
+    if previous_state is None:
+        return ipset_commands(
+            result.country_code, result.networks, SizingOptions(args.headroom, args.maxelem)
+        )
+    return ipset_delta_commands(
+        result.country_code,
+        result.networks,
+        previous_state,
+        args.delta_threshold,
+        SizingOptions(args.headroom, args.maxelem),
+    )
+
+
+def write_group_session(
+        results: Iterable[BatchResult],
+        args: argparse.Namespace,
+        previous_state: Optional[IpsetState],
+        metrics: Optional[Metrics] = None,
+) -> bool:
+    results = list(results)
+    failed_results = [result for result in results if result.error is not None]
+    for result in failed_results:
+        print(f"{result.country_code}: {result.error}", file=sys.stderr)
+    if failed_results:
+        # a partial group set would silently unblock the failed countries
+        print(f"group {args.group_name}: not generated", file=sys.stderr)
+        return False
+    name = create_group_set_name(args.group_name)
+    networks = [network for result in results for network in result.networks]
+    sets = group_session_sets(args.group_name, networks)
+    try:
+        check_set_sizes(sets, args.maxelem)
+    except ValueError as error:
+        print(f"group {args.group_name}: {error}", file=sys.stderr)
+        return False
+    commands = ipset_group_commands(
+        args.group_name,
+        networks,
+        SizingOptions(args.headroom, args.maxelem),
+        args.list_set,
+        previous_state,
+    )
+    if args.apply:
+        with measure_stage(metrics, name, "apply"):
+            return apply_session(name, commands, sets, args.ipset_binary)
+    with measure_stage(metrics, name, "render"):
+        write_commands(commands, args.output_directory, name)
+    return True
+
+
+def apply_session(
+        name: str,
+        commands: Iterable[str],
+        sets: Mapping[str, Collection[Network]],
+        ipset_binary: str,
+) -> bool:
+    success = True
+    try:
+        try:
+            ipset_restore(commands, ipset_binary)
+        except ValueError as error:
+            print(f"{name}: {error}", file=sys.stderr)
+            success = False
+        for set_name in remove_temporary_sets(sets, ipset_binary):
+            print(f"{name}: removed leftover set {set_name}", file=sys.stderr)
+        for verification in verify_sets(sets, ipset_binary):
+            for line in verification.describe():
+                print(f"{name}: {line}", file=sys.stderr)
+                success = False
+    except (OSError, ValueError) as error:
+        print(f"{name}: {error}", file=sys.stderr)
+        success = False
+    return success
+
+
+def write_nft_script(
+        results: Iterable[BatchResult],
+        args: argparse.Namespace,
+        metrics: Optional[Metrics] = None,
+) -> bool:
+    # One script for all countries. Sets of failed countries are left out, so
+    # that they keep their current contents.
+    success = True
+
+    def country_sets() -> Iterable[tuple[str, IntervalSet]]:
+        nonlocal success
+        for result in results:
+            if result.error is not None:
+                print(f"{result.country_code}: {result.error}", file=sys.stderr)
+                success = False
+                continue
+            with measure_stage(metrics, result.country_code, "render"):
+                interval_sets = network_interval_sets(result.networks)
+            for version, interval_set in interval_sets.items():
+                yield create_target_set_name(result.country_code, version), interval_set
+
+    def group_sets() -> Iterable[tuple[str, IntervalSet]]:
+        nonlocal success
+        group_results = list(results)
+        failed_results = [result for result in group_results if result.error is not None]
+        for result in failed_results:
+            print(f"{result.country_code}: {result.error}", file=sys.stderr)
+        if failed_results:
+            print(f"group {args.group_name}: not generated", file=sys.stderr)
+            success = False
+            return
+        name = create_group_set_name(args.group_name)
+        with measure_stage(metrics, name, "render"):
+            interval_sets = network_interval_sets(
+                itertools.chain.from_iterable(result.networks for result in group_results)
+            )
+        for version, interval_set in interval_sets.items():
+            yield create_group_set_name(args.group_name, version), interval_set
+
+    write_lines(
+        nft_commands(group_sets() if args.group_name else country_sets(), args.nft_table),
+        os.path.join(args.output_directory, f"{args.nft_table}.nft")
+        if args.output_directory else None,
+    )
+    return success
+
+
+def write_commands(commands: Iterable[str], output_directory: Optional[str], name: str) -> None:
+    write_lines(commands, output_filename(output_directory, name) if output_directory else None)
+
+
+def write_lines(lines: Iterable[str], filename: Optional[str]) -> None:
+    output: ContextManager[TextIO] = contextlib.nullcontext(sys.stdout)
+    if filename:
+        output = open(filename, "w", encoding="ascii")
+    with output as output_file:
+        for line in lines:
+            output_file.write(line + "\n")
+            count_metric("commands", 1)
+
+
+def run_lookup(
+        args: argparse.Namespace,
+        country_codes: Collection[str],
+        previous_state: Optional[IpsetState],
+        options: GenerationOptions,
+        metrics: Optional[Metrics] = None,
+) -> bool:
+    success = True
+    if previous_state is not None:
+        # the sets as they are loaded, no downloads needed
+        index = CountryIndex.from_set_entries(previous_state.entries, country_codes)
+    else:
+        country_networks = {}
+        for result in list_networks_batch(country_codes, options, args.max_workers, metrics):
+            if result.error is not None:
+                print(f"{result.country_code}: {result.error}", file=sys.stderr)
+                success = False
+            else:
+                country_networks[result.country_code] = result.networks
+        index = CountryIndex.from_networks(country_networks)
+    with measure_stage(metrics, "all", "lookup"):
+        for lookup_result in lookup_addresses(index, args.lookup_file):
+            if lookup_result.error is not None:
+                print(f"{lookup_result.address}: {lookup_result.error}", file=sys.stderr)
+                success = False
+                continue
+            matches = ",".join(lookup_result.country_codes) or "-"
+            sys.stdout.write(f"{lookup_result.address}\t{matches}\n")
+    return success
+
+
+def run_daemon(
+        args: argparse.Namespace,
+        country_codes: Iterable[str],
+        options: GenerationOptions,
+) -> None:
+    daemon = SetRefreshDaemon(
+        country_codes,
+        DaemonOptions(
+            args.output_directory,
+            options,
+            SizingOptions(args.headroom, args.maxelem),
+            args.delegated_files or (),
+        ),
+        RefreshOptions(args.interval, args.jitter, args.retry_interval, args.max_workers),
+        args.status_file,
+    )
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+def write_metrics(metrics: Metrics, filename: str, metrics_format: str) -> None:
+    if metrics_format == "textfile":
+        lines = metrics.textfile_lines()
+    else:
+        lines = metrics.json_lines()
+    content = "".join(line + "\n" for line in lines)
+    if filename == "-":
+        sys.stderr.write(content)
+    else:
+        write_file_atomically(filename, content.encode("utf-8"))
+
+
+def write_outputs(
+        args: argparse.Namespace,
+        country_codes: Collection[str],
+        previous_state: Optional[IpsetState],
+        options: GenerationOptions,
+        metrics: Optional[Metrics] = None,
+) -> bool:
+    results: Iterable[BatchResult]
+    if args.history_time is not None and options.history is not None:
+        results = history_results(options.history, country_codes, args.history_time)
+    elif args.processes is not None:
+        # full sessions are rendered by the workers, others need all countries
+        # or the previous state
+        render = not args.group_name and previous_state is None and args.format == "ipset"
+        results = list_networks_parallel(
+            country_codes,
+            options,
+            args.processes or None,
+            SizingOptions(args.headroom, args.maxelem) if render else None,
+            metrics,
+        )
+    else:
+        results = list_networks_batch(country_codes, options, args.max_workers, metrics)
+    if args.snapshot_file or args.manifest_file:
+        results = list(results)
+    if args.format == "nft":
+        success = write_nft_script(results, args, metrics)
+    elif args.group_name:
+        success = write_group_session(results, args, previous_state, metrics)
+    else:
+        success = write_sessions(results, args, previous_state, metrics)
+    if args.snapshot_file:
+        write_snapshot(args.snapshot_file, results, options.sources)
+    if args.manifest_file:
+        write_file_atomically(args.manifest_file, manifest_bytes(results, args.group_name))
+    return success
+
+
+def query_history(args: argparse.Namespace, history: HistoryStore) -> bool:
+    success = True
+    country_codes = read_country_codes(args, required=False) or history.country_codes()
+    for country_code in country_codes:
+        try:
+            if args.changes_period:
+                write_history_changes(history, country_code, *args.changes_period)
+            else:
+                write_churn_stats(history, country_code, *args.churn_period)
+        except ValueError as error:
+            print(f"{country_code}: {error}", file=sys.stderr)
+            success = False
+    return success
+
+
+def write_history_changes(
+        history: HistoryStore,
+        country_code: str,
+        since: float,
+        until: float,
+) -> None:
+    changes = history.changes(country_code, since, until)
+    for sign, interval_sets in (("+", changes.added), ("-", changes.removed)):
+        for interval_set in interval_sets.values():
+            for network in interval_set.networks():
+                sys.stdout.write(f"{country_code}\t{sign}{network}\n")
+
+
+def write_churn_stats(
+        history: HistoryStore,
+        country_code: str,
+        since: float,
+        until: float,
+) -> None:
+    # the generated networks first, then each data source
+    for source in (None, *history.sources(country_code)):
+        churn = history.churn(country_code, since, until, source)
+        record = {
+            "country": country_code,
+            "source": source,
+            "refreshes": churn.refreshes,
+            "changes": churn.changes,
+        }
+        for version in ADDRESS_LENGTHS:
+            record[f"added_addresses_v{version}"] = churn.added_addresses[version]
+            record[f"removed_addresses_v{version}"] = churn.removed_addresses[version]
+        sys.stdout.write(json.dumps(record) + "\n")
+
+
+def check_manifest(args: argparse.Namespace, previous_state: IpsetState) -> None:
+    manifest_sets = parse_manifest(args.check_manifest_file.read())
+    for name in stale_sessions(manifest_sets, previous_state):
+        sys.stdout.write(name + "\n")
+
+
+def check_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    if args.offline and not args.cache_dir:
+        parser.error("--offline requires --cache-dir")
+    if args.list_set and not args.group_name:
+        parser.error("--list-set requires -g")
+    if args.delegated_files and "delegated" not in args.sources:
+        parser.error("--delegated-file requires the delegated source in --sources")
+    if args.quorum is not None and not 1 <= args.quorum <= len(args.sources):
+        parser.error(f"--quorum must be between 1 and the number of sources ({len(args.sources)})")
+    if args.processes is not None and args.processes < 0:
+        parser.error("-p must not be negative")
+    if args.format == "nft" and any((
+            args.previous_file, args.list_set, args.apply, args.daemon, args.manifest_file,
+    )):
+        parser.error(
+            "--format nft can't be used with -d, --list-set, --apply, --daemon or --manifest"
+        )
+    if args.apply and (args.output_directory or args.lookup_file or args.daemon):
+        parser.error("--apply can't be used with -o, --lookup or --daemon")
+    history_queries = (args.history_time, args.changes_period, args.churn_period)
+    if any(query is not None for query in history_queries) and not args.history_directory:
+        parser.error("--at, --changes and --churn require --history")
+    if args.daemon and any(query is not None for query in history_queries):
+        parser.error("--daemon can't be used with --at, --changes or --churn")
+    if args.daemon and not args.output_directory:
+        parser.error("--daemon requires -o")
+    if args.check_manifest_file and not args.previous_file:
+        parser.error("--check-manifest requires -d")
+    if args.daemon and any((
+            args.group_name, args.lookup_file, args.previous_file, args.snapshot_file,
+            args.manifest_file, args.metrics_file,
+    )):
+        parser.error(
+            "--daemon can't be used with -g, --lookup, -d, --snapshot, --manifest or --metrics"
+        )
+
+
+def install_delegated_stats_or_exit(args: argparse.Namespace, metrics: Optional[Metrics]) -> None:
+    try:
+        with measure_stage(metrics, "all", "download", "delegated"):
+            install_delegated_stats(load_delegated_stats(args.delegated_files or ()))
+    except (OSError, ValueError) as error:
+        print(f"delegated statistics: {error}", file=sys.stderr)
+        sys.exit(1)
+
+
+def main() -> None:
+    parser = create_argument_parser()
     args = parser.parse_args()
-    for line in ipset(args.country_code, args.max_diff):
-        print(line)
+    check_arguments(parser, args)
+    try:
+        previous_state = None
+        if args.previous_file:
+            previous_state = read_previous_state(
+                args.previous_file, allow_snapshot=bool(args.lookup_file)
+            )
+        if args.check_manifest_file and previous_state is not None:
+            check_manifest(args, previous_state)
+            return
+        if args.changes_period or args.churn_period:
+            if not query_history(args, HistoryStore(args.history_directory)):
+                sys.exit(1)
+            return
+        country_codes = read_country_codes(
+            args, required=not (args.lookup_file and args.previous_file)
+        )
+        allowed_sets = read_allow_lists(args.allow_files or ())
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    install_http_client(HttpClient(args.connect_timeout, args.read_timeout, args.retries))
+    if args.cache_dir:
+        install_url_cache(
+            UrlCache(args.cache_dir, args.cache_ttl, args.cache_max_size, args.offline)
+        )
+    metrics = Metrics() if args.metrics_file else None
+    if "delegated" in args.sources and not args.daemon and args.history_time is None:
+        install_delegated_stats_or_exit(args, metrics)
+    options = GenerationOptions(
+        args.max_diff,
+        args.space_limit,
+        args.max_overshoot,
+        args.sources,
+        args.quorum,
+        allowed_sets,
+        args.shaping_budget,
+        HistoryStore(args.history_directory) if args.history_directory else None,
+    )
+    if args.daemon:
+        run_daemon(args, country_codes, options)
+        return
+    if args.lookup_file:
+        success = run_lookup(args, country_codes, previous_state, options, metrics)
+    else:
+        success = write_outputs(args, country_codes, previous_state, options, metrics)
+    if metrics is not None:
+        write_metrics(metrics, args.metrics_file, args.metrics_format)
+    if not success:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
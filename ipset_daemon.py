@@ -0,0 +1,162 @@
+import itertools
+import json
+import random
+import sys
+import time
+from typing import Iterable, Mapping, Collection, Sequence, NamedTuple, Optional, Any
+from ipset_intervals import Network
+from ipset_metrics import Metrics
+from ipset_http import write_file_atomically
+
+
+class RefreshOptions(NamedTuple):
+    interval: float = 86400
+    # fraction of the delay, randomly added or subtracted
+    jitter: float = 0.1
+    retry_interval: float = 300
+    max_workers: int = 8
+
+
+class RefreshResult(NamedTuple):
+    country_code: str
+    networks: Collection[Network]
+    error: Optional[Exception]
+
+
+class CountryStatus(NamedTuple):
+    networks: Optional[Collection[Network]] = None
+    next_refresh: float = 0
+    failures: int = 0
+    error: Optional[str] = None
+    last_attempt: Optional[float] = None
+    last_success: Optional[float] = None
+    last_change: Optional[float] = None
+    timings: Optional[Mapping[str, float]] = None
+
+
+class RefreshDaemon:
+    # Keeps the networks of each country in memory and refreshes them on their
+    # own schedule. A failed refresh is retried with exponential backoff while
+    # the last good networks stay published. Networks are only published again
+    # when they change. Subclasses implement refresh(), publish() and
+    # read_published().
+
+    def __init__(
+            self,
+            country_codes: Iterable[str],
+            refresh_options: RefreshOptions = RefreshOptions(),
+            status_file: Optional[str] = None,
+    ) -> None:
+        self.refresh_options = refresh_options
+        self.status_file = status_file
+        self.random = random.Random()
+        # networks published before a restart are not published again if unchanged
+        self.statuses = {
+            country_code: CountryStatus(networks=self.read_published(country_code))
+            for country_code in country_codes
+        }
+
+    def refresh(self, country_codes: Sequence[str], metrics: Metrics) -> Iterable[RefreshResult]:
+        raise NotImplementedError
+
+    def publish(self, country_code: str, networks: Collection[Network]) -> None:
+        raise NotImplementedError
+
+    def read_published(self, country_code: str) -> Optional[Collection[Network]]:
+        raise NotImplementedError
+
+    def run(self, cycles: Optional[int] = None) -> None:
+        for _ in itertools.repeat(None) if cycles is None else range(cycles):
+            self.refresh_due()
+            self.write_status()
+            next_refresh = min(status.next_refresh for status in self.statuses.values())
+            time.sleep(max(next_refresh - time.monotonic(), 0))
+
+    def refresh_due(self) -> None:
+        now = time.monotonic()
+        due = [
+            country_code for country_code, status in self.statuses.items()
+            if status.next_refresh <= now
+        ]
+        if not due:
+            return
+        metrics = Metrics()
+        for result in self.refresh(due, metrics):
+            timings: dict[str, float] = {}
+            for record in metrics.records:
+                if record["country"] == result.country_code:
+                    timings[record["stage"]] = timings.get(record["stage"], 0) + record["seconds"]
+            self.update(result, timings)
+
+    def update(self, result: RefreshResult, timings: Mapping[str, float]) -> None:
+        status = self.statuses[result.country_code]._replace(
+            last_attempt=time.time(), timings=timings
+        )
+        if result.error is not None:
+            self.fail(result.country_code, status, result.error)
+            return
+        if status.networks is None or set(status.networks) != set(result.networks):
+            try:
+                self.publish(result.country_code, result.networks)
+            except (OSError, ValueError) as error:
+                # not published, so the previous networks stay the published state
+                self.fail(result.country_code, status, error)
+                return
+            status = status._replace(last_change=time.time())
+        self.statuses[result.country_code] = status._replace(
+            networks=result.networks,
+            failures=0,
+            error=None,
+            last_success=time.time(),
+            next_refresh=time.monotonic() + self.next_delay(0),
+        )
+
+    def fail(self, country_code: str, status: CountryStatus, error: Exception) -> None:
+        failures = status.failures + 1
+        self.statuses[country_code] = status._replace(
+            failures=failures,
+            error=str(error),
+            next_refresh=time.monotonic() + self.next_delay(failures),
+        )
+
+    def next_delay(self, failures: int) -> float:
+        if failures:
+            delay = min(
+                self.refresh_options.retry_interval * 2.0 ** (failures - 1),
+                self.refresh_options.interval,
+            )
+        else:
+            delay = self.refresh_options.interval
+        jitter = self.refresh_options.jitter
+        return delay * (1 + self.random.uniform(-jitter, jitter))
+
+    def status(self) -> dict[str, Any]:
+        # wall clock times, for health checks
+        offset = time.time() - time.monotonic()
+        return {
+            "updated": time.time(),
+            "countries": {
+                country_code: {
+                    "networks": None if status.networks is None else len(status.networks),
+                    "next_refresh": status.next_refresh + offset,
+                    "failures": status.failures,
+                    "error": status.error,
+                    "last_attempt": status.last_attempt,
+                    "last_success": status.last_success,
+                    "last_change": status.last_change,
+                    "timings": status.timings,
+                }
+                for country_code, status in self.statuses.items()
+            },
+        }
+
+    def write_status(self) -> None:
+        if not self.status_file:
+            return
+        try:
+            write_file_atomically(
+                self.status_file, json.dumps(self.status(), indent=1).encode("ascii")
+            )
+        except OSError as error:
+            # the next cycle tries again
+            print(f"status: {error}", file=sys.stderr)
@@ -0,0 +1,103 @@
+import concurrent.futures
+import ipaddress
+import threading
+from typing import Iterable, Sequence, Optional
+from ipset_intervals import Network, IntervalSet, network_to_range
+from ipset_http import read_url
+
+
+class DelegatedStats:
+    # Country -> address space index built from the RIR delegated-extended
+    # statistics files, each of which covers all countries of a registry.
+
+    def __init__(self) -> None:
+        self.ranges: dict[str, dict[int, list[tuple[int, int]]]] = {}
+
+    def update(self, lines: Iterable[bytes]) -> None:
+        # registry|cc|type|start|value|date|status[|opaque-id[|extensions]]
+        for line in lines:
+            record = line.rstrip().split(b"|")
+            # skips comments, the version header, summary lines and space that
+            # is not delegated to any country (available, reserved)
+            if len(record) < 7 or record[2] not in (b"ipv4", b"ipv6"):
+                continue
+            if record[6] not in (b"allocated", b"assigned") or len(record[1]) != 2:
+                continue
+            version = 4 if record[2] == b"ipv4" else 6
+            country_ranges = self.ranges.setdefault(record[1].decode("ascii").lower(), {})
+            country_ranges.setdefault(version, []).append(
+                delegated_record_to_range(version, record[3], record[4])
+            )
+
+    def country_codes(self) -> list[str]:
+        return sorted(self.ranges)
+
+    def interval_sets(self, country_code: str) -> dict[int, IntervalSet]:
+        if country_code not in self.ranges:
+            raise ValueError(f"no delegated address space for country '{country_code}'")
+        return {
+            version: IntervalSet.from_ranges(version, version_ranges)
+            for version, version_ranges in sorted(self.ranges[country_code].items())
+        }
+
+    def networks(self, country_code: str) -> Iterable[Network]:
+        for interval_set in self.interval_sets(country_code).values():
+            yield from interval_set.networks()
+
+
+def delegated_record_to_range(version: int, start: bytes, value: bytes) -> tuple[int, int]:
+    # IPv4 records hold an address count, which is not necessarily a power of
+    # two, IPv6 records hold a prefix length
+    if version == 4:
+        first = int(ipaddress.IPv4Address(start.decode("ascii")))
+        count = int(value)
+        if count < 1:
+            raise ValueError(f"invalid address count: {value.decode('ascii')}")
+        return first, first + count - 1
+    return network_to_range(
+        ipaddress.IPv6Network(f"{start.decode('ascii')}/{value.decode('ascii')}")
+    )
+
+
+RIR_DELEGATED_URLS = {
+    "afrinic": "https://ftp.afrinic.net/pub/stats/afrinic/delegated-afrinic-extended-latest",
+    "apnic": "https://ftp.apnic.net/stats/apnic/delegated-apnic-extended-latest",
+    "arin": "https://ftp.arin.net/pub/stats/arin/delegated-arin-extended-latest",
+    "lacnic": "https://ftp.lacnic.net/pub/stats/lacnic/delegated-lacnic-extended-latest",
+    "ripencc": "https://ftp.ripe.net/pub/stats/ripencc/delegated-ripencc-extended-latest",
+}
+
+
+def load_delegated_stats(filenames: Sequence[str] = ()) -> DelegatedStats:
+    delegated_stats = DelegatedStats()
+    if filenames:
+        for filename in filenames:
+            with open(filename, "rb") as delegated_file:
+                delegated_stats.update(delegated_file)
+        return delegated_stats
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(RIR_DELEGATED_URLS)) as executor:
+        for content in executor.map(read_url, RIR_DELEGATED_URLS.values()):
+            delegated_stats.update(content.splitlines())
+    return delegated_stats
+
+
+_delegated_stats: Optional[DelegatedStats] = None # pylint: disable=invalid-name
+_delegated_stats_lock = threading.Lock()
+
+
+def install_delegated_stats(delegated_stats: Optional[DelegatedStats]) -> None:
+    global _delegated_stats # pylint: disable=global-statement; same as install_url_cache
+    _delegated_stats = delegated_stats
+
+
+def get_delegated_stats() -> DelegatedStats:
+    # downloaded once, on first use, and shared by all countries
+    global _delegated_stats # pylint: disable=global-statement
+    with _delegated_stats_lock:
+        if _delegated_stats is None:
+            _delegated_stats = load_delegated_stats()
+        return _delegated_stats
+
+
+def installed_delegated_stats() -> Optional[DelegatedStats]:
+    return _delegated_stats
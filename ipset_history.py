@@ -0,0 +1,224 @@
+import datetime
+import itertools
+import json
+import math
+import os.path
+import re
+import time
+from typing import Iterable, Iterator, Mapping, Sequence, NamedTuple, Optional, Any
+from ipset_intervals import Network, ADDRESS_LENGTHS, IntervalSet, network_interval_sets
+from ipset_metrics import count_metric
+
+
+class HistoryChanges(NamedTuple):
+    added: Mapping[int, IntervalSet]
+    removed: Mapping[int, IntervalSet]
+
+
+class ChurnStats(NamedTuple):
+    refreshes: int
+    # refreshes that changed the networks
+    changes: int
+    added_addresses: Mapping[int, int]
+    removed_addresses: Mapping[int, int]
+
+
+class HistoryStore:
+    # Networks of each country over time, both the generated ones and those
+    # of each data source. Every refresh appends a line to the file of the
+    # country (or country and source): the address ranges added and removed
+    # since the previous record, or all ranges in a checkpoint record every
+    # `checkpoint_interval` records, so that any state is rebuilt from at most
+    # that many records. Lines start with the time and the record kind, only
+    # the records needed are decoded.
+
+    def __init__(self, directory: str, checkpoint_interval: int = 30) -> None:
+        self.directory = directory
+        self.checkpoint_interval = checkpoint_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, country_code: str, source: Optional[str] = None) -> str:
+        name = country_code if source is None else f"{country_code}-{source}"
+        return os.path.join(self.directory, f"{name}.history")
+
+    def country_codes(self) -> list[str]:
+        return sorted(
+            filename.removesuffix(".history")
+            for filename in os.listdir(self.directory)
+            if re.fullmatch("[a-z]{2}\\.history", filename)
+        )
+
+    def sources(self, country_code: str) -> list[str]:
+        return sorted(
+            filename.removeprefix(f"{country_code}-").removesuffix(".history")
+            for filename in os.listdir(self.directory)
+            if filename.startswith(f"{country_code}-") and filename.endswith(".history")
+        )
+
+    def read(self, country_code: str, source: Optional[str] = None) -> list[tuple[float, str, str]]:
+        try:
+            with open(self.filename(country_code, source), encoding="ascii") as history_file:
+                records = []
+                for line in history_file:
+                    timestamp, kind, payload = line.rstrip("\n").split("\t", 2)
+                    records.append((float(timestamp), kind, payload))
+                return records
+        except FileNotFoundError:
+            return []
+
+    def record(
+            self,
+            country_code: str,
+            networks: Iterable[Network],
+            source: Optional[str] = None,
+            timestamp: Optional[float] = None,
+    ) -> None:
+        records = self.read(country_code, source)
+        state = network_interval_sets(networks)
+        last_checkpoint = max(
+            (index for index, (_, kind, _) in enumerate(records) if kind == "full"), default=None
+        )
+        payload: Mapping[str, Any]
+        if last_checkpoint is None or len(records) - last_checkpoint >= self.checkpoint_interval:
+            kind, payload = "full", encode_interval_sets(state)
+        else:
+            previous = list(self.replay(records))[-1][1]
+            kind, payload = "delta", {
+                "added": encode_interval_sets(subtract_interval_sets(state, previous)),
+                "removed": encode_interval_sets(subtract_interval_sets(previous, state)),
+            }
+        line = f"{time.time() if timestamp is None else timestamp}\t{kind}\t{json.dumps(payload)}\n"
+        # a single write, appended whole even with concurrent writers
+        with open(self.filename(country_code, source), "a", encoding="ascii") as history_file:
+            history_file.write(line)
+        count_metric("history_records", 1)
+
+    @staticmethod
+    def replay(
+            records: Sequence[tuple[float, str, str]],
+            since: float = math.inf,
+    ) -> Iterator[tuple[float, dict[int, IntervalSet], HistoryChanges]]:
+        # from the last checkpoint at or before `since`
+        start = max(
+            (
+                index for index, (timestamp, kind, _) in enumerate(records)
+                if kind == "full" and timestamp <= since
+            ),
+            default=0,
+        )
+        state: dict[int, IntervalSet] = {}
+        for timestamp, kind, payload in records[start:]:
+            data = json.loads(payload)
+            if kind == "full":
+                new_state = decode_interval_sets(data)
+                changes = HistoryChanges(
+                    subtract_interval_sets(new_state, state),
+                    subtract_interval_sets(state, new_state),
+                )
+            else:
+                changes = HistoryChanges(
+                    decode_interval_sets(data["added"]), decode_interval_sets(data["removed"])
+                )
+                new_state = {
+                    version: (interval_set - changes.removed[version]) | changes.added[version]
+                    for version, interval_set in state.items()
+                }
+            state = new_state
+            yield timestamp, state, changes
+
+    def state(
+            self,
+            country_code: str,
+            timestamp: float = math.inf,
+            source: Optional[str] = None,
+    ) -> dict[int, IntervalSet]:
+        records = [record for record in self.read(country_code, source) if record[0] <= timestamp]
+        if not records:
+            raise ValueError(f"no recorded networks for country '{country_code}' at that time")
+        return list(self.replay(records, timestamp))[-1][1]
+
+    def changes(
+            self,
+            country_code: str,
+            since: float,
+            until: float,
+            source: Optional[str] = None,
+    ) -> HistoryChanges:
+        after = self.state(country_code, until, source)
+        try:
+            before = self.state(country_code, since, source)
+        except ValueError:
+            # since is before the first record, all recorded networks were added
+            before = {}
+        return HistoryChanges(
+            subtract_interval_sets(after, before), subtract_interval_sets(before, after)
+        )
+
+    def churn(
+            self,
+            country_code: str,
+            since: float,
+            until: float,
+            source: Optional[str] = None,
+    ) -> ChurnStats:
+        refreshes = 0
+        changed = 0
+        added_addresses = dict.fromkeys(ADDRESS_LENGTHS, 0)
+        removed_addresses = dict.fromkeys(ADDRESS_LENGTHS, 0)
+        records = [record for record in self.read(country_code, source) if record[0] <= until]
+        # the first record is not a change, there is nothing to compare it to
+        first_timestamp = records[0][0] if records else None
+        for timestamp, _, changes in self.replay(records, since):
+            if timestamp <= since or timestamp == first_timestamp:
+                continue
+            refreshes += 1
+            if any(changes.added.values()) or any(changes.removed.values()):
+                changed += 1
+            for version in ADDRESS_LENGTHS:
+                added_addresses[version] += changes.added[version].address_count()
+                removed_addresses[version] += changes.removed[version].address_count()
+        return ChurnStats(refreshes, changed, added_addresses, removed_addresses)
+
+
+def encode_interval_sets(interval_sets: Mapping[int, IntervalSet]) -> dict[str, list[int]]:
+    # ranges as flat lists of first and last addresses
+    return {
+        str(version): list(itertools.chain.from_iterable(interval_set))
+        for version, interval_set in interval_sets.items()
+    }
+
+
+def decode_interval_sets(data: Mapping[str, Sequence[int]]) -> dict[int, IntervalSet]:
+    interval_sets = {version: IntervalSet(version) for version in ADDRESS_LENGTHS}
+    for version, bounds in data.items():
+        interval_sets[int(version)] = IntervalSet.from_sorted_ranges(
+            int(version), zip(bounds[::2], bounds[1::2])
+        )
+    return interval_sets
+
+
+def subtract_interval_sets(
+        first: Mapping[int, IntervalSet],
+        second: Mapping[int, IntervalSet],
+) -> dict[int, IntervalSet]:
+    empty_sets = {version: IntervalSet(version) for version in ADDRESS_LENGTHS}
+    return {
+        version: first.get(version, empty_set) - second.get(version, empty_set)
+        for version, empty_set in empty_sets.items()
+    }
+
+
+def parse_history_time(text_input: str) -> float:
+    # ISO 8601, UTC unless a time zone is given, or "now"
+    if text_input == "now":
+        return time.time()
+    try:
+        # fromisoformat() accepts "Z" only since Python 3.11
+        parsed = datetime.datetime.fromisoformat(
+            text_input[:-1] + "+00:00" if text_input.endswith("Z") else text_input
+        )
+    except ValueError as error:
+        raise ValueError(f"invalid time '{text_input}', use ISO 8601 or 'now'") from error
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
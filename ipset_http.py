@@ -0,0 +1,342 @@
+import gzip
+import hashlib
+import http.client
+import itertools
+import json
+import os.path
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+import email.message
+from http import HTTPStatus
+from typing import Mapping, NamedTuple, Optional, Any
+from ipset_metrics import count_metric
+
+
+def write_file_atomically(filename: str, content: bytes) -> None:
+    tmp_filename = f"{filename}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_filename, "wb") as tmp_file:
+        tmp_file.write(content)
+    os.replace(tmp_filename, filename)
+
+
+class UrlResponse(NamedTuple):
+    status: int
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class UrlCache:
+    # Entries younger than `ttl` seconds are used without any network traffic,
+    # older ones are revalidated with a conditional request. Once cached bodies
+    # exceed `max_size` bytes, the least recently used entries are evicted.
+    # In `offline` mode cached entries are used regardless of their age.
+
+    def __init__(
+            self,
+            directory: str,
+            ttl: float = 0,
+            max_size: Optional[int] = None,
+            offline: bool = False,
+    ) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (UrlCache, (self.directory, self.ttl, self.max_size, self.offline))
+
+    def read(self, url: str) -> bytes:
+        entry = self.load(url)
+        if entry is not None and (self.offline or time.time() - entry["stored"] < self.ttl):
+            return self.use(url, entry)
+        if self.offline:
+            raise ValueError(f"document not available in offline mode: {url}")
+        headers = {}
+        if entry is not None and entry["status"] == HTTPStatus.OK:
+            if entry["etag"] is not None:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"] is not None:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            response = fetch_url(url, headers)
+        except urllib.error.HTTPError as http_error:
+            if http_error.code == HTTPStatus.NOT_FOUND:
+                # remember missing documents too, e.g. IPdeny IPv6 zones
+                self.store(url, UrlResponse(http_error.code, b"", None, None))
+            raise
+        if response.status == HTTPStatus.NOT_MODIFIED and entry is not None:
+            entry["stored"] = time.time()
+            self.store_entry(url, entry)
+            return self.use(url, entry)
+        self.store(url, response)
+        return response.body
+
+    def filename(self, url: str, extension: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def load(self, url: str) -> Optional[dict[str, Any]]:
+        try:
+            with open(self.filename(url, "json"), encoding="utf-8") as entry_file:
+                entry: dict[str, Any] = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url or not os.path.exists(self.filename(url, "body")):
+            return None
+        return entry
+
+    def use(self, url: str, entry: Mapping[str, Any]) -> bytes:
+        if entry["status"] == HTTPStatus.NOT_FOUND:
+            raise urllib.error.HTTPError(
+                url, HTTPStatus.NOT_FOUND, "Not Found (cached)", http.client.HTTPMessage(), None
+            )
+        body_filename = self.filename(url, "body")
+        with self.lock:
+            with open(body_filename, "rb") as body_file:
+                body = body_file.read()
+            # the body file modification time tracks recent use, for LRU eviction
+            os.utime(body_filename)
+        return body
+
+    def store(self, url: str, response: UrlResponse) -> None:
+        with self.lock:
+            write_file_atomically(self.filename(url, "body"), response.body)
+        self.store_entry(url, {
+            "url": url,
+            "status": response.status,
+            "etag": response.etag,
+            "last_modified": response.last_modified,
+            "stored": time.time(),
+        })
+        self.evict()
+
+    def store_entry(self, url: str, entry: Mapping[str, Any]) -> None:
+        with self.lock:
+            write_file_atomically(self.filename(url, "json"), json.dumps(entry).encode("utf-8"))
+
+    def evict(self) -> None:
+        if self.max_size is None:
+            return
+        with self.lock:
+            bodies = []
+            for filename in os.listdir(self.directory):
+                if filename.endswith(".body"):
+                    stat = os.stat(os.path.join(self.directory, filename))
+                    bodies.append((stat.st_mtime, stat.st_size, filename))
+            total_size = sum(size for _, size, _ in bodies)
+            for _, size, filename in sorted(bodies):
+                if total_size <= self.max_size:
+                    break
+                for extension in ("body", "json"):
+                    path = os.path.join(self.directory, filename[:-len("body")] + extension)
+                    if os.path.exists(path):
+                        os.remove(path)
+                total_size -= size
+
+
+_url_cache: Optional[UrlCache] = None # pylint: disable=invalid-name
+
+
+def install_url_cache(cache: Optional[UrlCache]) -> None:
+    global _url_cache # pylint: disable=global-statement; mirrors urllib.request.install_opener
+    _url_cache = cache
+
+
+def installed_url_cache() -> Optional[UrlCache]:
+    return _url_cache
+
+
+def read_url(url: str) -> bytes:
+    if _url_cache is not None:
+        body = _url_cache.read(url)
+    else:
+        body = fetch_url(url).body
+    count_metric("bytes_read", len(body))
+    return body
+
+
+def fetch_url(url: str, headers: Optional[Mapping[str, str]] = None) -> UrlResponse:
+    return _http_client.fetch(url, headers)
+
+
+class HttpResponse(NamedTuple):
+    status: int
+    reason: str
+    headers: email.message.Message
+    body: bytes
+
+
+class HttpClient:
+    # GET requests over persistent connections, pooled per host because
+    # downloads run in parallel threads. Bodies are requested compressed, and
+    # connection errors and server errors are retried with exponential backoff.
+
+    def __init__(
+            self,
+            connect_timeout: float = 10,
+            read_timeout: float = 60,
+            retries: int = 3,
+            backoff: float = 1,
+    ) -> None:
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.idle_connections: dict[tuple[str, str], list[http.client.HTTPConnection]] = {}
+        self.lock = threading.Lock()
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # copies and pickles have the same settings, but no connections
+        return (HttpClient, (self.connect_timeout, self.read_timeout, self.retries, self.backoff))
+
+    def fetch(self, url: str, headers: Optional[Mapping[str, str]] = None) -> UrlResponse:
+        request_headers = {"Accept-Encoding": "gzip, deflate", **(headers or {})}
+        for _ in range(HTTP_MAX_REDIRECTS + 1):
+            response = self.request_with_retries(url, request_headers)
+            location = response.headers.get("Location")
+            if response.status not in HTTP_REDIRECT_STATUSES or not location:
+                break
+            url = urllib.parse.urljoin(url, location)
+        else:
+            raise ValueError(f"too many redirects: {url}")
+        if response.status == HTTPStatus.NOT_MODIFIED:
+            return UrlResponse(response.status, b"", None, None)
+        if response.status >= HTTPStatus.BAD_REQUEST:
+            raise urllib.error.HTTPError(
+                url, response.status, response.reason, response.headers, None
+            )
+        if response.status != HTTPStatus.OK:
+            raise ValueError(f"unexpected HTTP code: {response.status}")
+        count_metric("bytes_downloaded", len(response.body))
+        return UrlResponse(
+            status=response.status,
+            body=decode_content(response.body, response.headers.get("Content-Encoding")),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+
+    def request_with_retries(self, url: str, headers: Mapping[str, str]) -> HttpResponse:
+        for attempt in itertools.count():
+            try:
+                response = self.request(url, headers)
+            except (OSError, http.client.HTTPException):
+                if attempt >= self.retries:
+                    raise
+            else:
+                if response.status < HTTPStatus.INTERNAL_SERVER_ERROR or attempt >= self.retries:
+                    return response
+            time.sleep(self.backoff * 2 ** attempt)
+        raise AssertionError("unreachable")
+
+    def request(self, url: str, headers: Mapping[str, str]) -> HttpResponse:
+        split_url = urllib.parse.urlsplit(url)
+        if urllib.request.getproxies().get(split_url.scheme) \
+                and not urllib.request.proxy_bypass(split_url.hostname or ""):
+            return self.request_with_urllib(url, headers)
+        key = (split_url.scheme, split_url.netloc)
+        path = urllib.parse.urlunsplit(("", "", split_url.path or "/", split_url.query, ""))
+        connection, reused = self.acquire(key)
+        while True:
+            try:
+                connection.request("GET", path, headers=dict(headers))
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                if not reused:
+                    raise
+                # the server may have closed an idle connection, try a new one
+                connection, reused = self.acquire(key, reuse=False)
+        if response.will_close:
+            connection.close()
+        else:
+            with self.lock:
+                self.idle_connections.setdefault(key, []).append(connection)
+        return HttpResponse(response.status, response.reason, response.headers, body)
+
+    def request_with_urllib(self, url: str, headers: Mapping[str, str]) -> HttpResponse:
+        # plain urllib, which supports proxies, with a new connection each time
+        request = urllib.request.Request(url, headers=dict(headers))
+        try:
+            with urllib.request.urlopen(request, timeout=self.read_timeout) as response:
+                return HttpResponse(response.status, response.reason, response.headers,
+                                    response.read())
+        except urllib.error.HTTPError as http_error:
+            return HttpResponse(http_error.code, http_error.reason, http_error.headers,
+                                http_error.read())
+
+    def acquire(
+            self,
+            key: tuple[str, str],
+            reuse: bool = True,
+    ) -> tuple[http.client.HTTPConnection, bool]:
+        if reuse:
+            with self.lock:
+                idle_connections = self.idle_connections.get(key)
+                if idle_connections:
+                    return idle_connections.pop(), True
+        scheme, host = key
+        connection: http.client.HTTPConnection
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, timeout=self.connect_timeout)
+        elif scheme == "http":
+            connection = http.client.HTTPConnection(host, timeout=self.connect_timeout)
+        else:
+            raise ValueError(f"unsupported URL scheme: {scheme}")
+        connection.connect()
+        if connection.sock is not None:
+            connection.sock.settimeout(self.read_timeout)
+        return connection, False
+
+    def close(self) -> None:
+        with self.lock:
+            for connections in self.idle_connections.values():
+                for connection in connections:
+                    connection.close()
+            self.idle_connections.clear()
+
+
+HTTP_MAX_REDIRECTS = 5
+
+HTTP_REDIRECT_STATUSES = (
+    HTTPStatus.MOVED_PERMANENTLY,
+    HTTPStatus.FOUND,
+    HTTPStatus.SEE_OTHER,
+    HTTPStatus.TEMPORARY_REDIRECT,
+    HTTPStatus.PERMANENT_REDIRECT,
+)
+
+
+def decode_content(body: bytes, content_encoding: Optional[str]) -> bytes:
+    if content_encoding in (None, "", "identity"):
+        return body
+    if content_encoding in ("gzip", "x-gzip"):
+        return gzip.decompress(body)
+    if content_encoding == "deflate":
+        # zlib wrapped, as specified, or raw deflate, as sent by some servers
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    raise ValueError(f"unsupported content encoding: {content_encoding}")
+
+
+_http_client = HttpClient() # pylint: disable=invalid-name
+
+
+def install_http_client(client: HttpClient) -> None:
+    global _http_client # pylint: disable=global-statement; same as install_url_cache
+    _http_client = client
+
+
+def installed_http_client() -> HttpClient:
+    return _http_client
@@ -0,0 +1,189 @@
+import ipaddress
+import array
+import bisect
+import heapq
+from typing import Iterable, Iterator, MutableSequence, Union, Callable
+
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+NETWORK_CLASSES: dict[int, Callable[[tuple[int, int]], Network]] = {
+    4: ipaddress.IPv4Network,
+    6: ipaddress.IPv6Network,
+}
+
+ADDRESS_CLASSES: dict[int, Callable[[int], Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]] = {
+    4: ipaddress.IPv4Address,
+    6: ipaddress.IPv6Address,
+}
+
+ADDRESS_LENGTHS = {
+    4: ipaddress.IPV4LENGTH,
+    6: ipaddress.IPV6LENGTH,
+}
+
+
+def int_array(version: int, values: Iterable[int]) -> MutableSequence[int]:
+    # IPv6 values don't fit in any machine type
+    if version == 4:
+        return array.array("Q", values)
+    return list(values)
+
+
+class IntervalSet:
+    # Address space of a single IP version, as sorted, disjoint and non-adjacent
+    # (first, last) address ranges kept in two parallel integer arrays.
+
+    __slots__ = ("version", "firsts", "lasts")
+
+    def __init__(self, version: int, firsts: Iterable[int] = (), lasts: Iterable[int] = ()) -> None:
+        self.version = version
+        self.firsts = int_array(version, firsts)
+        self.lasts = int_array(version, lasts)
+
+    @classmethod
+    def from_ranges(cls, version: int, ranges: Iterable[tuple[int, int]]) -> "IntervalSet":
+        return cls.from_sorted_ranges(version, sorted(ranges))
+
+    @classmethod
+    def from_sorted_ranges(cls, version: int, ranges: Iterable[tuple[int, int]]) -> "IntervalSet":
+        firsts = int_array(version, ())
+        lasts = int_array(version, ())
+        for first, last in ranges:
+            if lasts and first <= lasts[-1] + 1:
+                if last > lasts[-1]:
+                    lasts[-1] = last
+            else:
+                firsts.append(first)
+                lasts.append(last)
+        interval_set = cls(version)
+        interval_set.firsts = firsts
+        interval_set.lasts = lasts
+        return interval_set
+
+    @classmethod
+    def from_networks(cls, version: int, networks: Iterable[Network]) -> "IntervalSet":
+        return cls.from_ranges(version, map(network_to_range, networks))
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        return zip(self.firsts, self.lasts)
+
+    def __len__(self) -> int:
+        return len(self.firsts)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, IntervalSet):
+            return NotImplemented
+        return (
+            self.version == other.version
+            and list(self.firsts) == list(other.firsts)
+            and list(self.lasts) == list(other.lasts)
+        )
+
+    __hash__ = None # type: ignore
+
+    def __repr__(self) -> str:
+        ranges = ", ".join(f"{first}-{last}" for first, last in self)
+        return f"IntervalSet({self.version}, [{ranges}])"
+
+    def __contains__(self, address: object) -> bool:
+        if not isinstance(address, int):
+            return False
+        index = bisect.bisect_right(self.firsts, address) - 1
+        return index >= 0 and address <= self.lasts[index]
+
+    def address_count(self) -> int:
+        return sum(self.lasts) - sum(self.firsts) + len(self.firsts)
+
+    def overlaps(self, first: int, last: int) -> bool:
+        index = bisect.bisect_right(self.firsts, last) - 1
+        return index >= 0 and self.lasts[index] >= first
+
+    def networks(self) -> Iterable[Network]:
+        for first, last in self:
+            yield from range_networks(self.version, first, last)
+
+    def union(self, other: "IntervalSet") -> "IntervalSet":
+        self.check_version(other)
+        return self.from_sorted_ranges(self.version, heapq.merge(self, other))
+
+    def intersection(self, other: "IntervalSet") -> "IntervalSet":
+        self.check_version(other)
+        firsts, lasts = [], []
+        index = other_index = 0
+        while index < len(self) and other_index < len(other):
+            first = max(self.firsts[index], other.firsts[other_index])
+            last = min(self.lasts[index], other.lasts[other_index])
+            if first <= last:
+                firsts.append(first)
+                lasts.append(last)
+            if self.lasts[index] < other.lasts[other_index]:
+                index += 1
+            else:
+                other_index += 1
+        return IntervalSet(self.version, firsts, lasts)
+
+    def difference(self, other: "IntervalSet") -> "IntervalSet":
+        self.check_version(other)
+        firsts, lasts = [], []
+        other_index = 0
+        for first, last in self:
+            while other_index < len(other) and other.lasts[other_index] < first:
+                other_index += 1
+            index = other_index
+            while index < len(other) and other.firsts[index] <= last and first <= last:
+                if other.firsts[index] > first:
+                    firsts.append(first)
+                    lasts.append(other.firsts[index] - 1)
+                first = other.lasts[index] + 1
+                index += 1
+            if first <= last:
+                firsts.append(first)
+                lasts.append(last)
+        return IntervalSet(self.version, firsts, lasts)
+
+    def symmetric_difference(self, other: "IntervalSet") -> "IntervalSet":
+        return self.difference(other).union(other.difference(self))
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
+
+    def check_version(self, other: "IntervalSet") -> None:
+        if self.version != other.version:
+            raise ValueError(f"IP version mismatch: {self.version} != {other.version}")
+
+
+def network_to_range(network: Network) -> tuple[int, int]:
+    # hostmask is a cached property, much slower than the prefix length
+    first = int(network.network_address)
+    return first, first | ((1 << (network.max_prefixlen - network.prefixlen)) - 1)
+
+
+def range_networks(version: int, first: int, last: int) -> Iterable[Network]:
+    # minimal CIDR cover of a range, same as ipaddress.summarize_address_range
+    network_class = NETWORK_CLASSES[version]
+    max_prefixlen = ADDRESS_LENGTHS[version]
+    while first <= last:
+        host_bits = (first & -first).bit_length() - 1 if first else max_prefixlen
+        host_bits = min(host_bits, (last - first + 1).bit_length() - 1)
+        yield network_class((first, max_prefixlen - host_bits))
+        first += 1 << host_bits
+
+
+def network_interval_sets(networks: Iterable[Network]) -> dict[int, IntervalSet]:
+    return {
+        version: IntervalSet.from_networks(version, version_networks)
+        for version, version_networks in group_networks_by_version(networks).items()
+    }
+
+
+def group_networks_by_version(networks: Iterable[Network]) -> dict[int, list[Network]]:
+    networks_grouped_by_version: dict[int, list[Network]] = {
+        4: [],
+        6: [],
+    }
+    for network in networks:
+        networks_grouped_by_version[network.version].append(network)
+    return networks_grouped_by_version
@@ -0,0 +1,124 @@
+import bisect
+import ipaddress
+import itertools
+from typing import Iterable, Mapping, Collection, MutableSequence, NamedTuple, Union, Optional
+from ipset_intervals import (
+    Network, ADDRESS_LENGTHS, IntervalSet, int_array, network_interval_sets,
+)
+from ipset_metrics import count_metric
+from ipset_snapshot import Snapshot
+
+
+class CountryIndex:
+    # Address -> country codes lookup. Networks of all countries are split into
+    # sorted, disjoint ranges, each labeled with all the countries covering it
+    # (sources may disagree), and searched with bisection.
+
+    def __init__(self, country_interval_sets: Mapping[str, Mapping[int, IntervalSet]]) -> None:
+        self.firsts: dict[int, MutableSequence[int]] = {}
+        self.lasts: dict[int, MutableSequence[int]] = {}
+        self.labels: dict[int, list[tuple[str, ...]]] = {}
+        for version in ADDRESS_LENGTHS:
+            segments = list(label_ranges(
+                (first, last, country_code)
+                for country_code, interval_sets in country_interval_sets.items()
+                if version in interval_sets
+                for first, last in interval_sets[version]
+            ))
+            self.firsts[version] = int_array(version, (first for first, _, _ in segments))
+            self.lasts[version] = int_array(version, (last for _, last, _ in segments))
+            self.labels[version] = [labels for _, _, labels in segments]
+
+    @classmethod
+    def from_networks(cls, country_networks: Mapping[str, Iterable[Network]]) -> "CountryIndex":
+        return cls({
+            country_code: network_interval_sets(networks)
+            for country_code, networks in country_networks.items()
+        })
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot) -> "CountryIndex":
+        return cls({
+            country_code: snapshot.interval_sets(country_code)
+            for country_code in snapshot.country_codes()
+        })
+
+    @classmethod
+    def from_set_entries(
+            cls,
+            entries: Mapping[str, Iterable[Network]],
+            country_codes: Collection[str] = (),
+    ) -> "CountryIndex":
+        # sets other than the generated country sets are labeled with their names
+        country_networks: dict[str, list[Network]] = {}
+        for set_name, networks in entries.items():
+            country_code = set_name_country_code(set_name)
+            if not country_codes or country_code in country_codes:
+                country_networks.setdefault(country_code, []).extend(networks)
+        return cls.from_networks(country_networks)
+
+    def lookup(
+            self,
+            address: Union[str, ipaddress.IPv4Address, ipaddress.IPv6Address],
+    ) -> tuple[str, ...]:
+        if isinstance(address, str):
+            address = ipaddress.ip_address(address)
+        return self.lookup_int(address.version, int(address))
+
+    def lookup_int(self, version: int, address: int) -> tuple[str, ...]:
+        index = bisect.bisect_right(self.firsts[version], address) - 1
+        if index >= 0 and address <= self.lasts[version][index]:
+            return self.labels[version][index]
+        return ()
+
+
+def label_ranges(
+        ranges: Iterable[tuple[int, int, str]],
+) -> Iterable[tuple[int, int, tuple[str, ...]]]:
+    # Sweeps over range boundaries, ranges of a single label must not overlap
+    # or touch each other (as in an IntervalSet).
+    boundaries = sorted(itertools.chain.from_iterable(
+        ((first, label, True), (last + 1, label, False)) for first, last, label in ranges
+    ))
+    active: set[str] = set()
+    labels_cache: dict[tuple[str, ...], tuple[str, ...]] = {}
+    start = 0
+    for position, events in itertools.groupby(boundaries, key=lambda boundary: boundary[0]):
+        if active:
+            labels = tuple(sorted(active))
+            yield start, position - 1, labels_cache.setdefault(labels, labels)
+        for _, label, starts in events:
+            if starts:
+                active.add(label)
+            else:
+                active.discard(label)
+        start = position
+
+
+def set_name_country_code(set_name: str) -> str:
+    # country-pl-v4 -> pl, other set names only lose the IP version suffix
+    for version in ADDRESS_LENGTHS:
+        set_name = set_name.removesuffix(f"-v{version}")
+    return set_name.removeprefix("country-")
+
+
+class LookupResult(NamedTuple):
+    address: str
+    country_codes: tuple[str, ...]
+    error: Optional[ValueError]
+
+
+def lookup_addresses(index: CountryIndex, lines: Iterable[str]) -> Iterable[LookupResult]:
+    for line in lines:
+        address = line.strip()
+        if not address:
+            continue
+        try:
+            country_codes = index.lookup(address)
+        except ValueError as value_error:
+            yield LookupResult(address, (), value_error)
+            continue
+        count_metric("addresses", 1)
+        if country_codes:
+            count_metric("matches", 1)
+        yield LookupResult(address, country_codes, None)
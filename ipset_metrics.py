@@ -0,0 +1,82 @@
+import contextlib
+import json
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Any, ContextManager
+
+
+class Metrics:
+    # Wall time and counters of pipeline stages, one record per stage, country
+    # and data source. Counters are reported by the code running in a stage
+    # through count_metric(), which is a no-op outside of measured stages.
+
+    def __init__(self) -> None:
+        self.records: list[dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(
+            self,
+            country_code: str,
+            stage: str,
+            source: Optional[str] = None,
+    ) -> Iterator[dict[str, int]]:
+        counters: dict[str, int] = {}
+        outer_counters = getattr(_stage_counters, "counters", None)
+        _stage_counters.counters = counters
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield counters
+            failed = False
+        finally:
+            _stage_counters.counters = outer_counters
+            record = {
+                "country": country_code,
+                "stage": stage,
+                "source": source,
+                "seconds": time.perf_counter() - start,
+                "failed": int(failed),
+                **counters,
+            }
+            with self.lock:
+                self.records.append(record)
+
+    def json_lines(self) -> Iterable[str]:
+        return (json.dumps(record) for record in self.records)
+
+    def textfile_lines(self) -> Iterable[str]:
+        # Prometheus text format, e.g. for the node exporter textfile collector
+        samples: dict[str, list[str]] = {}
+        for record in self.records:
+            labels = ",".join(
+                f'{label}="{record[label]}"'
+                for label in ("country", "stage", "source")
+                if record[label] is not None
+            )
+            for name, value in record.items():
+                if name not in ("country", "stage", "source"):
+                    samples.setdefault(name, []).append(f"ipset_country_{name}{{{labels}}} {value}")
+        for name, metric_samples in samples.items():
+            yield f"# TYPE ipset_country_{name} gauge"
+            yield from metric_samples
+
+
+_stage_counters = threading.local()
+
+
+def measure_stage(
+        metrics: Optional[Metrics],
+        country_code: str,
+        stage: str,
+        source: Optional[str] = None,
+) -> ContextManager[dict[str, int]]:
+    if metrics is None:
+        return contextlib.nullcontext({})
+    return metrics.stage(country_code, stage, source)
+
+
+def count_metric(name: str, value: int) -> None:
+    counters = getattr(_stage_counters, "counters", None)
+    if counters is not None:
+        counters[name] = counters.get(name, 0) + value
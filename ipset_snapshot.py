@@ -0,0 +1,128 @@
+import array
+import contextlib
+import hashlib
+import json
+import mmap
+import struct
+import sys
+import time
+from typing import Iterable, Iterator, Mapping, MutableSequence, Union, Optional, Any
+from ipset_intervals import Network, IntervalSet, int_array, network_interval_sets
+
+
+SNAPSHOT_MAGIC = b"IPSETSNP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<8sHHI")
+SNAPSHOT_ADDRESS_SIZES = {4: 4, 6: 16}
+
+
+def snapshot_bytes(
+        country_networks: Mapping[str, Iterable[Network]],
+        metadata: Optional[Mapping[str, Any]] = None,
+) -> bytes:
+    # Header, JSON metadata and, for each country and IP version, the first and
+    # last addresses of its collapsed ranges as two packed arrays: little
+    # endian 32 bit integers for IPv4, big endian 128 bit integers for IPv6.
+    data = bytearray()
+    countries = {}
+    for country_code, networks in country_networks.items():
+        networks = list(networks)
+        offset = len(data)
+        ranges = {}
+        address_counts = {}
+        for version, interval_set in network_interval_sets(networks).items():
+            data += pack_addresses(version, interval_set.firsts)
+            data += pack_addresses(version, interval_set.lasts)
+            ranges[str(version)] = len(interval_set)
+            address_counts[str(version)] = interval_set.address_count()
+        countries[country_code] = {
+            "offset": offset,
+            "size": len(data) - offset,
+            "sha256": hashlib.sha256(data[offset:]).hexdigest(),
+            "networks": len(networks),
+            "ranges": ranges,
+            "address_counts": address_counts,
+        }
+    metadata_bytes = json.dumps(
+        {"created": int(time.time()), **(metadata or {}), "countries": countries},
+        sort_keys=True,
+    ).encode("ascii")
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, len(metadata_bytes))
+    padding = bytes(-(len(header) + len(metadata_bytes)) % 16)
+    return header + metadata_bytes + padding + data
+
+
+def pack_addresses(version: int, values: Iterable[int]) -> bytes:
+    if version == 4:
+        packed = array.array("I", values)
+        if sys.byteorder == "big":
+            packed.byteswap()
+        return packed.tobytes()
+    return b"".join(value.to_bytes(16, "big") for value in values)
+
+
+def unpack_addresses(version: int, buffer: memoryview) -> MutableSequence[int]:
+    if version == 4:
+        unpacked = array.array("I")
+        unpacked.frombytes(buffer)
+        if sys.byteorder == "big":
+            unpacked.byteswap()
+        return int_array(version, unpacked)
+    return [int.from_bytes(buffer[index:index + 16], "big") for index in range(0, len(buffer), 16)]
+
+
+class Snapshot:
+    # Read-only view of a snapshot, only the metadata is decoded up front,
+    # ranges are decoded (and verified) for the requested countries.
+
+    def __init__(self, buffer: Union[bytes, mmap.mmap]) -> None:
+        self.buffer = memoryview(buffer)
+        if len(self.buffer) < SNAPSHOT_HEADER.size:
+            raise ValueError("not a snapshot: file too short")
+        magic, version, _, metadata_length = SNAPSHOT_HEADER.unpack_from(self.buffer)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("not a snapshot: invalid header")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version: {version}")
+        metadata_end = SNAPSHOT_HEADER.size + metadata_length
+        self.metadata = json.loads(bytes(self.buffer[SNAPSHOT_HEADER.size:metadata_end]))
+        self.data_offset = metadata_end + -metadata_end % 16
+
+    def country_codes(self) -> list[str]:
+        return sorted(self.metadata["countries"])
+
+    def interval_sets(self, country_code: str) -> dict[int, IntervalSet]:
+        if country_code not in self.metadata["countries"]:
+            raise ValueError(f"country '{country_code}' not in snapshot")
+        country = self.metadata["countries"][country_code]
+        start = self.data_offset + country["offset"]
+        if hashlib.sha256(self.buffer[start:start + country["size"]]).hexdigest() \
+                != country["sha256"]:
+            raise ValueError(f"snapshot data of country '{country_code}' is corrupted")
+        interval_sets = {}
+        for version_key, range_count in country["ranges"].items():
+            version = int(version_key)
+            size = range_count * SNAPSHOT_ADDRESS_SIZES[version]
+            interval_set = IntervalSet(version)
+            interval_set.firsts = unpack_addresses(version, self.buffer[start:start + size])
+            start += size
+            interval_set.lasts = unpack_addresses(version, self.buffer[start:start + size])
+            start += size
+            interval_sets[version] = interval_set
+        return interval_sets
+
+    def networks(self, country_code: str) -> Iterable[Network]:
+        for interval_set in self.interval_sets(country_code).values():
+            yield from interval_set.networks()
+
+
+@contextlib.contextmanager
+def open_snapshot(filename: str) -> Iterator[Snapshot]:
+    # memory mapped, so that reading a few countries doesn't load the others
+    with open(filename, "rb") as snapshot_file, \
+            mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot_map:
+        snapshot = Snapshot(snapshot_map)
+        try:
+            yield snapshot
+        finally:
+            snapshot.buffer.release()
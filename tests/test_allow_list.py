@@ -0,0 +1,80 @@
+import pytest
+from ipset import (
+    IntervalSet, network_interval_sets, parse_allow_list, subtract_networks,
+    process_networks, GenerationOptions,
+)
+from .util import networks
+
+
+def test_split_into_minimal_networks() -> None:
+    result = subtract_networks(
+        networks("10.0.0.0/22", "3fff::/20"),
+        network_interval_sets(networks("10.0.1.0/25", "10.0.3.255")),
+    )
+    assert result.networks == networks(
+        "10.0.0.0/24",
+        "10.0.1.128/25",
+        "10.0.2.0/24",
+        "10.0.3.0/25",
+        "10.0.3.128/26",
+        "10.0.3.192/27",
+        "10.0.3.224/28",
+        "10.0.3.240/29",
+        "10.0.3.248/30",
+        "10.0.3.252/31",
+        "10.0.3.254/32",
+        "3fff::/20",
+    )
+    assert result.removed_sizes == {4: 129, 6: 0}
+
+
+def test_non_overlapping_networks_are_kept() -> None:
+    # e.g. networks merged by minimize_networks, which are not a minimal cover
+    result = subtract_networks(
+        networks("10.0.0.0/24", "10.0.1.0/24", "10.1.0.0/16"),
+        network_interval_sets(networks("10.1.255.0/24")),
+    )
+    assert result.networks == networks(
+        "10.0.0.0/24", "10.0.1.0/24", "10.1.0.0/17", "10.1.128.0/18", "10.1.192.0/19",
+        "10.1.224.0/20", "10.1.240.0/21", "10.1.248.0/22", "10.1.252.0/23", "10.1.254.0/24",
+    )
+
+
+def test_whole_networks_removed() -> None:
+    result = subtract_networks(
+        networks("10.0.0.0/24", "3fff::/32"),
+        network_interval_sets(networks("10.0.0.0/8", "3fff::/16")),
+    )
+    assert not result.networks
+    assert result.removed_sizes == {4: 256, 6: 2 ** 96}
+
+
+def test_process_networks() -> None:
+    options = GenerationOptions(
+        max_overshoot=0, allowed_sets=network_interval_sets(networks("10.0.0.0/25"))
+    )
+    assert process_networks(
+        "zz", [networks("10.0.0.0/24"), networks("10.0.0.0/24")], options
+    ) == networks("10.0.0.128/25")
+
+
+def test_parse() -> None:
+    assert parse_allow_list("10.0.0.0/24\n\n# comment\n3fff::1 # monitoring\n") == networks(
+        "10.0.0.0/24", "3fff::1/128"
+    )
+
+
+@pytest.mark.parametrize("text_input", ("10.0.0.1/24\n", "foo\n", "10.0.0.0/33\n"))
+def test_parse_invalid(text_input: str) -> None:
+    with pytest.raises(ValueError):
+        parse_allow_list(text_input)
+
+
+def test_overlaps() -> None:
+    interval_set = IntervalSet(4, [10, 20], [14, 24])
+    assert interval_set.overlaps(0, 10)
+    assert interval_set.overlaps(14, 19)
+    assert interval_set.overlaps(12, 13)
+    assert not interval_set.overlaps(15, 19)
+    assert not interval_set.overlaps(0, 9)
+    assert not interval_set.overlaps(25, 30)
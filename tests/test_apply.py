@@ -0,0 +1,130 @@
+import ipaddress
+import pytest
+from ipset import (
+    Network, apply_session, ipset_commands, ipset_restore, run_ipset, session_sets, verify_sets,
+    parse_ipset_state, SizingOptions,
+)
+from .util import data_filename
+
+# pylint: disable=redefined-outer-name; (for pytest fixtures)
+
+
+NETWORKS: list[Network] = [
+    ipaddress.IPv4Network("10.0.0.0/24"),
+    ipaddress.IPv4Network("192.0.2.1/32"),
+    ipaddress.IPv6Network("3fff::/20"),
+]
+
+
+@pytest.fixture
+def fake_ipset(tmp_path, monkeypatch):  # type: ignore # no way to properly typehint fixtures
+    monkeypatch.setenv("FAKE_IPSET_STATE", str(tmp_path / "sets.json"))
+    return data_filename("fake-ipset")
+
+
+def test_apply(fake_ipset: str) -> None:
+    assert apply_session(
+        "pl", ipset_commands("pl", NETWORKS), session_sets("pl", NETWORKS), fake_ipset
+    )
+
+    loaded = parse_ipset_state(run_ipset(["save"], fake_ipset))
+    assert loaded.entries == {
+        "country-pl-v4": set(NETWORKS[:2]),
+        "country-pl-v6": set(NETWORKS[2:]),
+    }
+
+
+def test_apply_again(fake_ipset: str) -> None:
+    for _ in range(2):
+        assert apply_session(
+            "pl", ipset_commands("pl", NETWORKS), session_sets("pl", NETWORKS), fake_ipset
+        )
+    assert run_ipset(["list", "-n"], fake_ipset).split() == ["country-pl-v4", "country-pl-v6"]
+
+
+def test_apply_resized(fake_ipset: str) -> None:
+    # a large headroom sizes the sets differently for each number of entries
+    for count in (1, 2):
+        assert apply_session(
+            "pl",
+            ipset_commands("pl", NETWORKS[:count], SizingOptions(10 ** 8)),
+            session_sets("pl", NETWORKS[:count]),
+            fake_ipset,
+        )
+
+
+def test_maxelem_mismatch(fake_ipset: str) -> None:
+    ipset_restore(ipset_commands("pl", NETWORKS, SizingOptions(maxelem=131072)), fake_ipset)
+    with pytest.raises(ValueError, match="Error in line 1: Set cannot be created"):
+        ipset_restore(ipset_commands("pl", NETWORKS), fake_ipset)
+
+
+def test_failed_restore(
+        fake_ipset: str,
+        monkeypatch: pytest.MonkeyPatch,
+        capsys: pytest.CaptureFixture[str],
+) -> None:
+    monkeypatch.setenv("FAKE_IPSET_FAIL", "192.0.2.1")
+
+    assert not apply_session(
+        "pl", ipset_commands("pl", NETWORKS), session_sets("pl", NETWORKS), fake_ipset
+    )
+
+    errors = capsys.readouterr().err.splitlines()
+    assert errors[0] == "pl: ipset restore failed: ipset v7.19: Error in line 5: Injected failure"
+    assert errors[1].startswith("pl: removed leftover set country-pl-v4.tmp-")
+    assert errors[2:] == [
+        "pl: 257 addresses missing from the loaded set country-pl-v4: 10.0.0.0/24, 192.0.2.1/32",
+        "pl: 324518553658426726783156020576256 addresses missing from the loaded set "
+        "country-pl-v6: 3fff::/20",
+    ]
+    assert run_ipset(["list", "-n"], fake_ipset).split() == ["country-pl-v4"]
+
+
+def test_long_session_fails_early(fake_ipset: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("FAKE_IPSET_FAIL", "10.0.0.0/24")
+    networks = list(ipaddress.IPv4Network("10.0.0.0/8").subnets(new_prefix=24))
+
+    with pytest.raises(ValueError, match="Error in line 4: Injected failure"):
+        ipset_restore(ipset_commands("pl", networks), fake_ipset)
+
+
+def test_dropped_entry(
+        fake_ipset: str,
+        monkeypatch: pytest.MonkeyPatch,
+        capsys: pytest.CaptureFixture[str],
+) -> None:
+    monkeypatch.setenv("FAKE_IPSET_DROP", "192.0.2.1/32")
+
+    assert not apply_session(
+        "pl", ipset_commands("pl", NETWORKS), session_sets("pl", NETWORKS), fake_ipset
+    )
+
+    assert capsys.readouterr().err.splitlines() == [
+        "pl: 1 addresses missing from the loaded set country-pl-v4: 192.0.2.1/32",
+    ]
+
+
+def test_verify_address_space(fake_ipset: str) -> None:
+    halves: list[Network] = [
+        ipaddress.IPv4Network("10.0.0.0/25"),
+        ipaddress.IPv4Network("10.0.0.128/25"),
+        ipaddress.IPv4Network("192.0.2.2/32"),
+    ]
+    ipset_restore(ipset_commands("pl", halves), fake_ipset)
+
+    verifications = list(verify_sets(session_sets("pl", NETWORKS), fake_ipset))
+
+    assert [verification.set_name for verification in verifications] \
+        == ["country-pl-v4", "country-pl-v6"]
+    assert list(verifications[0].missing.networks()) == [ipaddress.IPv4Network("192.0.2.1/32")]
+    assert list(verifications[0].unexpected.networks()) == [ipaddress.IPv4Network("192.0.2.2/32")]
+    assert not verifications[1].unexpected
+
+
+def test_missing_binary(tmp_path, capsys: pytest.CaptureFixture[str]) -> None:  # type: ignore
+    assert not apply_session(
+        "pl", ipset_commands("pl", NETWORKS), session_sets("pl", NETWORKS),
+        str(tmp_path / "ipset"),
+    )
+    assert "No such file or directory" in capsys.readouterr().err
@@ -0,0 +1,30 @@
+import ipaddress
+import benchmark
+from ipset import compare_address_space
+
+
+def test_dataset_sources_cover_mostly_the_same_space() -> None:
+    dataset = benchmark.generate_dataset("small", 1000, seed=1)
+
+    comparision = compare_address_space(dataset.ipdeny_networks, dataset.ripestat_networks)
+
+    assert comparision.common_networks
+    assert 0 < comparision.differences_sizes[4] < comparision.total_sizes[4] * 0.1
+    assert any(isinstance(network, ipaddress.IPv6Network) for network in dataset.ipdeny_networks)
+    assert b"-" in dataset.ripestat
+
+
+def test_run() -> None:
+    results = list(benchmark.run(["small"], 1, {"compare_networks", "ipset_commands"}))
+
+    assert [result.stage for result in results] == ["compare_networks", "ipset_commands"]
+    assert all(result.seconds > 0 and result.peak_bytes > 0 for result in results)
+
+
+def test_compare_results() -> None:
+    baseline = [{"dataset": "small", "stage": "foo", "seconds": 2.0, "peak_bytes": 100}]
+    results = [benchmark.StageResult("small", "foo", 1.0, 300, 0)]
+
+    assert list(benchmark.compare_results(baseline, results)) == [
+        f"small    {'foo':32} time x0.50 memory x3.00",
+    ]
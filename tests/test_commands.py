@@ -1,9 +1,7 @@
 import ipaddress
-import time
 from typing import List
 import pytest
-from pytest_mock.plugin import MockerFixture
-from ipset import Network, ipset_commands
+from ipset import Network, SizingOptions, ipset_commands, ipset_create_options
 
 
 @pytest.mark.parametrize(
@@ -15,14 +13,16 @@ from ipset import Network, ipset_commands
             ],
             [
                 "create -exist country-ZZ-v4 hash:net family inet",
-                "create country-ZZ-v4.tmp-290619060010 hash:net family inet",
-                "add country-ZZ-v4.tmp-290619060010 127.0.0.0/24",
-                "swap country-ZZ-v4 country-ZZ-v4.tmp-290619060010",
-                "destroy country-ZZ-v4.tmp-290619060010",
+                "create -exist country-ZZ-v4.tmp-2cb800b2c0d0 hash:net family inet",
+                "flush country-ZZ-v4.tmp-2cb800b2c0d0",
+                "add country-ZZ-v4.tmp-2cb800b2c0d0 127.0.0.0/24",
+                "swap country-ZZ-v4 country-ZZ-v4.tmp-2cb800b2c0d0",
+                "destroy country-ZZ-v4.tmp-2cb800b2c0d0",
                 "create -exist country-ZZ-v6 hash:net family inet6",
-                "create country-ZZ-v6.tmp-290619060010 hash:net family inet6",
-                "swap country-ZZ-v6 country-ZZ-v6.tmp-290619060010",
-                "destroy country-ZZ-v6.tmp-290619060010",
+                "create -exist country-ZZ-v6.tmp-e3b0c44298fc hash:net family inet6",
+                "flush country-ZZ-v6.tmp-e3b0c44298fc",
+                "swap country-ZZ-v6 country-ZZ-v6.tmp-e3b0c44298fc",
+                "destroy country-ZZ-v6.tmp-e3b0c44298fc",
             ],
             id="single IPv4 network",
         ),
@@ -32,14 +32,16 @@ from ipset import Network, ipset_commands
             ],
             [
                 "create -exist country-ZZ-v4 hash:net family inet",
-                "create country-ZZ-v4.tmp-290619060010 hash:net family inet",
-                "swap country-ZZ-v4 country-ZZ-v4.tmp-290619060010",
-                "destroy country-ZZ-v4.tmp-290619060010",
+                "create -exist country-ZZ-v4.tmp-e3b0c44298fc hash:net family inet",
+                "flush country-ZZ-v4.tmp-e3b0c44298fc",
+                "swap country-ZZ-v4 country-ZZ-v4.tmp-e3b0c44298fc",
+                "destroy country-ZZ-v4.tmp-e3b0c44298fc",
                 "create -exist country-ZZ-v6 hash:net family inet6",
-                "create country-ZZ-v6.tmp-290619060010 hash:net family inet6",
-                "add country-ZZ-v6.tmp-290619060010 3fff::/20",
-                "swap country-ZZ-v6 country-ZZ-v6.tmp-290619060010",
-                "destroy country-ZZ-v6.tmp-290619060010",
+                "create -exist country-ZZ-v6.tmp-70c4a3d5f44d hash:net family inet6",
+                "flush country-ZZ-v6.tmp-70c4a3d5f44d",
+                "add country-ZZ-v6.tmp-70c4a3d5f44d 3fff::/20",
+                "swap country-ZZ-v6 country-ZZ-v6.tmp-70c4a3d5f44d",
+                "destroy country-ZZ-v6.tmp-70c4a3d5f44d",
             ],
             id="single IPv6 network",
         ),
@@ -50,15 +52,17 @@ from ipset import Network, ipset_commands
             ],
             [
                 "create -exist country-ZZ-v4 hash:net family inet",
-                "create country-ZZ-v4.tmp-290619060010 hash:net family inet",
-                "add country-ZZ-v4.tmp-290619060010 1.0.0.0/24",
-                "add country-ZZ-v4.tmp-290619060010 2.0.0.0/24",
-                "swap country-ZZ-v4 country-ZZ-v4.tmp-290619060010",
-                "destroy country-ZZ-v4.tmp-290619060010",
+                "create -exist country-ZZ-v4.tmp-3ef37d7cca57 hash:net family inet",
+                "flush country-ZZ-v4.tmp-3ef37d7cca57",
+                "add country-ZZ-v4.tmp-3ef37d7cca57 1.0.0.0/24",
+                "add country-ZZ-v4.tmp-3ef37d7cca57 2.0.0.0/24",
+                "swap country-ZZ-v4 country-ZZ-v4.tmp-3ef37d7cca57",
+                "destroy country-ZZ-v4.tmp-3ef37d7cca57",
                 "create -exist country-ZZ-v6 hash:net family inet6",
-                "create country-ZZ-v6.tmp-290619060010 hash:net family inet6",
-                "swap country-ZZ-v6 country-ZZ-v6.tmp-290619060010",
-                "destroy country-ZZ-v6.tmp-290619060010",
+                "create -exist country-ZZ-v6.tmp-e3b0c44298fc hash:net family inet6",
+                "flush country-ZZ-v6.tmp-e3b0c44298fc",
+                "swap country-ZZ-v6 country-ZZ-v6.tmp-e3b0c44298fc",
+                "destroy country-ZZ-v6.tmp-e3b0c44298fc",
             ],
             id="networks should be sorted",
         ),
@@ -67,10 +71,49 @@ from ipset import Network, ipset_commands
 def test_output(
         networks: List[Network],
         expected_commands: List[str],
-        mocker: MockerFixture,
 ) -> None:
-    mocker.patch("time.gmtime", return_value=time.gmtime(1876543210))
-
     output = list(ipset_commands("ZZ", networks))
 
     assert output == expected_commands
+
+
+@pytest.mark.parametrize(
+    "entry_count,headroom,maxelem,expected_options",
+    (
+        (0, 25, 65536, {}),
+        (800, 25, 65536, {}),
+        (900, 25, 65536, {"hashsize": 2048}),
+        (60000, 0, 65536, {"hashsize": 65536}),
+        (60000, 25, 65536, {"hashsize": 131072}),
+        (60000, 25, 262144, {"hashsize": 131072, "maxelem": 262144}),
+        (110000, 25, 262144, {"hashsize": 262144, "maxelem": 262144}),
+    ),
+)
+def test_create_options(
+        entry_count: int,
+        headroom: float,
+        maxelem: int,
+        expected_options: dict[str, int],
+) -> None:
+    assert ipset_create_options(entry_count, SizingOptions(headroom, maxelem)) \
+        == expected_options
+
+
+def test_large_set_options() -> None:
+    networks = list(ipaddress.IPv4Network("10.0.0.0/8").subnets(new_prefix=25))[:60000]
+
+    output = list(ipset_commands("ZZ", networks, SizingOptions(maxelem=262144)))
+
+    assert output[:2] == [
+        "create -exist country-ZZ-v4 hash:net family inet maxelem 262144",
+        "create -exist country-ZZ-v4.tmp-f0c331aea2e3 hash:net family inet "
+        "hashsize 131072 maxelem 262144",
+    ]
+
+
+def test_too_many_entries() -> None:
+    networks = list(ipaddress.IPv4Network("10.0.0.0/8").subnets(new_prefix=25))[:65537]
+
+    assert len(list(ipset_commands("ZZ", networks[:-1]))) == 65536 + 5 + 5
+    with pytest.raises(ValueError, match="has 65537 entries, more than maxelem 65536"):
+        list(ipset_commands("ZZ", networks))
@@ -0,0 +1,70 @@
+import ipaddress
+import pytest
+from ipset import (
+    compare_address_space, parse_address_space_limit, select_networks, AddressSpaceLimit,
+)
+
+
+def test_equivalent_aggregation() -> None:
+    comparision = compare_address_space(
+        [ipaddress.IPv4Network("1.0.0.0/23")],
+        [ipaddress.IPv4Network("1.0.0.0/24"), ipaddress.IPv4Network("1.0.1.0/24")],
+    )
+
+    assert list(comparision.common_networks) == [ipaddress.IPv4Network("1.0.0.0/23")]
+    assert not comparision.ipdeny_missing
+    assert not comparision.ripestat_missing
+    assert comparision.differences_sizes == {4: 0, 6: 0}
+    assert comparision.total_sizes == {4: 512, 6: 0}
+
+
+def test_partial_overlap() -> None:
+    comparision = compare_address_space(
+        [ipaddress.IPv4Network("1.0.0.0/23"), ipaddress.IPv6Network("3fff::/20")],
+        [ipaddress.IPv4Network("1.0.1.0/24"), ipaddress.IPv4Network("1.0.2.0/25")],
+    )
+
+    assert list(comparision.common_networks) == [ipaddress.IPv4Network("1.0.1.0/24")]
+    assert list(comparision.ipdeny_missing) == [ipaddress.IPv4Network("1.0.2.0/25")]
+    assert list(comparision.ripestat_missing) == [
+        ipaddress.IPv4Network("1.0.0.0/24"),
+        ipaddress.IPv6Network("3fff::/20"),
+    ]
+    assert comparision.differences_sizes == {4: 384, 6: 2 ** 108}
+    assert comparision.total_sizes == {4: 640, 6: 2 ** 108}
+    assert "IPv4 differences: 384 addresses (60.00% of 640)" in tuple(comparision.describe())
+
+
+@pytest.mark.parametrize(
+    "limit,exceeded",
+    (
+        ("511", True),
+        ("512", False),
+        ("49.9%", True),
+        ("50%", False),
+    ),
+)
+def test_limits(limit: str, exceeded: bool) -> None:
+    comparision = compare_address_space(
+        [ipaddress.IPv4Network("1.0.0.0/23"), ipaddress.IPv4Network("2.0.0.0/24")],
+        [ipaddress.IPv4Network("1.0.0.0/23"), ipaddress.IPv4Network("3.0.0.0/24")],
+    )
+
+    assert comparision.exceeds(parse_address_space_limit(limit)) == exceeded
+
+
+@pytest.mark.parametrize("limit", ("", "foo", "-1", "%", "-5%"))
+def test_invalid_limit(limit: str) -> None:
+    with pytest.raises(ValueError):
+        parse_address_space_limit(limit)
+
+
+def test_select_networks() -> None:
+    ipdeny_networks = [ipaddress.IPv4Network("1.0.0.0/23"), ipaddress.IPv4Network("2.0.0.0/24")]
+    ripestat_networks = [ipaddress.IPv4Network("1.0.0.0/24"), ipaddress.IPv4Network("1.0.1.0/24")]
+
+    with pytest.raises(ValueError, match="IPv4 differences: 256 addresses"):
+        select_networks(ipdeny_networks, ripestat_networks, 0, AddressSpaceLimit(0, False))
+    assert list(
+        select_networks(ipdeny_networks, ripestat_networks, 0, AddressSpaceLimit(256, False))
+    ) == [ipaddress.IPv4Network("1.0.0.0/23")]
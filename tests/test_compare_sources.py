@@ -0,0 +1,91 @@
+import pytest
+from pytest_mock.plugin import MockerFixture
+from ipset import (
+    GenerationOptions, IntervalSet, compare_sources, list_networks_batch,
+    parse_address_space_limit, quorum_interval_sets,
+)
+from .util import networks
+
+
+SOURCES = [
+    networks("10.0.0.0/24", "10.0.1.0/24", "3fff::/20"),
+    networks("10.0.0.0/23", "3fff::/20"),
+    networks("10.0.0.0/24", "10.0.2.0/24"),
+]
+
+
+def test_majority() -> None:
+    comparision = compare_sources(SOURCES, ["a", "b", "c"], 2)
+    assert comparision.common_networks == networks("10.0.0.0/23", "3fff::/20")
+    assert comparision.differences_sizes(0) == {4: 0, 6: 0}
+    assert comparision.differences_sizes(1) == {4: 0, 6: 0}
+    assert comparision.differences_sizes(2) == {4: 512, 6: 2 ** 108}
+    assert list(comparision.extra_sets[2][4].networks()) == networks("10.0.2.0/24")
+    assert list(comparision.missing_sets[2][4].networks()) == networks("10.0.1.0/24")
+    assert comparision.total_sizes == {4: 768, 6: 2 ** 108}
+
+
+def test_all_sources() -> None:
+    comparision = compare_sources(SOURCES, ["a", "b", "c"], 3)
+    assert comparision.common_networks == networks("10.0.0.0/24")
+    assert comparision.differences_count(0) == 2
+    assert comparision.differences_count(2) == 1
+
+
+def test_any_source() -> None:
+    comparision = compare_sources(SOURCES, ["a", "b", "c"], 1)
+    assert comparision.common_networks == networks("10.0.0.0/23", "10.0.2.0/24", "3fff::/20")
+
+
+@pytest.mark.parametrize("quorum", (0, 4))
+def test_invalid_quorum(quorum: int) -> None:
+    with pytest.raises(ValueError):
+        compare_sources(SOURCES, ["a", "b", "c"], quorum)
+
+
+def test_agreement_limits() -> None:
+    comparision = compare_sources(SOURCES, ["a", "b", "c"], 2)
+    assert comparision.agrees(0)
+    assert not comparision.agrees(2)
+    assert comparision.agrees(2, max_diff=3)
+    assert not comparision.agrees(2, space_limit=parse_address_space_limit("512"))
+    assert comparision.agrees(2, space_limit=parse_address_space_limit("100%"))
+
+
+def test_sweep_boundaries() -> None:
+    # touching ranges of different sources and ranges ending at the last address
+    source_sets = [
+        IntervalSet(4, [0, 10], [4, 2 ** 32 - 1]),
+        IntervalSet(4, [5], [2 ** 32 - 1]),
+        IntervalSet(4, [], []),
+    ]
+    accepted, extra, missing = quorum_interval_sets(source_sets, 2)
+    assert accepted == IntervalSet(4, [10], [2 ** 32 - 1])
+    assert extra == [IntervalSet(4, [0], [4]), IntervalSet(4, [5], [9]), IntervalSet(4)]
+    assert missing == [IntervalSet(4), IntervalSet(4), IntervalSet(4, [10], [2 ** 32 - 1])]
+
+
+def test_describe() -> None:
+    description = list(compare_sources(SOURCES, ["a", "b", "c"], 2).describe())
+    assert description == [
+        "addresses present in at least 2 of 3 sources",
+        "c IPv4: 256 addresses not accepted (10.0.2.0/24), "
+        "256 accepted addresses missing (10.0.1.0/24)",
+        f"c IPv6: 0 addresses not accepted (-), {2 ** 108} accepted addresses missing "
+        "(3fff::/20)",
+    ]
+
+
+def test_batch(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.list_ipdeny", return_value=SOURCES[0])
+    mocker.patch("ipset.list_ripestat", return_value=SOURCES[1])
+    mocker.patch("ipset.list_delegated", return_value=SOURCES[2])
+    sources = ("ipdeny", "ripestat", "delegated")
+
+    result, = list_networks_batch(["zz"], GenerationOptions(sources=sources, quorum=2))
+    assert result.error is None
+    assert list(result.networks) == networks("10.0.0.0/23", "3fff::/20")
+
+    result, = list_networks_batch(["zz"], GenerationOptions(sources=sources))
+    assert "sources within the difference limit: 0, required: 3" in str(result.error)
+    assert "RIR statistics IPv4" in str(result.error)
@@ -1,5 +1,5 @@
 import pytest
-from ipset import normalize_country_code
+from ipset import normalize_country_code, parse_country_codes
 
 
 @pytest.mark.parametrize(
@@ -32,3 +32,17 @@ def test_invalid_country_code(
 ) -> None:
     with pytest.raises(ValueError):
         normalize_country_code(input_country_code)
+
+
+def test_parse_plain_list() -> None:
+    assert parse_country_codes("pl\nDE cn\n\n") == ["pl", "de", "cn"]
+
+
+def test_parse_yaml_list() -> None:
+    text_input = "countries:\n  - xx\n  - yy # comment\n  -zz\n"
+    assert parse_country_codes(text_input) == ["xx", "yy", "zz"]
+
+
+def test_parse_invalid_list() -> None:
+    with pytest.raises(ValueError):
+        parse_country_codes("pl\nPOL\n")
@@ -0,0 +1,104 @@
+import ipaddress
+import pytest
+from ipset import parse_ipset_state
+from ipset_lookup import CountryIndex, label_ranges, lookup_addresses, set_name_country_code
+from ipset_snapshot import Snapshot, snapshot_bytes
+
+
+INDEX = CountryIndex.from_networks({
+    "pl": [
+        ipaddress.IPv4Network("10.0.0.0/16"),
+        ipaddress.IPv6Network("3fff::/20"),
+    ],
+    "de": [
+        ipaddress.IPv4Network("10.0.255.0/24"),
+        ipaddress.IPv4Network("10.1.0.0/24"),
+        ipaddress.IPv4Network("255.255.255.255/32"),
+    ],
+})
+
+
+@pytest.mark.parametrize(
+    "address,expected",
+    (
+        ("10.0.0.0", ("pl",)),
+        ("10.0.254.255", ("pl",)),
+        ("10.0.255.0", ("de", "pl")),
+        ("10.0.255.255", ("de", "pl")),
+        ("10.1.0.0", ("de",)),
+        ("10.1.0.255", ("de",)),
+        ("10.1.1.0", ()),
+        ("9.255.255.255", ()),
+        ("0.0.0.0", ()),
+        ("255.255.255.255", ("de",)),
+        ("3fff:fff::1", ("pl",)),
+        ("3fff:1000::", ()),
+        ("::a00:1", ()),
+    ),
+)
+def test_lookup(address: str, expected: tuple[str, ...]) -> None:
+    assert INDEX.lookup(address) == expected
+    assert INDEX.lookup(ipaddress.ip_address(address)) == expected
+
+
+def test_invalid_address() -> None:
+    with pytest.raises(ValueError):
+        INDEX.lookup("10.0.0")
+
+
+def test_empty_index() -> None:
+    assert not CountryIndex({}).lookup("10.0.0.1")
+
+
+def test_label_ranges() -> None:
+    assert list(label_ranges([(0, 10, "a"), (5, 7, "b"), (8, 20, "c"), (30, 40, "a")])) == [
+        (0, 4, ("a",)),
+        (5, 7, ("a", "b")),
+        (8, 10, ("a", "c")),
+        (11, 20, ("c",)),
+        (30, 40, ("a",)),
+    ]
+
+
+def test_from_snapshot() -> None:
+    snapshot = Snapshot(snapshot_bytes({"pl": [ipaddress.IPv4Network("10.0.0.0/8")]}))
+    assert CountryIndex.from_snapshot(snapshot).lookup("10.1.2.3") == ("pl",)
+
+
+def test_from_set_entries() -> None:
+    state = parse_ipset_state(
+        "create country-pl-v4 hash:net family inet\n"
+        "add country-pl-v4 10.0.0.0/8\n"
+        "create country-de-v4 hash:net family inet\n"
+        "add country-de-v4 10.0.0.0/24\n"
+        "create group-eu-v6 hash:net family inet6\n"
+        "add group-eu-v6 3fff::/20\n"
+        "create group-eu list:set\n"
+        "add group-eu group-eu-v6\n"
+    )
+    assert CountryIndex.from_set_entries(state.entries).lookup("10.0.0.1") == ("de", "pl")
+    assert CountryIndex.from_set_entries(state.entries).lookup("3fff::1") == ("group-eu",)
+    assert CountryIndex.from_set_entries(state.entries, ["pl"]).lookup("10.0.0.1") == ("pl",)
+
+
+@pytest.mark.parametrize(
+    "set_name,expected",
+    (
+        ("country-pl-v4", "pl"),
+        ("country-pl-v6", "pl"),
+        ("group-eu-v4", "group-eu"),
+        ("blocklist", "blocklist"),
+    ),
+)
+def test_set_name_country_code(set_name: str, expected: str) -> None:
+    assert set_name_country_code(set_name) == expected
+
+
+def test_lookup_addresses() -> None:
+    results = list(lookup_addresses(INDEX, ["10.0.0.1\n", "\n", " 3fff::1 \n", "foo\n"]))
+    assert [(result.address, result.country_codes) for result in results] == [
+        ("10.0.0.1", ("pl",)),
+        ("3fff::1", ("pl",)),
+        ("foo", ()),
+    ]
+    assert [result.error is None for result in results] == [True, True, False]
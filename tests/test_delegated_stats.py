@@ -0,0 +1,93 @@
+import ipaddress
+import pytest
+from pytest_mock.plugin import MockerFixture
+from ipset import parse_sources
+from ipset_delegated import (
+    DelegatedStats, delegated_record_to_range, load_delegated_stats, RIR_DELEGATED_URLS,
+)
+from .util import data_filename, read_test_file
+
+
+def test_country_index() -> None:
+    delegated_stats = load_delegated_stats([data_filename("delegated/delegated-test-extended")])
+    assert delegated_stats.country_codes() == ["de", "pl", "us"]
+    assert list(delegated_stats.networks("pl")) == [
+        ipaddress.IPv4Network("10.0.0.0/23"),
+        ipaddress.IPv4Network("10.1.0.0/23"),
+        ipaddress.IPv4Network("10.1.2.0/24"),
+        ipaddress.IPv6Network("3fff::/31"),
+    ]
+    assert list(delegated_stats.networks("de")) == [
+        ipaddress.IPv4Network("10.2.0.0/22"),
+        ipaddress.IPv6Network("3fff:10::/29"),
+    ]
+
+
+def test_unknown_country() -> None:
+    delegated_stats = load_delegated_stats([data_filename("delegated/delegated-test-extended")])
+    with pytest.raises(ValueError):
+        list(delegated_stats.networks("xx"))
+
+
+def test_multiple_registries() -> None:
+    delegated_stats = DelegatedStats()
+    delegated_stats.update([b"one|PL|ipv4|10.0.0.0|256|20000101|allocated|A1"])
+    delegated_stats.update([b"two|PL|ipv4|10.0.1.0|256|20000101|allocated|B1\n"])
+    assert list(delegated_stats.networks("pl")) == [ipaddress.IPv4Network("10.0.0.0/23")]
+
+
+def test_download(mocker: MockerFixture) -> None:
+    read_url = mocker.patch(
+        "ipset_delegated.read_url", return_value=read_test_file("delegated/delegated-test-extended")
+    )
+    delegated_stats = load_delegated_stats()
+    assert sorted(call.args[0] for call in read_url.call_args_list) == sorted(
+        RIR_DELEGATED_URLS.values()
+    )
+    assert delegated_stats.country_codes() == ["de", "pl", "us"]
+
+
+@pytest.mark.parametrize(
+    "version,start,value,expected",
+    (
+        (4, b"10.0.0.0", b"1", (0x0a000000, 0x0a000000)),
+        (4, b"10.0.0.0", b"768", (0x0a000000, 0x0a0002ff)),
+        (6, b"3fff::", b"128", (0x3fff << 112, 0x3fff << 112)),
+        (6, b"3fff::", b"16", (0x3fff << 112, (0x4000 << 112) - 1)),
+    ),
+)
+def test_record_to_range(
+        version: int,
+        start: bytes,
+        value: bytes,
+        expected: tuple[int, int],
+) -> None:
+    assert delegated_record_to_range(version, start, value) == expected
+
+
+@pytest.mark.parametrize(
+    "version,start,value",
+    (
+        (4, b"10.0.0.0", b"0"),
+        (4, b"10.0.0", b"256"),
+        (6, b"3fff::1", b"16"),
+        (6, b"3fff::", b"129"),
+    ),
+)
+def test_invalid_record(version: int, start: bytes, value: bytes) -> None:
+    with pytest.raises(ValueError):
+        delegated_record_to_range(version, start, value)
+
+
+def test_parse_sources() -> None:
+    assert parse_sources("ipdeny,delegated") == ("ipdeny", "delegated")
+    assert parse_sources(" RIPEstat , delegated") == ("ripestat", "delegated")
+    assert parse_sources("ipdeny,ripestat,delegated") == ("ipdeny", "ripestat", "delegated")
+
+
+@pytest.mark.parametrize(
+    "sources", ("ipdeny", "ipdeny,ipdeny", "ipdeny,foo", "a,b,c", "ipdeny,ripestat,ipdeny")
+)
+def test_invalid_sources(sources: str) -> None:
+    with pytest.raises(ValueError):
+        parse_sources(sources)
@@ -0,0 +1,206 @@
+import ipaddress
+import pytest
+from ipset import (
+    ipset_delta_commands, parse_ipset_entries, parse_ipset_state, IpsetState, SizingOptions,
+)
+
+
+def test_parse_generated_session() -> None:
+    text_input = "\n".join((
+        "create -exist country-ZZ-v4 hash:net family inet",
+        "create -exist country-ZZ-v4.tmp-ec59d94e89fa hash:net family inet",
+        "flush country-ZZ-v4.tmp-ec59d94e89fa",
+        "add country-ZZ-v4.tmp-ec59d94e89fa 1.0.0.0/24",
+        "swap country-ZZ-v4 country-ZZ-v4.tmp-ec59d94e89fa",
+        "destroy country-ZZ-v4.tmp-ec59d94e89fa",
+        "create -exist country-ZZ-v6 hash:net family inet6",
+        "create -exist country-ZZ-v6.tmp-e3b0c44298fc hash:net family inet6",
+        "flush country-ZZ-v6.tmp-e3b0c44298fc",
+        "swap country-ZZ-v6 country-ZZ-v6.tmp-e3b0c44298fc",
+        "destroy country-ZZ-v6.tmp-e3b0c44298fc",
+    ))
+    assert parse_ipset_entries(text_input) == {
+        "country-ZZ-v4": {ipaddress.IPv4Network("1.0.0.0/24")},
+        "country-ZZ-v6": set(),
+    }
+
+
+def test_parse_save_dump() -> None:
+    text_input = "\n".join((
+        "create country-ZZ-v4 hash:net family inet hashsize 1024 maxelem 65536",
+        "add country-ZZ-v4 1.0.0.0/24",
+        "add country-ZZ-v4 2.0.0.1",
+    ))
+    assert parse_ipset_entries(text_input) == {
+        "country-ZZ-v4": {
+            ipaddress.IPv4Network("1.0.0.0/24"),
+            ipaddress.IPv4Network("2.0.0.1/32"),
+        },
+    }
+
+
+def test_parse_other_set_types() -> None:
+    text_input = "\n".join((
+        "create group-eu-v4 hash:net family inet",
+        "add group-eu-v4 1.0.0.0/24",
+        "create group-eu list:set size 8",
+        "add group-eu group-eu-v4",
+    ))
+    assert parse_ipset_entries(text_input) == {
+        "group-eu-v4": {ipaddress.IPv4Network("1.0.0.0/24")},
+    }
+
+
+def test_parse_leftover_temporary_set() -> None:
+    text_input = "\n".join((
+        "create country-ZZ-v4 hash:net family inet hashsize 1024 maxelem 65536",
+        "add country-ZZ-v4 1.0.0.0/24",
+        "create country-ZZ-v4.tmp-ec59d94e89fa hash:net family inet hashsize 1024 maxelem 65536",
+        "add country-ZZ-v4.tmp-ec59d94e89fa 1.0.0.0/24",
+        "add country-ZZ-v4.tmp-ec59d94e89fa 2.0.0.0/24",
+    ))
+    assert parse_ipset_entries(text_input) == {
+        "country-ZZ-v4": {ipaddress.IPv4Network("1.0.0.0/24")},
+    }
+
+
+@pytest.mark.parametrize(
+    "text_input",
+    (
+        "add country-ZZ-v4",
+        "add country-ZZ-v4 1.0.0.0/24",
+        "create country-ZZ-v4 hash:net family inet\nswap country-ZZ-v4",
+        "destroy country-ZZ-v4",
+    ),
+)
+def test_parse_invalid(text_input: str) -> None:
+    with pytest.raises(ValueError):
+        parse_ipset_entries(text_input)
+
+
+@pytest.mark.parametrize(
+    "networks",
+    (
+        pytest.param([ipaddress.IPv4Network("2.0.0.0/24")], id="removed"),
+        pytest.param([ipaddress.IPv4Network(f"{i}.0.0.0/24") for i in range(1, 4)], id="added"),
+        pytest.param([ipaddress.IPv4Network(f"{i}.0.0.0/24") for i in range(1, 3)], id="same"),
+    ),
+)
+def test_delta_session_is_not_a_state(networks: list[ipaddress.IPv4Network]) -> None:
+    previous_state = parse_ipset_state("\n".join((
+        "create country-ZZ-v4 hash:net family inet",
+        "add country-ZZ-v4 1.0.0.0/24",
+        "add country-ZZ-v4 2.0.0.0/24",
+    )))
+    delta = "\n".join(ipset_delta_commands("ZZ", networks, previous_state, 1.0))
+    assert "swap country-ZZ-v4 " not in delta
+    with pytest.raises(ValueError, match="ipset save"):
+        parse_ipset_state(delta)
+
+
+def test_delta() -> None:
+    previous_entries = {
+        "country-ZZ-v4": {
+            ipaddress.IPv4Network("1.0.0.0/24"),
+            ipaddress.IPv4Network("2.0.0.0/24"),
+            ipaddress.IPv4Network("3.0.0.0/24"),
+        },
+        "country-ZZ-v6": set(),
+    }
+    networks = [
+        ipaddress.IPv4Network("1.0.0.0/24"),
+        ipaddress.IPv4Network("2.0.0.0/24"),
+        ipaddress.IPv4Network("4.0.0.0/24"),
+    ]
+
+    output = list(ipset_delta_commands("ZZ", networks, IpsetState(previous_entries, {}), 1.0))
+
+    assert output == [
+        "create -exist country-ZZ-v4 hash:net family inet",
+        "del -exist country-ZZ-v4 3.0.0.0/24",
+        "add -exist country-ZZ-v4 4.0.0.0/24",
+        "create -exist country-ZZ-v6 hash:net family inet6",
+    ]
+
+
+def test_fallback_to_swap() -> None:
+    previous_entries = {
+        "country-ZZ-v4": {ipaddress.IPv4Network("1.0.0.0/24")},
+    }
+    networks = [ipaddress.IPv4Network("2.0.0.0/24")]
+
+    output = list(ipset_delta_commands("ZZ", networks, IpsetState(previous_entries, {}), 0.5))
+
+    assert output == [
+        "create -exist country-ZZ-v4 hash:net family inet",
+        "create -exist country-ZZ-v4.tmp-0e2398f00e98 hash:net family inet",
+        "flush country-ZZ-v4.tmp-0e2398f00e98",
+        "add country-ZZ-v4.tmp-0e2398f00e98 2.0.0.0/24",
+        "swap country-ZZ-v4 country-ZZ-v4.tmp-0e2398f00e98",
+        "destroy country-ZZ-v4.tmp-0e2398f00e98",
+        "create -exist country-ZZ-v6 hash:net family inet6",
+        "create -exist country-ZZ-v6.tmp-e3b0c44298fc hash:net family inet6",
+        "flush country-ZZ-v6.tmp-e3b0c44298fc",
+        "swap country-ZZ-v6 country-ZZ-v6.tmp-e3b0c44298fc",
+        "destroy country-ZZ-v6.tmp-e3b0c44298fc",
+    ]
+
+
+def test_parse_options() -> None:
+    text_input = "\n".join((
+        "create country-ZZ-v4 hash:net family inet hashsize 4096 maxelem 131072 bucketsize 12",
+        "create country-ZZ-v6 hash:net family inet6 hashsize 1024 maxelem 65536 counters",
+    ))
+    assert parse_ipset_state(text_input).options == {
+        "country-ZZ-v4": {"hashsize": 4096, "maxelem": 131072},
+        "country-ZZ-v6": {"hashsize": 1024, "maxelem": 65536},
+    }
+
+
+def test_existing_maxelem_is_kept() -> None:
+    previous_state = parse_ipset_state("\n".join((
+        "create country-ZZ-v4 hash:net family inet hashsize 1024 maxelem 131072",
+        "add country-ZZ-v4 1.0.0.0/24",
+    )))
+    networks = [ipaddress.IPv4Network("1.0.0.0/24"), ipaddress.IPv4Network("2.0.0.0/24")]
+
+    output = list(ipset_delta_commands("ZZ", networks, previous_state, 1.0))
+
+    assert output[:2] == [
+        "create -exist country-ZZ-v4 hash:net family inet maxelem 131072",
+        "add -exist country-ZZ-v4 2.0.0.0/24",
+    ]
+
+
+def test_too_small_set_is_rebuilt() -> None:
+    previous_state = parse_ipset_state("\n".join((
+        "create country-ZZ-v4 hash:net family inet hashsize 1024 maxelem 2",
+        "add country-ZZ-v4 1.0.0.0/24",
+        "add country-ZZ-v4 2.0.0.0/24",
+    )))
+    networks = [
+        ipaddress.IPv4Network("1.0.0.0/24"),
+        ipaddress.IPv4Network("2.0.0.0/24"),
+        ipaddress.IPv4Network("3.0.0.0/24"),
+    ]
+
+    output = list(ipset_delta_commands("ZZ", networks, previous_state, 1.0))
+
+    assert output[:4] == [
+        "create -exist country-ZZ-v4 hash:net family inet maxelem 2",
+        "create -exist country-ZZ-v4.tmp-e8d60722dead hash:net family inet",
+        "flush country-ZZ-v4.tmp-e8d60722dead",
+        "add country-ZZ-v4.tmp-e8d60722dead 1.0.0.0/24",
+    ]
+
+
+def test_rebuild_over_maxelem() -> None:
+    previous_state = parse_ipset_state("\n".join((
+        "create country-ZZ-v4 hash:net family inet hashsize 1024 maxelem 2",
+        "add country-ZZ-v4 1.0.0.0/24",
+        "add country-ZZ-v4 2.0.0.0/24",
+    )))
+    networks = [ipaddress.IPv4Network(f"{i}.0.0.0/24") for i in range(1, 4)]
+
+    with pytest.raises(ValueError, match="maxelem 2"):
+        list(ipset_delta_commands("ZZ", networks, previous_state, 1.0, SizingOptions(maxelem=2)))
@@ -0,0 +1,64 @@
+import ipaddress
+import pytest
+from ipset import Network, ipset_group_commands, normalize_group_name, parse_ipset_state
+
+
+def test_union_of_countries() -> None:
+    networks: list[Network] = [
+        # first country
+        ipaddress.IPv4Network("10.0.0.0/24"),
+        ipaddress.IPv6Network("3fff::/21"),
+        # second country, adjacent and overlapping networks
+        ipaddress.IPv4Network("10.0.1.0/24"),
+        ipaddress.IPv4Network("10.0.0.128/25"),
+        ipaddress.IPv6Network("3fff:800::/21"),
+    ]
+    assert list(ipset_group_commands("eu", networks)) == [
+        "create -exist group-eu-v4 hash:net family inet",
+        "create -exist group-eu-v4.tmp-d770634b5ab4 hash:net family inet",
+        "flush group-eu-v4.tmp-d770634b5ab4",
+        "add group-eu-v4.tmp-d770634b5ab4 10.0.0.0/23",
+        "swap group-eu-v4 group-eu-v4.tmp-d770634b5ab4",
+        "destroy group-eu-v4.tmp-d770634b5ab4",
+        "create -exist group-eu-v6 hash:net family inet6",
+        "create -exist group-eu-v6.tmp-70c4a3d5f44d hash:net family inet6",
+        "flush group-eu-v6.tmp-70c4a3d5f44d",
+        "add group-eu-v6.tmp-70c4a3d5f44d 3fff::/20",
+        "swap group-eu-v6 group-eu-v6.tmp-70c4a3d5f44d",
+        "destroy group-eu-v6.tmp-70c4a3d5f44d",
+    ]
+
+
+def test_list_set() -> None:
+    commands = list(ipset_group_commands("eu", [], list_set=True))
+    assert commands[-3:] == [
+        "create -exist group-eu list:set",
+        "add -exist group-eu group-eu-v4",
+        "add -exist group-eu group-eu-v6",
+    ]
+
+
+def test_existing_options() -> None:
+    state = parse_ipset_state(
+        "create group-eu-v4 hash:net family inet hashsize 4096 maxelem 131072\n"
+    )
+    commands = list(ipset_group_commands("eu", [], previous_state=state))
+    assert commands[0] == "create -exist group-eu-v4 hash:net family inet maxelem 131072"
+
+
+@pytest.mark.parametrize(
+    "group_name,expected",
+    (
+        ("eu", "eu"),
+        ("ASIA", "asia"),
+        ("bad1", "bad1"),
+    ),
+)
+def test_valid_group_name(group_name: str, expected: str) -> None:
+    assert normalize_group_name(group_name) == expected
+
+
+@pytest.mark.parametrize("group_name", ("", "toolong", "e-u", "eu "))
+def test_invalid_group_name(group_name: str) -> None:
+    with pytest.raises(ValueError):
+        normalize_group_name(group_name)
@@ -0,0 +1,136 @@
+import ipaddress
+import os
+from typing import Mapping
+import pytest
+from pytest_mock.plugin import MockerFixture
+from ipset import GenerationOptions, list_networks_batch, history_results
+from ipset_intervals import Network, IntervalSet
+from ipset_history import HistoryStore, parse_history_time
+
+# pylint: disable=redefined-outer-name; (for pytest fixtures)
+
+DAY = 86400
+
+VERSIONS: list[list[Network]] = [
+    [ipaddress.IPv4Network("10.0.0.0/24"), ipaddress.IPv6Network("3fff::/20")],
+    [ipaddress.IPv4Network("10.0.0.0/23"), ipaddress.IPv6Network("3fff::/20")],
+    [ipaddress.IPv4Network("10.0.0.0/23"), ipaddress.IPv6Network("3fff::/20")],
+    [ipaddress.IPv4Network("10.0.1.0/24")],
+]
+
+
+@pytest.fixture
+def history(tmp_path) -> HistoryStore:  # type: ignore
+    store = HistoryStore(str(tmp_path), checkpoint_interval=2)
+    for day, networks in enumerate(VERSIONS, 1):
+        store.record("pl", networks, timestamp=day * DAY)
+    return store
+
+
+def networks(interval_sets: Mapping[int, IntervalSet]) -> list[Network]:
+    return [
+        network for interval_set in interval_sets.values() for network in interval_set.networks()
+    ]
+
+
+@pytest.mark.parametrize("day", range(1, len(VERSIONS) + 1))
+def test_state(history: HistoryStore, day: int) -> None:
+    assert networks(history.state("pl", day * DAY)) == VERSIONS[day - 1]
+    assert networks(history.state("pl", day * DAY + DAY // 2)) == VERSIONS[day - 1]
+
+
+def test_latest_state(history: HistoryStore) -> None:
+    assert networks(history.state("pl")) == VERSIONS[-1]
+
+
+def test_no_state(history: HistoryStore) -> None:
+    with pytest.raises(ValueError):
+        history.state("pl", DAY - 1)
+    with pytest.raises(ValueError):
+        history.state("de")
+
+
+def test_checkpoints(history: HistoryStore) -> None:
+    assert [kind for _, kind, _ in history.read("pl")] == ["full", "delta", "full", "delta"]
+
+
+def test_deltas_are_small(tmp_path) -> None:  # type: ignore
+    store = HistoryStore(str(tmp_path))
+    large = list(ipaddress.IPv4Network("10.0.0.0/8").subnets(new_prefix=24))[::2]
+    store.record("pl", large, timestamp=DAY)
+    store.record("pl", large[1:], timestamp=2 * DAY)
+    full_size, delta_size = (len(payload) for _, _, payload in store.read("pl"))
+    assert delta_size * 1000 < full_size
+
+
+def test_changes(history: HistoryStore) -> None:
+    changes = history.changes("pl", DAY, 4 * DAY)
+    assert networks(changes.added) == [ipaddress.IPv4Network("10.0.1.0/24")]
+    assert networks(changes.removed) \
+        == [ipaddress.IPv4Network("10.0.0.0/24"), ipaddress.IPv6Network("3fff::/20")]
+
+
+def test_changes_before_first_record(history: HistoryStore) -> None:
+    changes = history.changes("pl", 0, 2 * DAY)
+    assert networks(changes.added) == VERSIONS[1]
+    assert not networks(changes.removed)
+    with pytest.raises(ValueError):
+        history.changes("pl", 0, DAY - 1)
+
+
+def test_churn(history: HistoryStore) -> None:
+    churn = history.churn("pl", 0, 4 * DAY)
+    # the first record is not a change
+    assert (churn.refreshes, churn.changes) == (3, 2)
+    assert churn.added_addresses == {4: 256, 6: 0}
+    assert churn.removed_addresses == {4: 256, 6: 2 ** 108}
+
+
+def test_churn_period(history: HistoryStore) -> None:
+    churn = history.churn("pl", 2 * DAY, 3 * DAY)
+    assert (churn.refreshes, churn.changes) == (1, 0)
+
+
+def test_countries_and_sources(history: HistoryStore) -> None:
+    history.record("pl", [], "ripestat")
+    history.record("de", [], "ipdeny")
+    history.record("de", [])
+    assert history.country_codes() == ["de", "pl"]
+    assert history.sources("pl") == ["ripestat"]
+
+
+def test_recorded_while_generating(tmp_path, mocker: MockerFixture) -> None:  # type: ignore
+    mocker.patch("ipset.list_ipdeny", return_value=VERSIONS[0])
+    mocker.patch("ipset.list_ripestat", return_value=VERSIONS[1])
+    store = HistoryStore(str(tmp_path))
+
+    results = list(list_networks_batch(["pl"], GenerationOptions(max_diff=2, history=store)))
+
+    assert sorted(os.listdir(tmp_path)) \
+        == ["pl-ipdeny.history", "pl-ripestat.history", "pl.history"]
+    assert networks(store.state("pl", source="ripestat")) == VERSIONS[1]
+    assert networks(store.state("pl")) == list(results[0].networks)
+
+
+def test_history_results(history: HistoryStore) -> None:
+    results = list(history_results(history, ["pl", "de"], 2 * DAY))
+    assert results[0].networks == VERSIONS[1]
+    assert isinstance(results[1].error, ValueError)
+
+
+@pytest.mark.parametrize(
+    "text_input,expected",
+    (
+        ("1970-01-02", DAY),
+        ("1970-01-02T01:00:00+01:00", DAY),
+        ("1970-01-01T00:01", 60),
+        ("1970-01-02T00:00:00Z", DAY),
+    ),
+)
+def test_parse_time(text_input: str, expected: float) -> None:
+    assert parse_history_time(text_input) == expected
+
+
+def test_invalid_time() -> None:
+    with pytest.raises(ValueError):
+        parse_history_time("yesterday")
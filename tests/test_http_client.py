@@ -0,0 +1,157 @@
+import gzip
+import http.server
+import socket
+import threading
+import time
+import urllib.error
+import zlib
+from typing import Iterator, Optional
+import pytest
+from pytest_mock.plugin import MockerFixture
+from ipset_http import HttpClient, decode_content
+
+
+# status, body and headers of fixed replies
+REPLIES: dict[str, tuple[int, bytes, dict[str, str]]] = {
+    "/plain": (200, b"plain", {}),
+    "/gzip": (200, gzip.compress(b"zipped"), {"Content-Encoding": "gzip"}),
+    "/deflate": (200, zlib.compress(b"deflated"), {"Content-Encoding": "deflate"}),
+    "/redirect": (302, b"", {"Location": "/plain"}),
+}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    requests: dict[str, int] = {}
+
+    def setup(self) -> None:
+        super().setup()
+        Handler.connections += 1
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None: # pylint: disable=invalid-name
+        Handler.requests[self.path] = Handler.requests.get(self.path, 0) + 1
+        if self.path in REPLIES:
+            self.reply(*REPLIES[self.path])
+        else:
+            getattr(self, f"get_{self.path.lstrip('/')}", self.get_missing)()
+
+    def get_flaky(self) -> None:
+        if Handler.requests[self.path] < 3:
+            self.reply(503, b"")
+        else:
+            self.reply(200, b"recovered")
+
+    def get_reset(self) -> None:
+        if Handler.requests[self.path] < 2:
+            self.close_connection = True
+        else:
+            self.reply(200, b"reconnected")
+
+    def get_slow(self) -> None:
+        time.sleep(0.5)
+        self.reply(200, b"slow")
+
+    def get_etag(self) -> None:
+        if self.headers.get("If-None-Match") == '"1"':
+            self.reply(304, b"")
+        else:
+            self.reply(200, b"tagged", {"ETag": '"1"'})
+
+    def get_missing(self) -> None:
+        self.reply(404, b"not found")
+
+    def reply(self, status: int, body: bytes, headers: Optional[dict[str, str]] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(name="base_url")
+def fixture_base_url() -> Iterator[str]:
+    Handler.connections = 0
+    Handler.requests = {}
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(name="client")
+def fixture_client() -> Iterator[HttpClient]:
+    client = HttpClient(connect_timeout=1, read_timeout=0.2, retries=2, backoff=0)
+    yield client
+    client.close()
+
+
+def test_connection_reuse(base_url: str, client: HttpClient) -> None:
+    for _ in range(3):
+        assert client.fetch(f"{base_url}/plain").body == b"plain"
+    assert Handler.connections == 1
+
+
+@pytest.mark.parametrize(
+    "path,expected",
+    (
+        ("/gzip", b"zipped"),
+        ("/deflate", b"deflated"),
+        ("/redirect", b"plain"),
+    ),
+)
+def test_decoding(base_url: str, client: HttpClient, path: str, expected: bytes) -> None:
+    assert client.fetch(f"{base_url}{path}").body == expected
+
+
+def test_retries_server_errors(base_url: str, client: HttpClient, mocker: MockerFixture) -> None:
+    sleep = mocker.patch("time.sleep")
+    assert client.fetch(f"{base_url}/flaky").body == b"recovered"
+    assert Handler.requests["/flaky"] == 3
+    assert sleep.call_count == 2
+
+
+def test_gives_up_after_retries(base_url: str, mocker: MockerFixture) -> None:
+    mocker.patch("time.sleep")
+    client = HttpClient(retries=1, backoff=0)
+    with pytest.raises(urllib.error.HTTPError) as http_error:
+        client.fetch(f"{base_url}/flaky")
+    assert http_error.value.code == 503
+    assert Handler.requests["/flaky"] == 2
+
+
+def test_retries_connection_resets(base_url: str, client: HttpClient) -> None:
+    assert client.fetch(f"{base_url}/reset").body == b"reconnected"
+
+
+def test_read_timeout(base_url: str) -> None:
+    client = HttpClient(read_timeout=0.1, retries=0)
+    # an alias of TimeoutError since Python 3.10
+    with pytest.raises(socket.timeout):
+        client.fetch(f"{base_url}/slow")
+
+
+def test_not_found_is_not_retried(base_url: str, client: HttpClient) -> None:
+    with pytest.raises(urllib.error.HTTPError) as http_error:
+        client.fetch(f"{base_url}/missing")
+    assert http_error.value.code == 404
+    assert Handler.requests["/missing"] == 1
+
+
+def test_conditional_request(base_url: str, client: HttpClient) -> None:
+    response = client.fetch(f"{base_url}/etag")
+    assert response.etag == '"1"'
+    assert client.fetch(f"{base_url}/etag", {"If-None-Match": '"1"'}).status == 304
+
+
+def test_decode_content() -> None:
+    assert decode_content(b"raw", None) == b"raw"
+    assert decode_content(zlib.compress(b"x")[2:-4], "deflate") == b"x"
+    with pytest.raises(ValueError):
+        decode_content(b"raw", "br")
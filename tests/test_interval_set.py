@@ -0,0 +1,98 @@
+import ipaddress
+from typing import List, Tuple
+import pytest
+from ipset_intervals import IntervalSet, network_interval_sets, range_networks
+
+
+def ranges(interval_set: IntervalSet) -> List[Tuple[int, int]]:
+    return list(interval_set)
+
+
+@pytest.mark.parametrize(
+    "input_ranges,expected_ranges",
+    (
+        pytest.param([], [], id="empty"),
+        pytest.param([(5, 9), (0, 3)], [(0, 3), (5, 9)], id="sorted"),
+        pytest.param([(0, 3), (4, 9)], [(0, 9)], id="adjacent"),
+        pytest.param([(0, 5), (3, 9)], [(0, 9)], id="overlapping"),
+        pytest.param([(0, 9), (3, 5)], [(0, 9)], id="contained"),
+    ),
+)
+def test_collapse(
+        input_ranges: List[Tuple[int, int]],
+        expected_ranges: List[Tuple[int, int]],
+) -> None:
+    assert ranges(IntervalSet.from_ranges(4, input_ranges)) == expected_ranges
+
+
+def test_operations() -> None:
+    left = IntervalSet.from_ranges(4, [(0, 9), (20, 29)])
+    right = IntervalSet.from_ranges(4, [(5, 24), (40, 49)])
+
+    assert ranges(left | right) == [(0, 29), (40, 49)]
+    assert ranges(left & right) == [(5, 9), (20, 24)]
+    assert ranges(left - right) == [(0, 4), (25, 29)]
+    assert ranges(right - left) == [(10, 19), (40, 49)]
+    assert ranges(left ^ right) == [(0, 4), (10, 19), (25, 29), (40, 49)]
+
+
+def test_difference_splits_ranges() -> None:
+    left = IntervalSet.from_ranges(4, [(0, 99)])
+    right = IntervalSet.from_ranges(4, [(10, 19), (30, 39), (99, 120)])
+
+    assert ranges(left - right) == [(0, 9), (20, 29), (40, 98)]
+
+
+def test_version_mismatch() -> None:
+    with pytest.raises(ValueError):
+        IntervalSet(4) | IntervalSet(6)  # pylint: disable=expression-not-assigned
+
+
+def test_contains_and_count() -> None:
+    interval_set = IntervalSet.from_ranges(4, [(10, 19), (30, 39)])
+
+    assert interval_set.address_count() == 20
+    assert [address in interval_set for address in (9, 10, 19, 20, 30, 40)] == [
+        False, True, True, False, True, False,
+    ]
+
+
+def test_networks_match_collapse_addresses() -> None:
+    networks = [
+        ipaddress.IPv4Network("10.0.0.0/24"),
+        ipaddress.IPv4Network("10.0.1.0/24"),
+        ipaddress.IPv4Network("10.0.2.0/25"),
+        ipaddress.IPv4Network("10.0.0.128/25"),
+        ipaddress.IPv4Network("192.168.0.0/32"),
+    ]
+    interval_set = IntervalSet.from_networks(4, networks)
+
+    assert list(interval_set.networks()) == list(ipaddress.collapse_addresses(networks))
+
+
+def test_grouped_by_version() -> None:
+    interval_sets = network_interval_sets([
+        ipaddress.IPv4Network("0.0.0.0/0"),
+        ipaddress.IPv6Network("3fff::/20"),
+    ])
+
+    assert list(interval_sets[4].networks()) == [ipaddress.IPv4Network("0.0.0.0/0")]
+    assert list(interval_sets[6].networks()) == [ipaddress.IPv6Network("3fff::/20")]
+
+
+@pytest.mark.parametrize(
+    "first,last",
+    (
+        ("0.0.0.0", "255.255.255.255"),
+        ("10.0.0.1", "10.0.0.1"),
+        ("10.0.0.1", "10.0.3.254"),
+        ("192.168.10.0", "192.168.12.255"),
+    ),
+)
+def test_range_networks(first: str, last: str) -> None:
+    first_address = ipaddress.IPv4Address(first)
+    last_address = ipaddress.IPv4Address(last)
+
+    assert list(range_networks(4, int(first_address), int(last_address))) == list(
+        ipaddress.summarize_address_range(first_address, last_address)
+    )
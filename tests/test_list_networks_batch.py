@@ -0,0 +1,51 @@
+from pytest_mock.plugin import MockerFixture
+from ipset import list_networks_batch, GenerationOptions
+from .util import fake_ipdeny, fake_ripestat, networks
+
+
+def test_results_in_input_order(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.list_ipdeny", side_effect=fake_ipdeny)
+    mocker.patch("ipset.list_ripestat", side_effect=fake_ripestat)
+
+    results = list(list_networks_batch(["zz", "yy"], GenerationOptions(max_diff=1), 2))
+
+    assert [result.country_code for result in results] == ["zz", "yy"]
+    assert [list(result.networks) for result in results] == [
+        networks("1.0.0.0/24", "3fff::/20"),
+        networks("1.0.0.0/24", "3fff::/20"),
+    ]
+    assert all(result.error is None for result in results)
+
+
+def test_failures_are_reported_per_country(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.list_ipdeny", side_effect=fake_ipdeny)
+    mocker.patch("ipset.list_ripestat", side_effect=fake_ripestat)
+
+    results = {result.country_code: result for result in list_networks_batch(["xx", "yy", "zz"])}
+
+    assert str(results["xx"].error) == "download failed"
+    assert isinstance(results["yy"].error, ValueError)
+    assert "total number of differences: 1" in str(results["yy"].error)
+    assert results["zz"].error is not None
+
+
+def test_failure_does_not_abort_others(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.list_ipdeny", side_effect=fake_ipdeny)
+    mocker.patch("ipset.list_ripestat", side_effect=fake_ripestat)
+
+    results = list(list_networks_batch(["xx", "yy"], GenerationOptions(max_diff=1)))
+
+    assert results[0].error is not None
+    assert results[1].error is None
+    assert list(results[1].networks) == networks("1.0.0.0/24", "3fff::/20")
+
+
+def test_selected_sources(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.list_ipdeny", side_effect=fake_ipdeny)
+    mocker.patch("ipset.list_delegated", side_effect=fake_ripestat)
+    list_ripestat = mocker.patch("ipset.list_ripestat")
+
+    results = list(list_networks_batch(["yy"], GenerationOptions(sources=("ipdeny", "delegated"))))
+
+    assert "present in IPdeny but not in RIR statistics" in str(results[0].error)
+    list_ripestat.assert_not_called()
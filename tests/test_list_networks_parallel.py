@@ -0,0 +1,96 @@
+import copy
+import ipaddress
+import pickle
+from pytest_mock.plugin import MockerFixture
+from ipset import (
+    list_networks_parallel, list_networks_batch, ipset_commands, GenerationOptions, Network,
+    PackedNetworks, Metrics, SizingOptions,
+)
+from ipset_http import HttpClient
+from .util import fake_ipdeny, fake_ripestat
+
+
+def test_same_as_batch(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.list_ipdeny", side_effect=fake_ipdeny)
+    mocker.patch("ipset.list_ripestat", side_effect=fake_ripestat)
+    options = GenerationOptions(max_diff=1)
+
+    results = list(list_networks_parallel(["zz", "yy"], options, 2))
+
+    expected = list(list_networks_batch(["zz", "yy"], options))
+    assert [result.country_code for result in results] == ["zz", "yy"]
+    assert [list(result.networks) for result in results] \
+        == [list(result.networks) for result in expected]
+    assert all(result.error is None and result.session is None for result in results)
+
+
+def test_rendered_sessions(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.list_ipdeny", side_effect=fake_ipdeny)
+    mocker.patch("ipset.list_ripestat", side_effect=fake_ripestat)
+
+    results = list(
+        list_networks_parallel(["zz"], GenerationOptions(max_diff=1), 1, SizingOptions(50))
+    )
+
+    expected_networks: list[Network] = [
+        ipaddress.IPv4Network("1.0.0.0/24"), ipaddress.IPv6Network("3fff::/20"),
+    ]
+    assert results[0].session == "".join(
+        command + "\n" for command in ipset_commands("zz", expected_networks, SizingOptions(50))
+    )
+
+
+def test_failures_are_isolated(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.list_ipdeny", side_effect=fake_ipdeny)
+    mocker.patch("ipset.list_ripestat", side_effect=fake_ripestat)
+
+    results = {
+        result.country_code: result
+        for result in list_networks_parallel(["xx", "yy", "zz"], GenerationOptions(max_diff=1))
+    }
+
+    assert str(results["xx"].error) == "download failed"
+    assert results["yy"].error is None
+    assert results["zz"].error is None
+
+
+def test_metrics_of_workers(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.list_ipdeny", side_effect=fake_ipdeny)
+    mocker.patch("ipset.list_ripestat", side_effect=fake_ripestat)
+    metrics = Metrics()
+
+    list(list_networks_parallel(
+        ["zz"], GenerationOptions(max_diff=1), 1, SizingOptions(25), metrics
+    ))
+
+    stages = {(record["stage"], record["source"]) for record in metrics.records}
+    assert stages == {
+        ("download", "ipdeny"), ("download", "ripestat"), ("compare", None), ("render", None),
+    }
+    assert [record["commands"] for record in metrics.records if record["stage"] == "render"] \
+        == [12]
+
+
+def test_packed_networks() -> None:
+    networks: list[Network] = [
+        ipaddress.IPv4Network("0.0.0.0/0"),
+        ipaddress.IPv4Network("255.255.255.255/32"),
+        ipaddress.IPv6Network("3fff::/20"),
+        ipaddress.IPv6Network("ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff/128"),
+    ]
+    packed = pickle.loads(pickle.dumps(PackedNetworks(networks)))
+    assert list(packed) == networks
+    assert len(packed) == 4
+    assert ipaddress.IPv6Network("3fff::/20") in packed
+    assert ipaddress.IPv6Network("3fff::/21") not in packed
+
+
+def test_http_client_copy() -> None:
+    client = HttpClient(1, 2, 3, 4)
+    client.idle_connections[("http", "localhost")] = []
+    client_copy = copy.copy(client)
+    assert (client_copy.connect_timeout, client_copy.read_timeout, client_copy.retries) \
+        == (1, 2, 3)
+    assert client_copy.backoff == 4
+    assert not client_copy.idle_connections
+    assert client_copy.lock is not client.lock
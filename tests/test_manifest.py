@@ -0,0 +1,109 @@
+import ipaddress
+import json
+import time
+import pytest
+from pytest_mock.plugin import MockerFixture
+from ipset import (
+    Network, BatchResult, ipset_commands, ipset_group_commands, manifest_bytes, networks_digest,
+    parse_ipset_state, parse_manifest, stale_sessions,
+)
+
+
+NETWORKS: list[Network] = [
+    ipaddress.IPv4Network("10.0.0.0/24"),
+    ipaddress.IPv4Network("192.0.2.1/32"),
+    ipaddress.IPv6Network("3fff::/20"),
+]
+
+IPSET_SAVE = "\n".join((
+    "create country-pl-v4 hash:net family inet hashsize 1024 maxelem 65536",
+    "add country-pl-v4 192.0.2.1",
+    "add country-pl-v4 10.0.0.0/24",
+    "create country-pl-v6 hash:net family inet6 hashsize 1024 maxelem 65536",
+    "add country-pl-v6 3fff::/20",
+))
+
+
+def test_session_is_reproducible(mocker: MockerFixture) -> None:
+    first = list(ipset_commands("pl", NETWORKS))
+    mocker.patch("time.gmtime", return_value=time.gmtime(1876543210))
+    assert list(ipset_commands("pl", reversed(NETWORKS))) == first
+
+
+def test_temporary_set_depends_on_entries() -> None:
+    first = list(ipset_commands("pl", NETWORKS))
+    second = list(ipset_commands("pl", NETWORKS[1:]))
+    assert first[1] != second[1]
+    # the IPv6 set is the same
+    assert first[-4:] == second[-4:]
+
+
+def test_digest_of_ipset_save_output() -> None:
+    state = parse_ipset_state(IPSET_SAVE)
+    assert networks_digest(state.entries["country-pl-v4"]) == networks_digest(NETWORKS[:2])
+
+
+def test_manifest() -> None:
+    manifest = json.loads(manifest_bytes([
+        BatchResult("pl", NETWORKS, None),
+        BatchResult("xx", [], ValueError("download failed")),
+    ]))
+    assert list(manifest["sessions"]) == ["pl"]
+    assert manifest["sessions"]["pl"]["sets"] == {
+        "country-pl-v4": networks_digest(NETWORKS[:2]),
+        "country-pl-v6": networks_digest(NETWORKS[2:]),
+    }
+
+
+def test_manifest_is_reproducible() -> None:
+    assert manifest_bytes([BatchResult("pl", NETWORKS, None)]) \
+        == manifest_bytes([BatchResult("pl", list(reversed(NETWORKS)), None)])
+
+
+def test_group_manifest() -> None:
+    results = [
+        BatchResult("pl", NETWORKS[:1], None),
+        BatchResult("de", [ipaddress.IPv4Network("10.0.1.0/24")], None),
+    ]
+    manifest = json.loads(manifest_bytes(results, "eu"))
+    assert manifest["sessions"]["group-eu"]["sets"]["group-eu-v4"] \
+        == networks_digest([ipaddress.IPv4Network("10.0.0.0/23")])
+    # the manifest matches the sets of the generated session
+    session = parse_ipset_state("\n".join(ipset_group_commands(
+        "eu", [network for result in results for network in result.networks]
+    )))
+    assert not list(stale_sessions(parse_manifest(json.dumps(manifest)), session))
+
+
+def test_failed_group_manifest() -> None:
+    manifest = json.loads(manifest_bytes([
+        BatchResult("pl", NETWORKS, None),
+        BatchResult("xx", [], ValueError("download failed")),
+    ], "eu"))
+    assert not manifest["sessions"]
+
+
+@pytest.mark.parametrize(
+    "state,expected",
+    (
+        pytest.param(IPSET_SAVE, [], id="loaded"),
+        pytest.param(IPSET_SAVE + "\nadd country-pl-v6 3fff:1000::/20", ["pl"], id="changed"),
+        pytest.param(IPSET_SAVE.split("\ncreate country-pl-v6", 1)[0], ["pl"], id="missing"),
+        pytest.param("", ["pl"], id="empty"),
+    ),
+)
+def test_stale_sessions(state: str, expected: list[str]) -> None:
+    manifest = parse_manifest(manifest_bytes([BatchResult("pl", NETWORKS, None)]).decode())
+    assert list(stale_sessions(manifest, parse_ipset_state(state))) == expected
+
+
+def test_generated_session_matches_manifest() -> None:
+    manifest = parse_manifest(manifest_bytes([BatchResult("pl", NETWORKS, None)]).decode())
+    session = parse_ipset_state("\n".join(ipset_commands("pl", NETWORKS)))
+    assert not list(stale_sessions(manifest, session))
+
+
+@pytest.mark.parametrize("text_input", ("", "[]", "{}", '{"sessions": {"pl": {}}}'))
+def test_invalid_manifest(text_input: str) -> None:
+    with pytest.raises(ValueError):
+        parse_manifest(text_input)
@@ -0,0 +1,84 @@
+import http.client
+import ipaddress
+from typing import Iterable
+import pytest
+from pytest_mock.plugin import MockerFixture
+from ipset import Network, list_networks_batch
+from ipset_http import HttpResponse, read_url
+from ipset_metrics import Metrics, count_metric
+
+
+def test_stage_counters() -> None:
+    metrics = Metrics()
+    with metrics.stage("zz", "download", "ipdeny"):
+        count_metric("networks", 2)
+        count_metric("networks", 3)
+    count_metric("networks", 100)
+
+    assert len(metrics.records) == 1
+    record = metrics.records[0]
+    assert record["country"] == "zz"
+    assert record["stage"] == "download"
+    assert record["source"] == "ipdeny"
+    assert record["networks"] == 5
+    assert record["failed"] == 0
+    assert record["seconds"] >= 0
+
+
+def test_failed_stage() -> None:
+    metrics = Metrics()
+    with pytest.raises(ValueError):
+        with metrics.stage("zz", "compare"):
+            raise ValueError
+
+    assert metrics.records[0]["failed"] == 1
+
+
+def test_downloaded_bytes(mocker: MockerFixture) -> None:
+    mocker.patch(
+        "ipset_http.HttpClient.request",
+        return_value=HttpResponse(200, "OK", http.client.HTTPMessage(), b"foo"),
+    )
+    metrics = Metrics()
+    with metrics.stage("zz", "download"):
+        read_url("http://www.example.com/")
+
+    assert metrics.records[0]["bytes_downloaded"] == 3
+    assert metrics.records[0]["bytes_read"] == 3
+
+
+def test_batch_records(mocker: MockerFixture) -> None:
+
+    def networks(_: str) -> Iterable[Network]:
+        return [ipaddress.IPv4Network("1.0.0.0/24")]
+
+    mocker.patch("ipset.list_ipdeny", side_effect=networks)
+    mocker.patch("ipset.list_ripestat", side_effect=networks)
+    metrics = Metrics()
+
+    list(list_networks_batch(["zz"], metrics=metrics))
+
+    records = {(record["stage"], record["source"]): record for record in metrics.records}
+    assert records[("download", "ipdeny")]["networks"] == 1
+    assert records[("download", "ripestat")]["networks"] == 1
+    assert records[("compare", None)]["common"] == 1
+    assert records[("compare", None)]["ipdeny_missing"] == 0
+
+
+def test_textfile_format() -> None:
+    metrics = Metrics()
+    metrics.records.append({
+        "country": "zz", "stage": "download", "source": "ipdeny", "seconds": 1.5, "failed": 0,
+    })
+    metrics.records.append({
+        "country": "zz", "stage": "compare", "source": None, "seconds": 0.5, "failed": 1,
+    })
+
+    assert list(metrics.textfile_lines()) == [
+        "# TYPE ipset_country_seconds gauge",
+        'ipset_country_seconds{country="zz",stage="download",source="ipdeny"} 1.5',
+        'ipset_country_seconds{country="zz",stage="compare"} 0.5',
+        "# TYPE ipset_country_failed gauge",
+        'ipset_country_failed{country="zz",stage="download",source="ipdeny"} 0',
+        'ipset_country_failed{country="zz",stage="compare"} 1',
+    ]
@@ -0,0 +1,68 @@
+import ipaddress
+from pytest_mock.plugin import MockerFixture
+from ipset import minimize_networks, list_networks_batch, GenerationOptions, Metrics
+
+
+def test_lossless() -> None:
+    result = minimize_networks([
+        ipaddress.IPv4Network("1.0.1.0/24"),
+        ipaddress.IPv4Network("1.0.0.0/24"),
+        ipaddress.IPv4Network("1.0.2.0/24"),
+        ipaddress.IPv6Network("3fff::/21"),
+        ipaddress.IPv6Network("3fff:800::/21"),
+    ])
+
+    assert list(result.networks) == [
+        ipaddress.IPv4Network("1.0.0.0/23"),
+        ipaddress.IPv4Network("1.0.2.0/24"),
+        ipaddress.IPv6Network("3fff::/20"),
+    ]
+    assert result.saved_entries == 2
+    assert result.added_sizes == {4: 0, 6: 0}
+
+
+def test_lossy_within_budget() -> None:
+    networks = [
+        ipaddress.IPv4Network("1.0.0.0/23"),
+        ipaddress.IPv4Network("1.0.2.0/24"),
+    ]
+
+    assert list(minimize_networks(networks, 24).networks) == networks
+
+    result = minimize_networks(networks, 25)
+    assert list(result.networks) == [ipaddress.IPv4Network("1.0.0.0/22")]
+    assert result.saved_entries == 1
+    assert result.added_sizes == {4: 256, 6: 0}
+
+
+def test_lossy_merges_only_where_dense() -> None:
+    networks = [
+        ipaddress.IPv4Network("10.0.0.0/25"),
+        ipaddress.IPv4Network("10.0.0.128/26"),
+        ipaddress.IPv4Network("10.0.0.192/27"),
+        ipaddress.IPv4Network("10.200.0.0/24"),
+    ]
+
+    result = minimize_networks(networks, 15)
+
+    assert list(result.networks) == [
+        ipaddress.IPv4Network("10.0.0.0/24"),
+        ipaddress.IPv4Network("10.200.0.0/24"),
+    ]
+    assert result.added_sizes[4] == 32
+
+
+def test_batch_stage(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.list_ipdeny", return_value=[
+        ipaddress.IPv4Network("1.0.0.0/24"), ipaddress.IPv4Network("1.0.1.0/24"),
+    ])
+    mocker.patch("ipset.list_ripestat", return_value=[
+        ipaddress.IPv4Network("1.0.0.0/24"), ipaddress.IPv4Network("1.0.1.0/24"),
+    ])
+    metrics = Metrics()
+
+    results = list(list_networks_batch(["zz"], GenerationOptions(max_overshoot=0), metrics=metrics))
+
+    assert list(results[0].networks) == [ipaddress.IPv4Network("1.0.0.0/23")]
+    minimize_record = [record for record in metrics.records if record["stage"] == "minimize"][0]
+    assert minimize_record["saved_entries"] == 1
@@ -0,0 +1,86 @@
+import argparse
+import ipaddress
+from typing import Iterable
+import pytest
+from pytest_mock.plugin import MockerFixture
+from ipset import BatchResult, IntervalSet, nft_commands, nft_element, write_nft_script
+
+
+def test_script() -> None:
+    v4_set = IntervalSet.from_networks(4, [
+        ipaddress.IPv4Network("10.0.0.0/24"),
+        ipaddress.IPv4Network("10.0.1.0/25"),
+        ipaddress.IPv4Network("192.0.2.1/32"),
+    ])
+    assert list(nft_commands([("country-pl-v4", v4_set), ("country-pl-v6", IntervalSet(6))])) == [
+        "add table inet country",
+        "add set inet country country-pl-v4 { type ipv4_addr; flags interval; auto-merge; }",
+        "flush set inet country country-pl-v4",
+        "add element inet country country-pl-v4 { 10.0.0.0-10.0.1.127, 192.0.2.1 }",
+        "add set inet country country-pl-v6 { type ipv6_addr; flags interval; auto-merge; }",
+        "flush set inet country country-pl-v6",
+    ]
+
+
+@pytest.mark.parametrize(
+    "version,first,last,expected",
+    (
+        (4, 0, 2 ** 32 - 1, "0.0.0.0/0"),
+        (4, 256, 511, "0.0.1.0/24"),
+        (4, 256, 767, "0.0.1.0-0.0.2.255"),
+        (4, 2 ** 32 - 1, 2 ** 32 - 1, "255.255.255.255"),
+        (6, 2 ** 128 - 2, 2 ** 128 - 1, "ffff:ffff:ffff:ffff:ffff:ffff:ffff:fffe/127"),
+        (6, 1, 2, "::1-::2"),
+    ),
+)
+def test_element(version: int, first: int, last: int, expected: str) -> None:
+    assert nft_element(version, first, last) == expected
+
+
+def test_elements_are_split(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.NFT_ELEMENTS_PER_COMMAND", 2)
+    interval_set = IntervalSet.from_ranges(4, [(0, 0), (2, 2), (4, 4)])
+    assert list(nft_commands([("zz", interval_set)], "filter"))[3:] == [
+        "add element inet filter zz { 0.0.0.0, 0.0.0.2 }",
+        "add element inet filter zz { 0.0.0.4 }",
+    ]
+
+
+def test_sets_are_rendered_lazily() -> None:
+    def sets() -> Iterable[tuple[str, IntervalSet]]:
+        yield "country-pl-v4", IntervalSet(4)
+        raise RuntimeError("not consumed yet")
+
+    commands = iter(nft_commands(sets()))
+    assert len([next(commands) for _ in range(3)]) == 3
+    with pytest.raises(RuntimeError):
+        next(commands)
+
+
+def test_failed_countries_are_left_out(tmp_path, capsys: pytest.CaptureFixture[str]) -> None:  # type: ignore
+    args = argparse.Namespace(group_name=None, nft_table="country", output_directory=str(tmp_path))
+    results = [
+        BatchResult("pl", [ipaddress.IPv4Network("10.0.0.0/24")], None),
+        BatchResult("xx", [], ValueError("download failed")),
+    ]
+
+    assert not write_nft_script(results, args)
+
+    script = (tmp_path / "country.nft").read_text()
+    assert "country-pl-v4 { 10.0.0.0/24 }" in script
+    assert "country-xx" not in script
+    assert capsys.readouterr().err == "xx: download failed\n"
+
+
+def test_group(tmp_path) -> None:  # type: ignore
+    args = argparse.Namespace(group_name="eu", nft_table="country", output_directory=str(tmp_path))
+    results = [
+        BatchResult("pl", [ipaddress.IPv4Network("10.0.0.0/24")], None),
+        BatchResult("de", [ipaddress.IPv4Network("10.0.1.0/24")], None),
+    ]
+
+    assert write_nft_script(results, args)
+
+    script = (tmp_path / "country.nft").read_text().splitlines()
+    assert "add element inet country group-eu-v4 { 10.0.0.0/23 }" in script
+    assert "flush set inet country group-eu-v6" in script
@@ -1,5 +1,7 @@
 import ipaddress
-from ipset import parse_ripestat_v4, parse_ripestat_v6
+from pytest_mock.plugin import MockerFixture
+import ipset
+from ipset import parse_ripestat, parse_ripestat_v4, parse_ripestat_v6, list_ripestat
 from .util import read_test_file
 
 
@@ -11,3 +13,21 @@ def test_valid_v4() -> None:
 def test_valid_v6() -> None:
     json_input = read_test_file("ripestat/valid.json")
     assert list(parse_ripestat_v6(json_input)) == [ipaddress.IPv6Network("3fff::/20")]
+
+
+def test_valid_both() -> None:
+    json_input = read_test_file("ripestat/valid.json")
+    v4_networks, v6_networks = parse_ripestat(json_input)
+    assert list(v4_networks) == [ipaddress.IPv4Network("127.0.0.0/24")]
+    assert list(v6_networks) == [ipaddress.IPv6Network("3fff::/20")]
+
+
+def test_single_pass(mocker: MockerFixture) -> None:
+    mocker.patch("ipset.read_url", return_value=read_test_file("ripestat/valid.json"))
+    check = mocker.spy(ipset, "check_ripestat_response")
+
+    assert list(list_ripestat("ZZ")) == [
+        ipaddress.IPv4Network("127.0.0.0/24"),
+        ipaddress.IPv6Network("3fff::/20"),
+    ]
+    assert check.call_count == 1
@@ -0,0 +1,170 @@
+import ipaddress
+import json
+import os.path
+from typing import Iterable
+from unittest.mock import MagicMock
+import pytest
+from pytest_mock.plugin import MockerFixture
+from ipset import Network, DaemonOptions, SetRefreshDaemon
+from ipset_daemon import RefreshOptions
+
+
+NETWORKS = [ipaddress.IPv4Network("1.0.0.0/24")]
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(mocker: MockerFixture) -> MagicMock:
+    clock = mocker.patch("time.monotonic", return_value=1000.0)
+    mocker.patch("time.sleep")
+    return clock
+
+
+@pytest.fixture(name="sources")
+def fixture_sources(mocker: MockerFixture) -> tuple[MagicMock, MagicMock]:
+    return (
+        mocker.patch("ipset.list_ipdeny", return_value=NETWORKS),
+        mocker.patch("ipset.list_ripestat", return_value=NETWORKS),
+    )
+
+
+def create_daemon(output_directory: str) -> SetRefreshDaemon:
+    return SetRefreshDaemon(
+        ["zz"],
+        DaemonOptions(output_directory),
+        refresh_options=RefreshOptions(interval=3600, jitter=0, retry_interval=60),
+        status_file=os.path.join(output_directory, "status.json"),
+    )
+
+
+def read_published(output_directory: str) -> str:
+    with open(os.path.join(output_directory, "ipset-zz.txt"), encoding="ascii") as published:
+        return published.read()
+
+
+def test_publishes_only_changes(
+        tmp_path: str,
+        clock: MagicMock,
+        sources: tuple[MagicMock, MagicMock],
+) -> None:
+    daemon = create_daemon(tmp_path)
+    daemon.refresh_due()
+    assert "add country-zz-v4.tmp-" in read_published(tmp_path)
+    os.remove(os.path.join(tmp_path, "ipset-zz.txt"))
+
+    clock.return_value += 3600
+    daemon.refresh_due()
+    assert not os.path.exists(os.path.join(tmp_path, "ipset-zz.txt"))
+
+    changed_networks: Iterable[Network] = [ipaddress.IPv4Network("2.0.0.0/24")]
+    for source in sources:
+        source.return_value = changed_networks
+    clock.return_value += 3600
+    daemon.refresh_due()
+    assert "2.0.0.0/24" in read_published(tmp_path)
+
+
+def test_refreshes_only_due_countries(
+        tmp_path: str,
+        clock: MagicMock,
+        sources: tuple[MagicMock, MagicMock],
+) -> None:
+    daemon = create_daemon(tmp_path)
+    daemon.refresh_due()
+    clock.return_value += 3599
+    daemon.refresh_due()
+    assert sources[0].call_count == 1
+    clock.return_value += 1
+    daemon.refresh_due()
+    assert sources[0].call_count == 2
+
+
+def test_backoff_keeps_last_good_networks(
+        tmp_path: str,
+        clock: MagicMock,
+        sources: tuple[MagicMock, MagicMock],
+) -> None:
+    daemon = create_daemon(tmp_path)
+    daemon.refresh_due()
+    published = read_published(tmp_path)
+    sources[0].side_effect = ValueError("download failed")
+
+    delays = []
+    for _ in range(8):
+        clock.return_value = daemon.statuses["zz"].next_refresh
+        daemon.refresh_due()
+        delays.append(daemon.statuses["zz"].next_refresh - clock.return_value)
+    assert delays == [60, 120, 240, 480, 960, 1920, 3600, 3600]
+    assert daemon.statuses["zz"].failures == 8
+    assert daemon.statuses["zz"].error == "download failed"
+    assert daemon.statuses["zz"].networks == NETWORKS
+    assert read_published(tmp_path) == published
+
+    sources[0].side_effect = None
+    clock.return_value = daemon.statuses["zz"].next_refresh
+    daemon.refresh_due()
+    assert daemon.statuses["zz"].failures == 0
+    assert daemon.statuses["zz"].error is None
+
+
+@pytest.mark.usefixtures("clock")
+def test_restart_does_not_republish(
+        tmp_path: str,
+        sources: tuple[MagicMock, MagicMock],
+) -> None:
+    create_daemon(tmp_path).refresh_due()
+    os.utime(os.path.join(tmp_path, "ipset-zz.txt"), (0, 0))
+    daemon = create_daemon(tmp_path)
+    assert daemon.statuses["zz"].networks == NETWORKS
+    daemon.refresh_due()
+    assert os.path.getmtime(os.path.join(tmp_path, "ipset-zz.txt")) == 0
+    assert daemon.statuses["zz"].last_change is None
+    assert sources[0].call_count == 2
+
+
+def test_status_file(
+        tmp_path: str,
+        clock: MagicMock,
+        sources: tuple[MagicMock, MagicMock],
+) -> None:
+    sources[1].side_effect = ValueError("download failed")
+    create_daemon(tmp_path).run(1)
+    with open(os.path.join(tmp_path, "status.json"), encoding="ascii") as status_file:
+        status = json.load(status_file)["countries"]["zz"]
+    assert status["failures"] == 1
+    assert status["error"] == "download failed"
+    assert status["networks"] is None
+    assert status["last_success"] is None
+    assert set(status["timings"]) == {"download"}
+    assert clock.call_count > 0
+
+
+def test_write_errors_back_off(
+        tmp_path: str,
+        mocker: MockerFixture,
+        clock: MagicMock,
+        sources: tuple[MagicMock, MagicMock],
+) -> None:
+    daemon = create_daemon(tmp_path)
+    daemon.refresh_due()
+    changed_networks: Iterable[Network] = [ipaddress.IPv4Network("2.0.0.0/24")]
+    for source in sources:
+        source.return_value = changed_networks
+    publish = mocker.patch("ipset.write_file_atomically", side_effect=OSError("disk full"))
+    write_status = mocker.patch(
+        "ipset_daemon.write_file_atomically", side_effect=OSError("disk full")
+    )
+
+    clock.return_value = daemon.statuses["zz"].next_refresh
+    daemon.run(1)
+    assert publish.call_count == 1
+    assert write_status.call_count == 1
+    assert daemon.statuses["zz"].failures == 1
+    assert daemon.statuses["zz"].error == "disk full"
+    assert daemon.statuses["zz"].networks == NETWORKS
+    assert daemon.statuses["zz"].next_refresh - clock.return_value == 60
+
+    publish.side_effect = None
+    clock.return_value = daemon.statuses["zz"].next_refresh
+    daemon.refresh_due()
+    assert daemon.statuses["zz"].failures == 0
+    assert daemon.statuses["zz"].networks == changed_networks
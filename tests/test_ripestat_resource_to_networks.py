@@ -1,7 +1,10 @@
 import ipaddress
-from typing import List
+import itertools
+import json
+import random
+from typing import Iterable, List
 import pytest
-from ipset import ripestat_resource_to_networks
+from ipset import ripestat_resource_to_networks, parse_ripestat_interval_sets
 
 
 @pytest.mark.parametrize(
@@ -50,3 +53,47 @@ def test_invalid(input_resource: str) -> None:
 )
 def test_networks(input_resource: str, expected_networks: List[ipaddress.IPv4Network]) -> None:
     assert list(ripestat_resource_to_networks(input_resource)) == expected_networks
+
+
+@pytest.mark.parametrize("input_resource", ("127.0.0.2-127.0.0.1", "1.0.0.0-2.0.0.0-3.0.0.0"))
+def test_invalid_range(input_resource: str) -> None:
+    with pytest.raises(ipaddress.AddressValueError):
+        ripestat_resource_to_networks(input_resource)
+
+
+def reference_networks(resource: str) -> Iterable[ipaddress.IPv4Network]:
+    # independent of the range parsing of the code under test
+    if "-" not in resource:
+        return [ipaddress.IPv4Network(resource)]
+    first, last = resource.split("-")
+    return ipaddress.summarize_address_range(
+        ipaddress.IPv4Address(first), ipaddress.IPv4Address(last)
+    )
+
+
+def test_bulk_conversion_matches_reference_conversion() -> None:
+    generator = random.Random(7)
+    resources = []
+    for _ in range(2000):
+        first = generator.getrandbits(32) & ~0xff
+        if generator.random() < 0.5:
+            prefixlen = generator.randint(16, 32)
+            network = ipaddress.IPv4Network(
+                (first >> (32 - prefixlen) << (32 - prefixlen), prefixlen)
+            )
+            resources.append(str(network.network_address) if prefixlen == 32 else str(network))
+        else:
+            last = min(first + generator.randint(0, 1 << 20), 2 ** 32 - 1)
+            resources.append(f"{ipaddress.IPv4Address(first)}-{ipaddress.IPv4Address(last)}")
+    json_input = json.dumps({
+        "status": "ok",
+        "status_code": 200,
+        "data_call_status": "supported",
+        "data": {"resources": {"ipv4": resources, "ipv6": []}},
+    }).encode("ascii")
+
+    v4_set, _ = parse_ripestat_interval_sets(json_input)
+
+    assert list(v4_set.networks()) == list(ipaddress.collapse_addresses(
+        itertools.chain.from_iterable(map(reference_networks, resources))
+    ))
@@ -0,0 +1,57 @@
+import pytest
+from ipset import choose_prefix_lengths, network_interval_sets, shape_prefix_lengths
+from .util import networks
+
+
+@pytest.mark.parametrize(
+    "histogram,max_added,expected",
+    (
+        pytest.param({}, 0, {}, id="empty"),
+        pytest.param({24: 10, 22: 1}, 0, {22: 22, 24: 24}, id="no budget"),
+        pytest.param({24: 10, 22: 1}, 2, {22: 22, 24: 24}, id="budget too small"),
+        pytest.param({24: 10, 22: 1}, 3, {22: 24, 24: 24}, id="split"),
+        pytest.param(
+            # dropping /20 or /23 costs 3, dropping /22 costs 1
+            {24: 10, 23: 3, 22: 1, 20: 1}, 3, {20: 20, 22: 23, 23: 23, 24: 24},
+            id="cheapest lengths",
+        ),
+        pytest.param(
+            {24: 10, 23: 1, 22: 1, 20: 1}, 19, {20: 24, 22: 24, 23: 24, 24: 24},
+            id="single length",
+        ),
+        pytest.param(
+            # a single length would cost 259, two lengths cost 127 or 4
+            {24: 1, 23: 4, 16: 1}, 200, {16: 16, 23: 24, 24: 24}, id="fewest entries",
+        ),
+    ),
+)
+def test_choose_prefix_lengths(
+        histogram: dict[int, int],
+        max_added: int,
+        expected: dict[int, int],
+) -> None:
+    assert choose_prefix_lengths(histogram, max_added) == expected
+
+
+def test_shape() -> None:
+    original = networks(
+        "10.0.0.0/22", "10.1.0.0/24", "10.2.0.0/24", "10.3.0.0/24", "10.4.0.0/24",
+        "3fff::/20", "3fff:1000::/24",
+    )
+    result = shape_prefix_lengths(original, 60)
+    assert result.networks == networks(
+        "10.0.0.0/24", "10.0.1.0/24", "10.0.2.0/24", "10.0.3.0/24",
+        "10.1.0.0/24", "10.2.0.0/24", "10.3.0.0/24", "10.4.0.0/24",
+        "3fff::/20", "3fff:1000::/24",
+    )
+    assert result.probes_before == {4: 2, 6: 2}
+    assert result.probes_after == {4: 1, 6: 2}
+    assert result.added_entries == 3
+    assert network_interval_sets(result.networks) == network_interval_sets(original)
+
+
+def test_no_budget() -> None:
+    original = networks("10.0.0.0/22", "10.1.0.0/24")
+    result = shape_prefix_lengths(original)
+    assert result.networks == original
+    assert result.added_entries == 0
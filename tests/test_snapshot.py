@@ -0,0 +1,118 @@
+import ipaddress
+import os.path
+import pytest
+from ipset import (
+    Network, read_previous_state, write_snapshot, BatchResult, IntervalSet, shape_prefix_lengths,
+)
+from ipset_snapshot import Snapshot, snapshot_bytes, open_snapshot
+
+
+NETWORKS: dict[str, list[Network]] = {
+    "pl": [
+        ipaddress.IPv4Network("10.0.0.0/24"),
+        ipaddress.IPv4Network("10.0.1.0/24"),
+        ipaddress.IPv4Network("255.255.255.255/32"),
+        ipaddress.IPv6Network("3fff::/20"),
+        ipaddress.IPv6Network("ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff/128"),
+    ],
+    "de": [
+        ipaddress.IPv4Network("0.0.0.0/32"),
+    ],
+    "zz": [],
+}
+
+
+def test_round_trip() -> None:
+    snapshot = Snapshot(snapshot_bytes(NETWORKS, {"sources": ["ipdeny", "ripestat"]}))
+    assert snapshot.country_codes() == ["de", "pl", "zz"]
+    assert snapshot.metadata["sources"] == ["ipdeny", "ripestat"]
+    assert list(snapshot.networks("pl")) == [
+        ipaddress.IPv4Network("10.0.0.0/23"),
+        ipaddress.IPv4Network("255.255.255.255/32"),
+        ipaddress.IPv6Network("3fff::/20"),
+        ipaddress.IPv6Network("ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff/128"),
+    ]
+    assert list(snapshot.networks("de")) == [ipaddress.IPv4Network("0.0.0.0/32")]
+    assert not list(snapshot.networks("zz"))
+
+
+def test_metadata() -> None:
+    snapshot = Snapshot(snapshot_bytes(NETWORKS))
+    country = snapshot.metadata["countries"]["pl"]
+    assert country["networks"] == 5
+    assert country["ranges"] == {"4": 2, "6": 2}
+    assert country["address_counts"] == {"4": 513, "6": 2 ** 108 + 1}
+    assert isinstance(snapshot.metadata["created"], int)
+
+
+def test_interval_sets() -> None:
+    interval_sets = Snapshot(snapshot_bytes(NETWORKS)).interval_sets("pl")
+    assert interval_sets[4] == IntervalSet(4, [0x0a000000, 2 ** 32 - 1], [0x0a0001ff, 2 ** 32 - 1])
+    assert interval_sets[6] == IntervalSet.from_networks(6, NETWORKS["pl"][3:])
+
+
+def test_unknown_country() -> None:
+    with pytest.raises(ValueError):
+        Snapshot(snapshot_bytes(NETWORKS)).interval_sets("xx")
+
+
+@pytest.mark.parametrize(
+    "content",
+    (
+        b"",
+        b"IPSETSN",
+        b"create country-pl-v4 hash:net family inet\n",
+        b"IPSETSNP\x02\x00\x00\x00\x02\x00\x00\x00{}",
+    ),
+)
+def test_invalid_snapshot(content: bytes) -> None:
+    with pytest.raises(ValueError):
+        Snapshot(content)
+
+
+def test_corrupted_data() -> None:
+    content = bytearray(snapshot_bytes(NETWORKS))
+    # the last country with any networks is stored last
+    content[-1] ^= 0xff
+    snapshot = Snapshot(bytes(content))
+    list(snapshot.networks("pl"))
+    with pytest.raises(ValueError):
+        list(snapshot.networks("de"))
+
+
+def test_file(tmp_path: str) -> None:
+    filename = os.path.join(tmp_path, "snapshot.bin")
+    write_snapshot(
+        filename,
+        [
+            BatchResult("pl", NETWORKS["pl"], None),
+            BatchResult("xx", [], ValueError("download failed")),
+        ],
+        ("ipdeny", "ripestat"),
+    )
+    with open_snapshot(filename) as snapshot:
+        assert snapshot.country_codes() == ["pl"]
+        assert len(list(snapshot.networks("pl"))) == 4
+
+
+def test_previous_state(tmp_path: str) -> None:
+    filename = os.path.join(tmp_path, "snapshot.bin")
+    write_snapshot(filename, [BatchResult("de", NETWORKS["de"], None)], ())
+    state = read_previous_state(filename, allow_snapshot=True)
+    assert state.entries == {
+        "country-de-v4": [ipaddress.IPv4Network("0.0.0.0/32")],
+        "country-de-v6": [],
+    }
+    assert not state.options
+
+
+def test_no_delta_against_snapshot(tmp_path: str) -> None:
+    # the loaded set holds the shaped entries, the snapshot only merged ranges
+    shaped = shape_prefix_lengths(
+        [ipaddress.IPv4Network("10.0.0.0/23"), ipaddress.IPv4Network("10.0.2.0/24")], 100
+    ).networks
+    assert ipaddress.IPv4Network("10.0.1.0/24") in shaped
+    filename = os.path.join(tmp_path, "snapshot.bin")
+    write_snapshot(filename, [BatchResult("pl", shaped, None)], ())
+    with pytest.raises(ValueError, match="--lookup"):
+        read_previous_state(filename)
@@ -0,0 +1,98 @@
+import os
+import urllib.error
+from http import HTTPStatus
+from pathlib import Path
+import pytest
+from pytest_mock.plugin import MockerFixture
+from ipset_http import UrlCache, UrlResponse, install_url_cache, read_url
+
+# pylint: disable=redefined-outer-name; (for pytest fixtures)
+
+URL = "http://www.example.com/zz-aggregated.zone"
+
+
+def test_fresh_entry_is_not_revalidated(tmp_path: Path, mocker: MockerFixture) -> None:
+    fetch = mocker.patch("ipset_http.fetch_url", return_value=UrlResponse(200, b"foo", None, None))
+    cache = UrlCache(str(tmp_path), ttl=3600)
+
+    assert cache.read(URL) == b"foo"
+    assert cache.read(URL) == b"foo"
+    assert fetch.call_count == 1
+
+
+def test_revalidation_headers(tmp_path: Path, mocker: MockerFixture) -> None:
+    fetch = mocker.patch(
+        "ipset_http.fetch_url",
+        return_value=UrlResponse(200, b"foo", '"abc"', "Wed, 21 Oct 2015 07:28:00 GMT"),
+    )
+    cache = UrlCache(str(tmp_path))
+    cache.read(URL)
+    fetch.return_value = UrlResponse(HTTPStatus.NOT_MODIFIED, b"", None, None)
+
+    assert cache.read(URL) == b"foo"
+    fetch.assert_called_with(URL, {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT",
+    })
+
+
+def test_changed_document(tmp_path: Path, mocker: MockerFixture) -> None:
+    fetch = mocker.patch("ipset_http.fetch_url", return_value=UrlResponse(200, b"foo", "1", None))
+    cache = UrlCache(str(tmp_path))
+    cache.read(URL)
+    fetch.return_value = UrlResponse(200, b"bar", "2", None)
+
+    assert cache.read(URL) == b"bar"
+
+
+def test_offline(tmp_path: Path, mocker: MockerFixture) -> None:
+    fetch = mocker.patch("ipset_http.fetch_url", return_value=UrlResponse(200, b"foo", None, None))
+    UrlCache(str(tmp_path)).read(URL)
+    offline_cache = UrlCache(str(tmp_path), offline=True)
+
+    assert offline_cache.read(URL) == b"foo"
+    assert fetch.call_count == 1
+    with pytest.raises(ValueError, match="offline"):
+        offline_cache.read(URL + ".missing")
+
+
+def test_not_found_is_cached(tmp_path: Path, mocker: MockerFixture) -> None:
+    mocker.patch(
+        "ipset_http.fetch_url",
+        side_effect=urllib.error.HTTPError(URL, 404, "Not Found", None, None),  # type: ignore
+    )
+    with pytest.raises(urllib.error.HTTPError):
+        UrlCache(str(tmp_path)).read(URL)
+
+    with pytest.raises(urllib.error.HTTPError) as http_error:
+        UrlCache(str(tmp_path), offline=True).read(URL)
+    assert http_error.value.code == HTTPStatus.NOT_FOUND
+
+
+def test_lru_eviction(tmp_path: Path, mocker: MockerFixture) -> None:
+    fetch = mocker.patch(
+        "ipset_http.fetch_url", return_value=UrlResponse(200, b"x" * 10, None, None)
+    )
+    cache = UrlCache(str(tmp_path), ttl=3600, max_size=25)
+    cache.read(URL + "1")
+    cache.read(URL + "2")
+    os.utime(cache.filename(URL + "1", "body"), (0, 0))
+    os.utime(cache.filename(URL + "2", "body"), (1, 1))
+    cache.read(URL + "1")
+    cache.read(URL + "3")
+
+    assert os.path.exists(cache.filename(URL + "1", "body"))
+    assert not os.path.exists(cache.filename(URL + "2", "body"))
+    assert os.path.exists(cache.filename(URL + "3", "body"))
+    assert fetch.call_count == 3
+
+
+def test_read_url_uses_installed_cache(tmp_path: Path, mocker: MockerFixture) -> None:
+    fetch = mocker.patch("ipset_http.fetch_url", return_value=UrlResponse(200, b"foo", None, None))
+    install_url_cache(UrlCache(str(tmp_path), ttl=3600))
+    try:
+        assert read_url(URL) == b"foo"
+        assert read_url(URL) == b"foo"
+    finally:
+        install_url_cache(None)
+    assert fetch.call_count == 1
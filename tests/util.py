@@ -1,4 +1,7 @@
+import ipaddress
 import os.path
+from typing import Iterable
+from ipset_intervals import Network
 
 
 def data_filename(filename: str) -> str:
@@ -7,3 +10,17 @@ def data_filename(filename: str) -> str:
 
 def read_test_file(filename: str) -> bytes:
     return open(data_filename(filename), "rb").read()
+
+
+def networks(*specs: str) -> list[Network]:
+    return [ipaddress.ip_network(spec) for spec in specs]
+
+
+def fake_ipdeny(country_code: str) -> Iterable[Network]:
+    if country_code == "xx":
+        raise ValueError("download failed")
+    return networks("1.0.0.0/24", "2.0.0.0/24", "3fff::/20")
+
+
+def fake_ripestat(_: str) -> Iterable[Network]:
+    return networks("1.0.0.0/24", "3fff::/20")